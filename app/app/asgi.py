@@ -13,4 +13,23 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once the apps are loaded
+from django.conf import settings  # noqa: E402
+from recipe.stream import change_stream  # noqa: E402
+
+if settings.WSGI_WARM_UP:
+    from core.warmup import warm_up
+
+    warm_up()
+
+
+async def application(scope, receive, send):
+    """Serve the change stream as a long-lived ASGI response, everything
+    else, like the probes, through Django; the API itself is served by
+    app.wsgi"""
+    if scope['type'] == 'http' and \
+            scope['path'] == settings.CHANGE_STREAM_PATH:
+        return await change_stream(scope, receive, send)
+    return await django_application(scope, receive, send)
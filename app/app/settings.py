@@ -53,7 +53,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.HealthCheckMiddleware',
+    'core.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -94,9 +97,30 @@ DATABASES = {
         'NAME': os.environ.get('DB_NAME', 'devdb'),
         'USER': os.environ.get('DB_USER', 'devuser'),
         'PASSWORD': os.environ.get('DB_PASSWORD', 'changeme'),
+        # Each server thread keeps its connection open between requests,
+        # see DB_MAX_CONNECTIONS in gunicorn.conf.py
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Shards holding the users' recipe data, see core.sharding. Users, and
+# the shard map, stay on the default database, which is a shard too.
+# DB_SHARDS adds aliases, e.g. "shard1,shard2": databases named
+# <DB_NAME>_<alias> on DB_HOST_<ALIAS> (default DB_HOST).
+for alias in filter(None, os.environ.get('DB_SHARDS', '').split(',')):
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': os.environ.get(f'DB_HOST_{alias.upper()}',
+                               DATABASES['default']['HOST']),
+        'NAME': f"{DATABASES['default']['NAME']}_{alias}",
+    }
+DATABASE_SHARDS = list(DATABASES)
+# Shards new users are spread over, by the hash of their email
+DATABASE_SHARDS_FOR_NEW_USERS = os.environ.get(
+    'DB_SHARDS_FOR_NEW_USERS', 'default').split(',')
+DATABASE_ROUTERS = ['core.sharding.ShardRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -117,6 +141,49 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing
+# The first hasher hashes new passwords, the others verify existing ones.
+# Passwords are rehashed with the first hasher and the current cost on the
+# next successful login.
+
+PASSWORD_HASHER_CHOICES = {
+    'argon2': 'core.hashers.TunableArgon2PasswordHasher',
+    'scrypt': 'core.hashers.TunableScryptPasswordHasher',
+    'pbkdf2': 'core.hashers.TunablePBKDF2PasswordHasher',
+}
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'pbkdf2')
+PASSWORD_HASHERS = [PASSWORD_HASHER_CHOICES[PASSWORD_HASHER]] + [
+    hasher for name, hasher in PASSWORD_HASHER_CHOICES.items()
+    if name != PASSWORD_HASHER
+]
+
+PASSWORD_HASH_PBKDF2_ITERATIONS = int(
+    os.environ.get('PASSWORD_HASH_PBKDF2_ITERATIONS', 600000)
+)
+PASSWORD_HASH_ARGON2_TIME_COST = int(
+    os.environ.get('PASSWORD_HASH_ARGON2_TIME_COST', 2)
+)
+PASSWORD_HASH_ARGON2_MEMORY_COST = int(  # KiB
+    os.environ.get('PASSWORD_HASH_ARGON2_MEMORY_COST', 102400)
+)
+PASSWORD_HASH_ARGON2_PARALLELISM = int(
+    os.environ.get('PASSWORD_HASH_ARGON2_PARALLELISM', 8)
+)
+PASSWORD_HASH_SCRYPT_WORK_FACTOR = int(
+    os.environ.get('PASSWORD_HASH_SCRYPT_WORK_FACTOR', 2 ** 14)
+)
+
+AUTHENTICATION_BACKENDS = ['core.backends.PooledModelBackend']
+
+# Password checks run in a pool of this many processes, 0 checks them in
+# the request thread. Checks waiting for a free process beyond the pool's
+# queue limit fall back to the request thread.
+PASSWORD_HASH_POOL_SIZE = int(os.environ.get('PASSWORD_HASH_POOL_SIZE', 0))
+PASSWORD_HASH_POOL_QUEUE = int(
+    os.environ.get('PASSWORD_HASH_POOL_QUEUE', 64)
+)
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
@@ -147,9 +214,173 @@ AUTH_USER_MODEL = 'core.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'DEFAULT_THROTTLE_CLASSES': [
+        'core.throttling.ReadRateThrottle',
+        'core.throttling.WriteRateThrottle',
+    ],
+    # Requests per user (or client address for anonymous requests) and
+    # endpoint. Counters live in the default cache, configure a shared
+    # cache (CACHE_BACKEND) so the budgets hold across server processes.
+    'DEFAULT_THROTTLE_RATES': {
+        'read': os.environ.get('THROTTLE_RATE_READ', '600/min'),
+        'write': os.environ.get('THROTTLE_RATE_WRITE', '120/min'),
+        'upload': os.environ.get('THROTTLE_RATE_UPLOAD', '30/hour'),
+        'login': os.environ.get('THROTTLE_RATE_LOGIN', '20/min'),
+        'signup': os.environ.get('THROTTLE_RATE_SIGNUP', '20/hour'),
+    },
 }
 
 SPECTACULAR_SETTINGS = {
     # Enable image upload through browsable interface
     'COMPONENT_SPLIT_REQUEST': True
 }
+
+# Directory the build_schema command writes the schema to. When empty, or
+# the files are missing, each process generates the schema on first use.
+SCHEMA_CACHE_DIR = os.environ.get('SCHEMA_CACHE_DIR', '')
+# Seconds clients may cache the schema and API docs page
+SCHEMA_CACHE_MAX_AGE = 5 * 60
+
+# Tag/ingredient name autocomplete
+AUTOCOMPLETE_DEFAULT_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 50
+# Users cached per worker process and how long a cached index is trusted
+AUTOCOMPLETE_CACHE_SIZE = int(os.environ.get('AUTOCOMPLETE_CACHE_SIZE', 1024))
+AUTOCOMPLETE_CACHE_TTL = int(os.environ.get('AUTOCOMPLETE_CACHE_TTL', 60))
+# Larger vocabularies are searched through the database index instead
+AUTOCOMPLETE_INDEX_MAX_SIZE = 5000
+
+# Most recipes the recipe batch endpoint returns per request
+RECIPE_BATCH_MAX_IDS = 100
+
+# Most requests per call to the batch endpoint (core.batch), and threads
+# shared by all batches running their consecutive reads concurrently,
+# each keeping a database connection open (counted in gunicorn.conf.py),
+# 0 runs them in turn on the request's database connection
+BATCH_MAX_REQUESTS = 20
+BATCH_READ_WORKERS = int(os.environ.get('BATCH_READ_WORKERS', 0))
+
+# Resized recipe image renditions served by the recipe image endpoint
+IMAGE_RENDITION_ROOT = os.environ.get('IMAGE_RENDITION_ROOT',
+                                      '/vol/web/renditions')
+IMAGE_RENDITION_WIDTHS = [160, 320, 640, 1280]
+IMAGE_RENDITION_CACHE_MAX_BYTES = int(
+    os.environ.get('IMAGE_RENDITION_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+)
+IMAGE_RENDITION_MAX_AGE = 60 * 60 * 24
+# Recipe image files younger than this are never deleted as orphans, this
+# protects files a concurrent upload of the same content is about to use
+IMAGE_ORPHAN_GRACE_SECONDS = 60
+
+# Limits enforced while recipe images are uploaded
+RECIPE_IMAGE_MAX_BYTES = int(
+    os.environ.get('RECIPE_IMAGE_MAX_BYTES', 10 * 1024 * 1024)
+)
+RECIPE_IMAGE_MAX_PIXELS = 40_000_000
+
+# API tokens
+AUTH_TOKEN_TTL = int(os.environ.get('AUTH_TOKEN_TTL', 60 * 60 * 24 * 30))
+# last_used is written at most once per interval (seconds) per token
+AUTH_TOKEN_LAST_USED_INTERVAL = 5 * 60
+# Authenticated tokens are cached for this long (seconds). Revocation
+# clears the cache, with the default per-process cache other workers may
+# still accept a revoked token for up to this long
+AUTH_TOKEN_CACHE_TTL = int(os.environ.get('AUTH_TOKEN_CACHE_TTL', 60))
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+# Response compression, see core.middleware.CompressionMiddleware
+# Encodings in order of preference, unavailable ones are skipped
+RESPONSE_COMPRESSION_ENCODINGS = ['zstd', 'br', 'gzip']
+# Levels chosen for JSON throughput, see the bench_compression command
+RESPONSE_COMPRESSION_LEVELS = {'zstd': 3, 'br': 4, 'gzip': 6}
+# Responses smaller than this (bytes) are not worth compressing
+RESPONSE_COMPRESSION_MIN_SIZE = int(
+    os.environ.get('RESPONSE_COMPRESSION_MIN_SIZE', 1024)
+)
+# Besides text/*, */*+json and */*+xml
+RESPONSE_COMPRESSION_TYPES = [
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'application/vnd.oai.openapi',
+]
+
+# Delta sync (recipe changes endpoint)
+SYNC_PAGE_SIZE = 500
+# Tombstones of deleted objects are kept this long, clients that have not
+# synced for longer must sync from scratch
+SYNC_TOMBSTONE_RETENTION_DAYS = int(
+    os.environ.get('SYNC_TOMBSTONE_RETENTION_DAYS', 90)
+)
+
+# Admin changelists show the planner's row estimate instead of counting
+# when it is at least this large (Postgres only)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 100_000
+
+# Build URL resolvers, serializers and the schema when app.wsgi or
+# app.asgi is loaded, before a preloading server forks its workers, see
+# core.warmup
+WSGI_WARM_UP = os.environ.get('WSGI_WARM_UP', '1') == '1'
+
+# Probe endpoints answered by core.middleware.HealthCheckMiddleware
+HEALTH_CHECK_PATH = '/health/'
+READINESS_CHECK_PATH = '/ready/'
+# Seconds a readiness result (database reachable) is reused
+READINESS_CHECK_INTERVAL = 10
+
+# Prometheus metrics answered by core.middleware.MetricsMiddleware, scrapes
+# must send `Authorization: Bearer <METRICS_TOKEN>`, without a token set
+# the metrics are only answered with DEBUG on
+METRICS_PATH = '/metrics'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Directory where each server process writes its metrics for the others
+# to aggregate, empty for a single process
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+# Seconds between writes of a process' metrics to METRICS_DIR
+METRICS_FLUSH_INTERVAL = 5
+
+# Account deletions, see core.deletion: rows deleted per transaction and
+# seconds without progress before another worker takes a deletion over
+ACCOUNT_DELETION_BATCH_SIZE = int(
+    os.environ.get('ACCOUNT_DELETION_BATCH_SIZE', 1000)
+)
+ACCOUNT_DELETION_LEASE_SECONDS = 5 * 60
+
+# Seconds a response stored for an Idempotency-Key is replayed to retries
+# (purged by `manage.py purge_idempotency_keys`), and seconds the lock of
+# a key in use is held at most outside Postgres, see core.idempotency
+IDEMPOTENCY_KEY_TTL = int(
+    os.environ.get('IDEMPOTENCY_KEY_TTL', 60 * 60 * 24)
+)
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+
+# Webhook delivery of the outbox events (`manage.py deliver_webhooks`, see
+# core.webhooks): events per request, connections (and posting threads)
+# per host, request timeout, and the retries, backing off from
+# WEBHOOK_RETRY_DELAY seconds doubling up to WEBHOOK_RETRY_MAX_DELAY
+WEBHOOK_BATCH_SIZE = 100
+WEBHOOK_POOL_SIZE = int(os.environ.get('WEBHOOK_POOL_SIZE', 8))
+WEBHOOK_TIMEOUT = 10
+WEBHOOK_MAX_ATTEMPTS = 12
+WEBHOOK_RETRY_DELAY = 30
+WEBHOOK_RETRY_MAX_DELAY = 6 * 60 * 60
+
+# Server-sent events stream of recipe changes, served by app.asgi (which
+# scripts/run.sh serves with SERVER_ROLE=stream) outside Django's URL
+# routing (see recipe.stream): its path, seconds between keep-alive
+# comments of an idle stream, and whether changes notify the streams at
+# all (a NOTIFY per changing transaction on Postgres)
+CHANGE_STREAM_PATH = '/api/recipe/changes/stream/'
+CHANGE_STREAM_HEARTBEAT = 15
+CHANGE_STREAM_NOTIFY = os.environ.get('CHANGE_STREAM_NOTIFY', '1') == '1'
+# Threads, and so database connections, the streams of one process query
+# in; as many as gunicorn.conf.py gives a gthread worker
+CHANGE_STREAM_DB_THREADS = int(os.environ.get('GUNICORN_THREADS', 4))
@@ -0,0 +1,39 @@
+"""
+Settings for API-only server processes.
+
+Token authenticated API requests never use the admin, sessions, messages,
+CSRF protection, static files or the browsable API, so these processes
+neither import nor run them. Select with
+DJANGO_SETTINGS_MODULE=app.settings_api, management commands use
+app.settings. CI runs the tests under both.
+"""
+from app.settings import *  # noqa: F401,F403
+from app.settings import INSTALLED_APPS, MIDDLEWARE, REST_FRAMEWORK
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in [
+    'django.contrib.admin',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    'drf_spectacular',
+]]
+
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE if middleware not in [
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]]
+
+TEMPLATES = []
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'core.authentication.ExpiringTokenAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+    ],
+}
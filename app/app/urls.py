@@ -14,21 +14,38 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
 from django.urls import path, include
 from django.conf.urls.static import static
 from django.conf import settings
+from django.views.decorators.cache import cache_page
 
-from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
+from core.batch import BatchView
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
-    path('api/schema/', SpectacularAPIView.as_view(), name='api-schema'),
-    path('api/docs/', SpectacularSwaggerView.as_view(url_name='api-schema'), name='api-docs'),
     path('api/user/', include('user.urls')),
     path('api/recipe/', include('recipe.urls')),
+    path('api/batch/', BatchView.as_view(), name='api-batch'),
 ]
 
+# Left out of the API-only settings profile (app.settings_api), which
+# does not import them either
+if 'django.contrib.admin' in settings.INSTALLED_APPS:
+    from django.contrib import admin
+
+    urlpatterns.append(path('admin/', admin.site.urls))
+
+if 'drf_spectacular' in settings.INSTALLED_APPS:
+    from drf_spectacular.views import SpectacularSwaggerView
+
+    from core.schema import CachedSchemaView
+
+    urlpatterns += [
+        path('api/schema/', CachedSchemaView.as_view(), name='api-schema'),
+        path('api/docs/', cache_page(settings.SCHEMA_CACHE_MAX_AGE)(
+            SpectacularSwaggerView.as_view(url_name='api-schema')
+        ), name='api-docs'),
+    ]
+
 if settings.DEBUG:
     urlpatterns += static(
         settings.MEDIA_URL,
@@ -1,20 +1,137 @@
 """
 Django admin customization
 """
+import json
 
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.auth import get_user_model
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.db.models.lookups import StartsWith
+from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 
 from core import models
+from core.sharding import SHARDED_MODELS, use_shard
 
 
-class UserAdmin(BaseUserAdmin):
+class EstimatedCountPaginator(Paginator):
+    """Paginator taking the row count of large tables from the Postgres
+    planner's estimate instead of running COUNT(*)
+
+    Counts estimated below ADMIN_ESTIMATED_COUNT_THRESHOLD, and all counts
+    on other databases, are exact.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql':
+            estimate = self._estimate(queryset, connection)
+            if estimate >= settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
+    def _estimate(self, queryset, connection):
+        if not queryset.query.where:
+            # Table statistics kept up to date by (auto)vacuum and analyze,
+            # -1 if the table has never been analyzed.
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class '
+                    'WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            return row[0] if row else -1
+        plan = json.loads(queryset.explain(format='json'))
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class PrefixSearchMixin:
+    """Search `search_fields` by case-insensitive prefix
+
+    The lookups are lower(<field>) LIKE 'term%', which the
+    lower(<field>) varchar_pattern_ops indexes serve on Postgres, instead
+    of the unindexable UPPER(<field>) LIKE '%term%' of the default search.
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip().lower()
+        if not term:
+            return queryset, False
+        query = Q()
+        for field in self.search_fields:
+            query |= Q(StartsWith(Lower(field), term))
+        return queryset.filter(query), False
+
+
+class LargeTableAdmin(PrefixSearchMixin, admin.ModelAdmin):
+    """Admin for tables too large to count or list in a dropdown"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    autocomplete_fields = ['user']
+    list_select_related = ['user']
+
+
+class ShardListFilter(admin.SimpleListFilter):
+    """Changelist filter picking the shard listed, the default database
+    unless another one is picked"""
+    title = _('shard')
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in settings.DATABASE_SHARDS]
+
+    def has_output(self):
+        return len(self.lookup_choices) > 1
+
+    def value(self):
+        return super().value() or DEFAULT_DB_ALIAS
+
+    def queryset(self, request, queryset):
+        # ShardedModelAdmin already reads from the shard
+        return queryset
+
+    def choices(self, changelist):
+        # No "All", a list covers one shard
+        return list(super().choices(changelist))[1:]
+
+
+class ShardAdminMixin:
+    """Read the objects of a ModelAdmin or inline, and the sharded objects
+    their fields refer to, from the shard its view runs on"""
+
+    def get_shard(self, request):
+        return getattr(request, '_admin_shard', DEFAULT_DB_ALIAS)
+
+    def get_queryset(self, request):
+        # Pinned, as the changelist and forms are read when rendered,
+        # after the view left the shard
+        return super().get_queryset(request).using(self.get_shard(request))
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.related_model._meta.label_lower in SHARDED_MODELS:
+            kwargs.setdefault('using', self.get_shard(request))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+
+class UserAdmin(PrefixSearchMixin, BaseUserAdmin):
     """Define admin for custom User model with no email field."""
 
     # Define fields for user list page
     ordering = ['id']
     list_display = ['email', 'name', 'is_superuser']
+    search_fields = ['email']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['deactivate']
 
     # Define fields for edit user page
     fieldsets = (
@@ -45,8 +162,156 @@ class UserAdmin(BaseUserAdmin):
          ),
     )
 
+    @admin.action(description=_('Deactivate selected users and revoke '
+                                'their API tokens'))
+    def deactivate(self, request, queryset):
+        """Deactivate the users in one update and revoke their tokens on
+        every shard"""
+        user_ids = list(queryset.values_list('pk', flat=True))
+        updated = queryset.update(is_active=False)
+        for alias in settings.DATABASE_SHARDS:
+            models.AuthToken.objects.db_manager(alias).revoke(
+                user_id__in=user_ids)
+        self.message_user(request, f'Deactivated {updated} users.')
+
+
+class ShardedModelAdmin(ShardAdminMixin, LargeTableAdmin):
+    """Admin for the per-user models, see core.sharding
+
+    Each view runs on one shard: the changelist, and so its actions, on
+    the one picked with ShardListFilter; the other views on the shard
+    holding the object, ids being unique across shards, or for a new
+    object on its user's shard.
+    """
+    list_filter = [ShardListFilter]
+    # The users are on the default database, not joinable on the others
+    list_select_related = ()
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('user')
+
+    def changelist_view(self, request, extra_context=None):
+        alias = request.GET.get(ShardListFilter.parameter_name)
+        return self._on_shard(request, alias, super().changelist_view,
+                              request, extra_context)
+
+    def add_view(self, request, form_url='', extra_context=None):
+        alias = None
+        user_id = request.POST.get('user', '')
+        if user_id.isdigit():
+            alias = get_user_model().objects.filter(
+                pk=user_id).values_list('shard', flat=True).first()
+        return self._on_shard(request, alias, super().add_view, request,
+                              form_url, extra_context)
+
+    def change_view(self, request, object_id, form_url='',
+                    extra_context=None):
+        return self._on_shard(request, self._shard_of(object_id),
+                              super().change_view, request, object_id,
+                              form_url, extra_context)
+
+    def delete_view(self, request, object_id, extra_context=None):
+        return self._on_shard(request, self._shard_of(object_id),
+                              super().delete_view, request, object_id,
+                              extra_context)
+
+    def history_view(self, request, object_id, extra_context=None):
+        return self._on_shard(request, self._shard_of(object_id),
+                              super().history_view, request, object_id,
+                              extra_context)
+
+    def _shard_of(self, object_id):
+        """Return the shard holding the object with pk `object_id`"""
+        for alias in settings.DATABASE_SHARDS:
+            try:
+                if self.model._base_manager.using(alias).filter(
+                        pk=object_id).exists():
+                    return alias
+            except (ValueError, ValidationError):
+                return None
+        return None
+
+    def _on_shard(self, request, alias, view, *args):
+        if alias not in settings.DATABASE_SHARDS:
+            alias = DEFAULT_DB_ALIAS
+        request._admin_shard = alias
+        with use_shard(alias):
+            return view(*args)
+
+
+class RecipeTagInline(ShardAdminMixin, admin.TabularInline):
+    """Tags of a recipe, picked by id"""
+    model = models.RecipeTag
+    fields = ['tag']
+    raw_id_fields = ['tag']
+    extra = 0
+
+
+class RecipeIngredientInline(ShardAdminMixin, admin.TabularInline):
+    """Ingredients of a recipe, picked by id"""
+    model = models.RecipeIngredient
+    fields = ['ingredient']
+    raw_id_fields = ['ingredient']
+    extra = 0
+
+
+class RecipeAdmin(ShardedModelAdmin):
+    """Admin for recipes"""
+    list_display = ['title', 'user', 'price', 'time_minutes', 'updated_at']
+    search_fields = ['title']
+    inlines = [RecipeTagInline, RecipeIngredientInline]
+    actions = ['remove_images']
+
+    def save_model(self, request, obj, form, change):
+        # The event is queued with the links, see save_related()
+        obj.save(event=False)
+
+    def save_formset(self, request, form, formset, change):
+        for link in formset.save(commit=False):
+            link.user_id = form.instance.user_id
+            link.save()
+        for link in formset.deleted_objects:
+            link.delete()
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        models.record_events([form.instance],
+                             'updated' if change else 'created',
+                             form.instance._state.db)
+
+    @admin.action(description=_('Remove images of selected recipes'))
+    def remove_images(self, request, queryset):
+        """Clear the images in batched updates and release the files"""
+        with_image = queryset.exclude(image='').exclude(image__isnull=True)
+        names = set(with_image.values_list('image', flat=True))
+        updated = with_image.update_versioned(image=None)
+        for name in names:
+            models.release_recipe_image(name)
+        self.message_user(request, f'Removed the images of {updated} '
+                                   f'recipes.')
+
+
+class NamedObjectAdmin(ShardedModelAdmin):
+    """Admin for tags and ingredients"""
+    list_display = ['name', 'user', 'updated_at']
+    search_fields = ['name']
+    actions = ['detach_from_recipes']
+
+    @admin.action(description=_('Remove selected items from all recipes'))
+    def detach_from_recipes(self, request, queryset):
+        """Delete the recipe links in one query and give the recipes that
+        had them new versions"""
+        rel = self.model._meta.get_field('recipe')
+        through = rel.through.objects.filter(
+            **{f'{rel.field.m2m_reverse_field_name()}__in': queryset})
+        recipe_ids = set(through.values_list('recipe_id', flat=True))
+        deleted = through.delete()[0]
+        models.Recipe.objects.filter(pk__in=recipe_ids).update_versioned()
+        self.message_user(request, f'Removed {deleted} recipe links.')
+
 
 admin.site.register(models.User, UserAdmin)
-admin.site.register(models.Recipe)
-admin.site.register(models.Tag)
-admin.site.register(models.Ingredient)
+admin.site.register(models.Recipe, RecipeAdmin)
+admin.site.register(models.Tag, NamedObjectAdmin)
+admin.site.register(models.Ingredient, NamedObjectAdmin)
+admin.site.register(models.Webhook)
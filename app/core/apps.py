@@ -1,6 +1,61 @@
 from django.apps import AppConfig
+from django.core.signals import request_finished, request_started
+from django.db.backends.signals import connection_created
+from django.db.models.signals import (m2m_changed,
+                                      post_delete,
+                                      post_migrate,
+                                      post_save,
+                                      pre_delete,
+                                      pre_migrate)
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        """Release recipe image files that are no longer referenced, keep
+        the token authentication cache and delta sync in sync, queue
+        webhook events, collect database metrics, route queries to the
+        user's shard and give each shard its own id range"""
+        from core.models import (AuthToken,
+                                 Ingredient,
+                                 Recipe,
+                                 Tag,
+                                 User,
+                                 record_deleted_event,
+                                 record_saved_event,
+                                 record_tombstone,
+                                 release_replaced_recipe_image,
+                                 release_deleted_recipe_image,
+                                 touch_changed_recipes)
+        from core.authentication import (forget_user_tokens,
+                                         forget_deleted_token)
+        from core.metrics import (count_open_connections,
+                                  instrument_connection)
+        from core.sharding import (delete_sharded_user_data,
+                                   end_migration,
+                                   reserve_ids,
+                                   reset_shard,
+                                   start_migration)
+
+        post_save.connect(release_replaced_recipe_image, sender=Recipe)
+        post_delete.connect(release_deleted_recipe_image, sender=Recipe)
+        post_save.connect(forget_user_tokens, sender=User)
+        post_delete.connect(forget_deleted_token, sender=AuthToken)
+        for model in (Recipe, Tag, Ingredient):
+            post_delete.connect(record_tombstone, sender=model)
+            post_save.connect(record_saved_event, sender=model)
+            post_delete.connect(record_deleted_event, sender=model)
+        m2m_changed.connect(touch_changed_recipes,
+                            sender=Recipe.tags.through)
+        m2m_changed.connect(touch_changed_recipes,
+                            sender=Recipe.ingredients.through)
+        connection_created.connect(instrument_connection)
+        request_finished.connect(count_open_connections)
+        request_started.connect(reset_shard)
+        request_finished.connect(reset_shard)
+        pre_delete.connect(delete_sharded_user_data, sender=User)
+        pre_migrate.connect(start_migration, sender=self)
+        post_migrate.connect(end_migration, sender=self)
+        post_migrate.connect(reserve_ids, sender=self)
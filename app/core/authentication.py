@@ -0,0 +1,129 @@
+"""
+Token authentication with expiry, cached lookups and throttled last_used
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from core.metrics import CACHE_REQUESTS
+from core.models import AuthToken
+from core.sharding import activate_shard
+
+
+# User fields kept in the token cache, the others (the password hash above
+# all) are deferred and loaded from the database if a request uses them
+CACHED_USER_FIELDS = {'id', 'email', 'name', 'is_active', 'is_staff',
+                      'is_superuser', 'shard'}
+
+
+def token_cache_key(key):
+    return f'auth-token:v2:{key}'
+
+
+def cache_token(token):
+    """Cache the token's fields and CACHED_USER_FIELDS of its user"""
+    cache.set(token_cache_key(token.key), (
+        token._state.db,
+        [getattr(token, field.attname)
+         for field in AuthToken._meta.concrete_fields],
+        {name: getattr(token.user, name) for name in CACHED_USER_FIELDS},
+    ), settings.AUTH_TOKEN_CACHE_TTL)
+
+
+def cached_token(key):
+    """Return the cached token of `key` with its partly loaded user, None
+    if it is not cached"""
+    entry = cache.get(token_cache_key(key))
+    if entry is None:
+        return None
+    alias, token_values, user_values = entry
+    token = AuthToken.from_db(
+        alias, [field.attname for field in AuthToken._meta.concrete_fields],
+        token_values)
+    user_model = get_user_model()
+    # from_db() takes the values in the order of the model's fields
+    names = [field.attname for field in user_model._meta.concrete_fields
+             if field.attname in user_values]
+    token.user = user_model.from_db(DEFAULT_DB_ALIAS, names,
+                                    [user_values[name] for name in names])
+    return token
+
+
+def forget_tokens(keys):
+    """Drop tokens from the authentication cache"""
+    cache.delete_many([token_cache_key(key) for key in keys])
+
+
+class ExpiringTokenAuthentication(TokenAuthentication):
+    """Authenticate `Authorization: Token <key>` headers with AuthToken
+
+    Authenticated tokens (with their user's CACHED_USER_FIELDS) are cached
+    for AUTH_TOKEN_CACHE_TTL seconds so most requests need no query, and
+    last_used is only written once per AUTH_TOKEN_LAST_USED_INTERVAL.
+    The user's shard becomes the current shard of the request.
+    """
+    model = AuthToken
+
+    def authenticate_credentials(self, key):
+        token = cached_token(key)
+        CACHE_REQUESTS.inc(cache='auth_token',
+                           result='miss' if token is None else 'hit')
+        if token is None:
+            token = self._find(key)
+            cache_token(token)
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.'))
+        if token.is_expired:
+            raise exceptions.AuthenticationFailed(_('Token has expired.'))
+
+        activate_shard(token.user.shard)
+        self._touch(token)
+        return (token.user, token)
+
+    def _find(self, key):
+        """Look the token up on the shard of the user whose id prefixes
+        the key, keys without one are on the default database"""
+        alias = DEFAULT_DB_ALIAS
+        user_id = key.split('.', 1)[0]
+        if user_id != key and user_id.isdigit() and \
+                len(settings.DATABASE_SHARDS) > 1:
+            alias = get_user_model().objects.filter(
+                pk=user_id).values_list('shard', flat=True).first()
+        tokens = self.model.objects.using(alias or DEFAULT_DB_ALIAS)
+        if alias == DEFAULT_DB_ALIAS:
+            # Users are on the default database only
+            tokens = tokens.select_related('user')
+        try:
+            return tokens.get(key=key)
+        except self.model.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+    def _touch(self, token):
+        """Record the token use if the last record is old enough"""
+        now = timezone.now()
+        interval = timedelta(seconds=settings.AUTH_TOKEN_LAST_USED_INTERVAL)
+        if token.last_used is None or token.last_used + interval <= now:
+            self.model.objects.filter(key=token.key).update(last_used=now)
+            token.last_used = now
+            cache_token(token)
+
+
+def forget_user_tokens(sender, instance, **kwargs):
+    """post_save receiver dropping cached tokens holding a stale user"""
+    forget_tokens(AuthToken.objects.using(instance.shard).filter(
+        user_id=instance.pk).values_list('key', flat=True))
+
+
+def forget_deleted_token(sender, instance, **kwargs):
+    """post_delete receiver dropping a revoked token from the cache"""
+    forget_tokens([instance.key])
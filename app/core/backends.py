@@ -0,0 +1,119 @@
+"""
+Authentication backend hashing passwords in a process pool
+"""
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import (check_password,
+                                         get_hasher,
+                                         identify_hasher,
+                                         make_password)
+
+from core.metrics import LOGIN_DURATION, PASSWORD_HASHES_IN_PROGRESS
+
+
+_pool = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """Return the process pool and its queue slots, created on first use
+    so each forked server worker gets its own pool."""
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is None:
+            size = settings.PASSWORD_HASH_POOL_SIZE
+            _pool = ProcessPoolExecutor(
+                max_workers=size,
+                # Forking a threaded server process is unsafe.
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _pool_slots = threading.BoundedSemaphore(
+                size + settings.PASSWORD_HASH_POOL_QUEUE
+            )
+        return _pool, _pool_slots
+
+
+def _discard_pool(pool):
+    """Drop a broken pool, the next hash starts a new one"""
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is pool:
+            _pool = _pool_slots = None
+    pool.shutdown(wait=False)
+
+
+def run_hasher(func, *args):
+    """Run the password hashing function `func`
+
+    With PASSWORD_HASH_POOL_SIZE set it runs in a separate process, so the
+    hashing CPU time is not spent in the server worker and the worker's
+    other threads keep serving requests. When the pool is saturated, or
+    broken by a process that died, it runs in the calling thread instead.
+    """
+    with PASSWORD_HASHES_IN_PROGRESS.track_inprogress():
+        if settings.PASSWORD_HASH_POOL_SIZE > 0:
+            pool, slots = _get_pool()
+            if slots.acquire(blocking=False):
+                try:
+                    return pool.submit(func, *args).result()
+                except BrokenProcessPool:
+                    _discard_pool(pool)
+                finally:
+                    slots.release()
+        return func(*args)
+
+
+def needs_rehash(encoded):
+    """Return True if `encoded` was not made by the preferred hasher with
+    its current cost"""
+    preferred = get_hasher()
+    return (identify_hasher(encoded).algorithm != preferred.algorithm or
+            preferred.must_update(encoded))
+
+
+class PooledModelBackend(ModelBackend):
+    """ModelBackend hashing passwords with `run_hasher`
+
+    Like ModelBackend, hashes made with another hasher or an outdated cost
+    are upgraded on successful login.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        start = time.perf_counter()
+        user = self._authenticate(username, password, **kwargs)
+        if password is not None:
+            LOGIN_DURATION.observe(
+                time.perf_counter() - start,
+                result='success' if user is not None else 'failure')
+        return user
+
+    def _authenticate(self, username, password, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # Hash once anyway to keep the response time of unknown users
+            # close to the one of known users.
+            run_hasher(make_password, password)
+            return None
+
+        if not run_hasher(check_password, password, user.password):
+            return None
+        if needs_rehash(user.password):
+            user.password = run_hasher(make_password, password)
+            user.save(update_fields=['password'])
+        if self.user_can_authenticate(user):
+            return user
+        return None
@@ -0,0 +1,170 @@
+"""
+Batch endpoint running several API requests in one HTTP call
+"""
+import contextvars
+import io
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import close_old_connections
+from django.urls import Resolver404, resolve
+from drf_spectacular.utils import extend_schema, OpenApiTypes
+from rest_framework import permissions, serializers, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from core.authentication import ExpiringTokenAuthentication
+
+
+# URL namespaces a batch may call into
+BATCH_NAMESPACES = ['user', 'recipe']
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Return the threads running the reads of all batches, created on
+    first use so each forked server worker gets its own."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.BATCH_READ_WORKERS,
+                thread_name_prefix='batch-read')
+        return _executor
+
+
+class SubRequestSerializer(serializers.Serializer):
+    """One request of a batch"""
+    method = serializers.ChoiceField(
+        choices=['GET', 'POST', 'PUT', 'PATCH', 'DELETE'])
+    path = serializers.CharField()
+    body = serializers.JSONField(required=False)
+
+
+class BatchSerializer(serializers.Serializer):
+    """Requests of a batch, run in order"""
+    requests = serializers.ListField(
+        child=SubRequestSerializer(), min_length=1,
+        max_length=settings.BATCH_MAX_REQUESTS)
+
+
+def _call(request, method, path, body=None):
+    """Run one API request as the user of `request` and return its
+    status and data"""
+    url = urlsplit(path)
+    try:
+        match = resolve(url.path)
+    except Resolver404:
+        match = None
+    if match is None or match.namespace not in BATCH_NAMESPACES:
+        return {'status': status.HTTP_404_NOT_FOUND,
+                'data': {'detail': 'Not found.'}}
+
+    payload = b'' if body is None else json.dumps(body).encode()
+    meta = {name: value for name, value in request.META.items()
+            # Meant for the batch, not each of its requests
+            if name != 'HTTP_IDEMPOTENCY_KEY'}
+    sub_request = WSGIRequest({
+        **meta,
+        'REQUEST_METHOD': method,
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(payload)),
+        'wsgi.input': io.BytesIO(payload),
+    })
+    # DRF authenticates requests carrying these with them, the token was
+    # checked once for the whole batch.
+    sub_request._force_auth_user = request.user
+    sub_request._force_auth_token = request.auth
+    response = match.func(sub_request, *match.args, **match.kwargs)
+    try:
+        return {'status': response.status_code,
+                'data': getattr(response, 'data', None)}
+    finally:
+        _close(response)
+
+
+def _close(response):
+    """Close what `response` would have streamed, such as the file of an
+    image FileResponse
+
+    Not response.close(), which also sends request_finished and so would
+    close the batch request's database connections.
+    """
+    for closer in response._resource_closers:
+        closer()
+    response._resource_closers.clear()
+
+
+def _call_in_thread(request, path):
+    """Run a GET in a pool thread, which keeps its connections between
+    requests as server threads do, checked as at a request's start and
+    end"""
+    close_old_connections()
+    try:
+        return _call(request, 'GET', path)
+    finally:
+        close_old_connections()
+
+
+class BatchView(APIView):
+    """Run up to BATCH_MAX_REQUESTS user and recipe API requests
+
+    The token is authenticated once for all of them. Requests run in
+    order on the request's database connection, a batch asking for the
+    same GET twice runs it once. With BATCH_READ_WORKERS set, consecutive
+    GETs run concurrently in a pool of that many threads shared by all
+    batches, each thread with its own persistent connection.
+    """
+    authentication_classes = [ExpiringTokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    @extend_schema(request=BatchSerializer,
+                   responses={200: OpenApiTypes.OBJECT})
+    def post(self, request):
+        """Return the status and data of each request, in order"""
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data['requests']
+
+        results = [None] * len(items)
+        reads = {}
+        for index, item in enumerate(items):
+            if item['method'] == 'GET':
+                reads.setdefault(item['path'], []).append(index)
+                continue
+            # A write may change what the reads before it return.
+            self._read(request, reads, results)
+            reads = {}
+            results[index] = _call(request, item['method'], item['path'],
+                                   item.get('body'))
+        self._read(request, reads, results)
+        return Response({'responses': results})
+
+    def _read(self, request, reads, results):
+        """Run the GETs of `reads`, a dict of paths to the indexes of the
+        requests asking for them"""
+        workers = min(settings.BATCH_READ_WORKERS, len(reads))
+        if workers > 1:
+            executor = _get_executor()
+            # The current shard goes along with a copy of the context.
+            futures = {
+                path: executor.submit(contextvars.copy_context().run,
+                                      _call_in_thread, request, path)
+                for path in reads
+            }
+            responses = {path: future.result()
+                         for path, future in futures.items()}
+        else:
+            responses = {path: _call(request, 'GET', path)
+                         for path in reads}
+        for path, indexes in reads.items():
+            for index in indexes:
+                results[index] = responses[path]
@@ -0,0 +1,130 @@
+"""
+Response body compressors and Accept-Encoding negotiation
+"""
+import zlib
+
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+
+class GzipCompressor:
+    """gzip, level 1-9"""
+    encoding = 'gzip'
+    levels = range(1, 10)
+
+    def __init__(self, level):
+        self.level = level
+
+    def _compressobj(self):
+        # wbits 31 writes the gzip header and trailer.
+        return zlib.compressobj(self.level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        compressor = self._compressobj()
+        return compressor.compress(data) + compressor.flush()
+
+    def stream(self):
+        """Return (compress_chunk, finish) for incremental compression,
+        each compressed chunk is flushed so it can be sent right away"""
+        compressor = self._compressobj()
+
+        def compress_chunk(chunk):
+            return (compressor.compress(chunk) +
+                    compressor.flush(zlib.Z_SYNC_FLUSH))
+
+        return compress_chunk, compressor.flush
+
+
+class BrotliCompressor(GzipCompressor):
+    """brotli, quality 0-11"""
+    encoding = 'br'
+    levels = range(0, 12)
+
+    def compress(self, data):
+        return brotli.compress(data, quality=self.level)
+
+    def stream(self):
+        compressor = brotli.Compressor(quality=self.level)
+
+        def compress_chunk(chunk):
+            return compressor.process(chunk) + compressor.flush()
+
+        return compress_chunk, compressor.finish
+
+
+class ZstdCompressor(GzipCompressor):
+    """zstd, level 1-22"""
+    encoding = 'zstd'
+    levels = range(1, 23)
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def stream(self):
+        compressor = zstandard.ZstdCompressor(
+            level=self.level).compressobj()
+
+        def compress_chunk(chunk):
+            return (compressor.compress(chunk) +
+                    compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK))
+
+        return compress_chunk, compressor.flush
+
+
+# Compressors usable in this environment by encoding
+COMPRESSORS = {
+    compressor.encoding: compressor
+    for compressor, module in ((ZstdCompressor, zstandard),
+                               (BrotliCompressor, brotli),
+                               (GzipCompressor, zlib))
+    if module is not None
+}
+
+
+def parse_accept_encoding(header):
+    """Return {coding: q} from an Accept-Encoding header"""
+    codings = {}
+    for item in header.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[coding] = q
+    return codings
+
+
+def negotiate(header):
+    """Return the compressor for the best encoding the client accepts
+
+    The client's q-values decide, ties go to the first encoding in
+    RESPONSE_COMPRESSION_ENCODINGS. Returns None when no usable encoding
+    is acceptable.
+    """
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get('*', 0.0)
+    best, best_q = None, 0.0
+    for encoding in settings.RESPONSE_COMPRESSION_ENCODINGS:
+        q = accepted.get(encoding, wildcard)
+        if encoding in COMPRESSORS and q > best_q:
+            best, best_q = encoding, q
+    if best is None:
+        return None
+    level = settings.RESPONSE_COMPRESSION_LEVELS[best]
+    return COMPRESSORS[best](level)
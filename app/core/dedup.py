@@ -0,0 +1,87 @@
+"""
+Merging of per-user tags/ingredients that share a normalized name
+"""
+from django.db import models, router, transaction
+from django.db.models import Case, Count, Exists, F, Min, OuterRef, Q, When
+
+
+# Duplicate groups merged per transaction
+BATCH_SIZE = 200
+
+
+def duplicate_groups(model, using=None):
+    """Return (user_id, normalized_name, keep_id) for every name that is
+    used by more than one of a user's objects; the oldest object is kept."""
+    return (
+        model.objects.using(using).values('user_id', 'normalized_name')
+        .annotate(keep_id=Min('id'), count=Count('id'))
+        .filter(count__gt=1)
+        .order_by()
+        .values_list('user_id', 'normalized_name', 'keep_id')
+    )
+
+
+def relink(links, column, targets):
+    """Point the `links` rows referencing a key of `targets`, a dict of
+    duplicate ids to the ids they merge into, at the merged object
+
+    A recipe ends up with one link per merged object: the link it already
+    had to the object, else the oldest of its links to the duplicates.
+    """
+    target = Case(*[When(**{column: duplicate_id}, then=keep_id)
+                    for duplicate_id, keep_id in targets.items()],
+                  default=F(column), output_field=models.BigIntegerField())
+    moved = links.filter(**{f'{column}__in': targets})
+    moved.annotate(target=target).filter(Exists(
+        links.annotate(target=target).filter(
+            Q(**{column: OuterRef('target')}) | Q(id__lt=OuterRef('id')),
+            recipe_id=OuterRef('recipe_id'),
+            target=OuterRef('target'),
+        )
+    )).delete()
+    moved.update(**{column: target})
+
+
+def merge_duplicates(model, through, field_name, using=None):
+    """Merge duplicate `model` objects into the oldest one of each group
+
+    `through` is the recipe M2M through model and `field_name` its foreign
+    key to `model`. The links of BATCH_SIZE groups at a time are rewritten
+    by one UPDATE, so neither the queries nor the memory used grow with
+    the number of links. The relinked recipes get new versions and
+    updated events, so the delta sync and webhooks see the merge. Returns
+    the number of objects removed from the `using` database, by default
+    the one `model` is routed to.
+    """
+    using = using or router.db_for_write(model)
+    column = f'{field_name}_id'
+    removed = 0
+
+    objects = model.objects.db_manager(using)
+    links = through.objects.db_manager(using)
+    recipes = through._meta.get_field('recipe').related_model.objects \
+        .db_manager(using)
+    groups = list(duplicate_groups(model, using))
+    for start in range(0, len(groups), BATCH_SIZE):
+        keep_ids = {(user_id, name): keep_id for user_id, name, keep_id
+                    in groups[start:start + BATCH_SIZE]}
+        candidates = objects.filter(
+            user_id__in={user_id for user_id, _ in keep_ids},
+            normalized_name__in={name for _, name in keep_ids},
+        ).values_list('id', 'user_id', 'normalized_name')
+        targets = {}
+        for pk, user_id, name in candidates:
+            keep_id = keep_ids.get((user_id, name), pk)
+            if keep_id != pk:
+                targets[pk] = keep_id
+
+        with transaction.atomic(using=using):
+            recipe_ids = set(links.filter(
+                **{f'{column}__in': targets}).values_list(
+                    'recipe_id', flat=True))
+            relink(links, column, targets)
+            objects.filter(id__in=targets).delete()
+            recipes.filter(id__in=recipe_ids).update_versioned()
+        removed += len(targets)
+
+    return removed
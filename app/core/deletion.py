@@ -0,0 +1,91 @@
+"""
+Batched deletion of the accounts queued in AccountDeletion
+
+Deleting a user with everything they own through Django's collector loads
+every row into memory and holds the locks for as long as it takes. The
+worker instead deletes the user's rows on their shard a batch at a time,
+each batch one DELETE in its own transaction, and deletes the user last.
+Progress is saved after every batch under a lease, so a deletion whose
+worker died is resumed by the next one.
+"""
+from datetime import timedelta
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+from django.utils import timezone
+
+from core.authentication import forget_tokens
+from core.models import (AccountDeletion,
+                         AuthToken,
+                         Recipe,
+                         release_recipe_image)
+from core.sharding import SHARDED_MODELS
+
+
+def delete_batch(alias, model, user_id, batch_size):
+    """Delete up to `batch_size` of the user's `model` rows on the `alias`
+    database with one DELETE, without signals, and return how many were
+    deleted"""
+    rows = model._base_manager.using(alias).filter(user_id=user_id)
+    if model is Recipe:
+        batch = dict(rows.values_list('pk', 'image')[:batch_size])
+    else:
+        batch = dict.fromkeys(rows.values_list('pk', flat=True)[:batch_size])
+    if not batch:
+        return 0
+    connection = connections[alias]
+    table = connection.ops.quote_name(model._meta.db_table)
+    pk = connection.ops.quote_name(model._meta.pk.column)
+    placeholders = ', '.join(['%s'] * len(batch))
+    with transaction.atomic(using=alias), connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE user_id = %s AND {pk} IN '
+            f'({placeholders})', [user_id, *batch])
+        deleted = cursor.rowcount
+        for name in set(filter(None, batch.values())):
+            release_recipe_image(name, alias)
+    if model is AuthToken:
+        forget_tokens(batch)
+    return deleted
+
+
+def delete_account(deletion, batch_size, lease, on_batch=None):
+    """Delete the user of `deletion` and everything they own
+
+    Tokens go first and the sync state last, links before what they link.
+    `on_batch(deletion, model, count)` is called after every batch.
+    """
+    user = get_user_model()._base_manager.filter(
+        pk=deletion.user_id).first()
+    if user is not None:
+        for label in reversed(SHARDED_MODELS):
+            model = apps.get_model(label)
+            while True:
+                count = delete_batch(user.shard, model, user.pk, batch_size)
+                if not count:
+                    break
+                deletion.deleted_rows += count
+                deletion.leased_until = (timezone.now() +
+                                         timedelta(seconds=lease))
+                deletion.save(update_fields=['deleted_rows',
+                                             'leased_until'])
+                if on_batch is not None:
+                    on_batch(deletion, model, count)
+        # Only the user's rows on the default database are left.
+        user.delete()
+    deletion.finished = timezone.now()
+    deletion.leased_until = None
+    deletion.save(update_fields=['finished', 'leased_until'])
+
+
+def process_deletions(batch_size, lease, on_batch=None):
+    """Delete the queued accounts until the queue is empty, alongside any
+    other workers, and return the deletions done"""
+    done = []
+    while True:
+        deletion = AccountDeletion.objects.claim(lease)
+        if deletion is None:
+            return done
+        delete_account(deletion, batch_size, lease, on_batch)
+        done.append(deletion)
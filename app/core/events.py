@@ -0,0 +1,123 @@
+"""
+Notifications of changes to a user's recipe book, for the change stream
+
+Every change takes the next version of the user's change counter, which
+notifies the user's id. On Postgres that is a NOTIFY sent when the
+transaction commits, heard by a LISTEN connection to each shard in every
+process serving the stream. Elsewhere the process that made the change
+tells its own broadcaster after the commit.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections, transaction
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'recipe_changes'
+
+
+class Broadcaster:
+    """Wake the coroutines waiting for changes of a user
+
+    Lives on one event loop, other threads call publish_threadsafe().
+    """
+
+    def __init__(self):
+        self._waiters = defaultdict(set)
+        self._loop = None
+        self._listeners = {}
+        self._lost = set()
+
+    def subscribe(self, user_id):
+        """Return an asyncio.Event set on the user's next change"""
+        self._loop = asyncio.get_running_loop()
+        self.listen()
+        event = asyncio.Event()
+        self._waiters[user_id].add(event)
+        return event
+
+    def unsubscribe(self, user_id, event):
+        waiters = self._waiters[user_id]
+        waiters.discard(event)
+        if not waiters:
+            del self._waiters[user_id]
+
+    def publish(self, user_id):
+        for event in self._waiters.get(user_id, ()):
+            event.set()
+
+    def publish_all(self):
+        for user_id in list(self._waiters):
+            self.publish(user_id)
+
+    def publish_threadsafe(self, user_id):
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self.publish, user_id)
+
+    def listen(self):
+        """LISTEN on every Postgres shard not listened to yet
+
+        Wakes every waiter when a lost LISTEN connection is back, for the
+        changes made without it.
+        """
+        relistened = False
+        for alias in settings.DATABASE_SHARDS:
+            wrapper = connections[alias]
+            if wrapper.vendor != 'postgresql' or alias in self._listeners:
+                continue
+            try:
+                connection = wrapper.get_new_connection(
+                    wrapper.get_connection_params())
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN {CHANNEL}')
+            except Exception:
+                logger.exception('Cannot LISTEN on %s', alias)
+                continue
+            self._listeners[alias] = connection
+            self._loop.add_reader(connection.fileno(), self._receive, alias)
+            if alias in self._lost:
+                self._lost.discard(alias)
+                relistened = True
+        if relistened:
+            self.publish_all()
+
+    def _receive(self, alias):
+        connection = self._listeners[alias]
+        try:
+            connection.poll()
+        except Exception:
+            logger.exception('Lost the LISTEN connection to %s', alias)
+            self._loop.remove_reader(connection.fileno())
+            del self._listeners[alias]
+            connection.close()
+            self._lost.add(alias)
+            # Changes may have been missed, every stream checks and
+            # listens again, see listen().
+            self.publish_all()
+            return
+        while connection.notifies:
+            self.publish(int(connection.notifies.pop(0).payload))
+
+
+broadcaster = Broadcaster()
+
+
+def notify_change(alias, user_id):
+    """Tell the change streams of the user that their recipe book
+    changes with the current transaction on `alias`"""
+    if not settings.CHANGE_STREAM_NOTIFY:
+        return
+    connection = connections[alias]
+    if connection.vendor == 'postgresql':
+        # Delivered on commit, once per transaction and user
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)',
+                           [CHANNEL, str(user_id)])
+    else:
+        transaction.on_commit(
+            lambda: broadcaster.publish_threadsafe(user_id), using=alias)
@@ -0,0 +1,45 @@
+"""
+Password hashers with a cost configured in settings
+"""
+from django.conf import settings
+from django.contrib.auth.hashers import (Argon2PasswordHasher,
+                                         PBKDF2PasswordHasher,
+                                         ScryptPasswordHasher)
+
+
+class TunablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """PBKDF2 with PASSWORD_HASH_PBKDF2_ITERATIONS iterations"""
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASH_PBKDF2_ITERATIONS
+
+
+class TunableArgon2PasswordHasher(Argon2PasswordHasher):
+    """Argon2 with costs from PASSWORD_HASH_ARGON2_* settings"""
+
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_HASH_ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        return settings.PASSWORD_HASH_ARGON2_MEMORY_COST
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_HASH_ARGON2_PARALLELISM
+
+
+class TunableScryptPasswordHasher(ScryptPasswordHasher):
+    """Scrypt with work factor PASSWORD_HASH_SCRYPT_WORK_FACTOR"""
+
+    @property
+    def work_factor(self):
+        return settings.PASSWORD_HASH_SCRYPT_WORK_FACTOR
+
+    @property
+    def maxmem(self):
+        # scrypt needs 128 * n * r bytes, OpenSSL refuses more than 32 MiB
+        # unless a higher limit is passed.
+        return 2 * 128 * self.work_factor * self.block_size
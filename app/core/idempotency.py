@@ -0,0 +1,160 @@
+"""
+Idempotency-Key support for POST endpoints
+
+A client retrying a POST sends the same Idempotency-Key header as the
+first attempt. The first response is stored with a hash of the request
+and replayed to repeats without running the view again. It is stored on
+the user's shard in the transaction of the view, so it is there exactly
+when the change is. A repeat arriving while the first attempt still runs
+gets 409 from a try-lock, without waiting or touching the table.
+"""
+import functools
+import hashlib
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import UploadedFile
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+from drf_spectacular.utils import OpenApiParameter
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.throttling import BaseThrottle
+
+from core.models import IdempotencyKey
+
+
+HEADER = 'Idempotency-Key'
+
+# For extend_schema(parameters=[...]) of the idempotent endpoints
+IDEMPOTENCY_KEY_PARAMETER = OpenApiParameter(
+    HEADER, str, OpenApiParameter.HEADER,
+    description='Unique key of the request, a retry with the same key '
+                'gets the response of the first attempt',
+)
+
+
+def file_hash(file):
+    """Return the sha256 of an uploaded file, the one its upload handler
+    computed if it did (see recipe.uploads)"""
+    digest = getattr(file, 'sha256', None)
+    if digest is None:
+        sha256 = hashlib.sha256()
+        for chunk in file.chunks():
+            sha256.update(chunk)
+        file.seek(0)
+        digest = sha256.hexdigest()
+    return digest
+
+
+def request_hash(request):
+    """Return a hash of what the request asks for
+
+    Multipart bodies are parsed, with the view's upload handlers, and
+    hashed by their fields and the sha256 of their files.
+    """
+    digest = hashlib.sha256(
+        f'{request.method} {request.get_full_path()}\n'.encode())
+    if request.content_type.startswith('multipart/'):
+        for name, values in sorted(request.data.lists()):
+            for value in values:
+                if isinstance(value, UploadedFile):
+                    value = f'file:{file_hash(value)}'
+                digest.update(f'{name}={value}\n'.encode())
+    else:
+        digest.update(request.body)
+    return digest.hexdigest()
+
+
+@contextmanager
+def try_lock(name):
+    """Try to take the lock `name` without waiting, yield whether it was
+    taken
+
+    A session advisory lock on Postgres, an atomic cache add() elsewhere.
+    """
+    connection = connections[DEFAULT_DB_ALIAS]
+    if connection.vendor == 'postgresql':
+        lock_id = int.from_bytes(
+            hashlib.sha256(name.encode()).digest()[:8], 'big', signed=True)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_try_advisory_lock(%s)', [lock_id])
+            locked = cursor.fetchone()[0]
+        try:
+            yield locked
+        finally:
+            if locked:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_advisory_unlock(%s)',
+                                   [lock_id])
+    else:
+        key = f'idempotency-lock:{name}'
+        locked = cache.add(key, 1, settings.IDEMPOTENCY_LOCK_TIMEOUT)
+        try:
+            yield locked
+        finally:
+            if locked:
+                cache.delete(key)
+
+
+def idempotent(view_method):
+    """Decorate a view method to honour the Idempotency-Key header
+
+    Responses below 500 are stored, so a retry after a server error runs
+    the request again. Views reading uploads set their upload handlers
+    before this runs, in initial(), as multipart bodies are parsed here.
+    """
+    @functools.wraps(view_method)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return view_method(view, request, *args, **kwargs)
+        if not key or len(key) > 255:
+            return Response(
+                {'detail': f'{HEADER} must have 1 to 255 characters.'},
+                status=status.HTTP_400_BAD_REQUEST)
+        if request.user.is_authenticated:
+            scope = f'user:{request.user.pk}'
+            alias = request.user.shard
+        else:
+            scope = f'anon:{BaseThrottle().get_ident(request)}'
+            alias = DEFAULT_DB_ALIAS
+        keys = IdempotencyKey.objects.using(alias)
+        fingerprint = request_hash(request)
+
+        with try_lock(f'{scope}:{key}') as locked:
+            if not locked:
+                return Response(
+                    {'detail': f'A request with this {HEADER} is in '
+                               f'progress.'},
+                    status=status.HTTP_409_CONFLICT)
+            now = timezone.now()
+            stored = keys.filter(
+                scope=scope, key=key,
+                created__gt=now - timedelta(
+                    seconds=settings.IDEMPOTENCY_KEY_TTL),
+            ).first()
+            if stored is not None:
+                if stored.request_hash != fingerprint:
+                    return Response(
+                        {'detail': f'This {HEADER} was used for a '
+                                   f'different request.'},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+                response = Response(stored.response,
+                                    status=stored.status_code)
+                response['Idempotent-Replayed'] = 'true'
+                return response
+
+            with transaction.atomic(using=alias):
+                response = view_method(view, request, *args, **kwargs)
+                if response.status_code < 500:
+                    keys.update_or_create(scope=scope, key=key, defaults={
+                        'request_hash': fingerprint,
+                        'status_code': response.status_code,
+                        'response': getattr(response, 'data', None),
+                        'created': now,
+                    })
+            return response
+    return wrapper
@@ -0,0 +1,66 @@
+"""
+Django command to benchmark response compression encodings and levels.
+"""
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.compression import COMPRESSORS
+
+
+WORDS = ('chicken', 'garlic', 'lemon', 'basil', 'tomato', 'onion', 'rice',
+         'curry', 'vegan', 'quick', 'dinner', 'spicy', 'pasta', 'ginger')
+
+
+def recipe_list_payload(count):
+    """JSON shaped like a recipe list response with nested tags and
+    ingredients"""
+    rnd = random.Random(0)
+
+    def named(n):
+        return [{'id': rnd.randint(1, 10000), 'name': rnd.choice(WORDS)}
+                for _ in range(n)]
+
+    recipes = [{
+        'id': i,
+        'title': ' '.join(rnd.choices(WORDS, k=3)).title(),
+        'time_minutes': rnd.randint(5, 120),
+        'price': f'{rnd.uniform(1, 50):.2f}',
+        'link': f'https://example.com/recipes/{i}',
+        'user': 'user@example.com',
+        'tags': named(rnd.randint(1, 5)),
+        'ingredients': named(rnd.randint(3, 12)),
+    } for i in range(count)]
+    return json.dumps(recipes).encode()
+
+
+class Command(BaseCommand):
+    help = ('Compress a recipe list sized JSON payload with each available '
+            'encoding and level, reporting the size and CPU time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100,
+                            help='Recipes in the payload.')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Compressions timed per level.')
+
+    def handle(self, *args, **options):
+        payload = recipe_list_payload(options['recipes'])
+        self.stdout.write(f'Payload: {len(payload)} bytes, '
+                          f"{options['recipes']} recipes")
+        self.stdout.write(f"{'encoding':>8} {'level':>5} {'bytes':>9} "
+                          f"{'ratio':>6} {'ms':>8} {'MB/s':>8}")
+        for encoding, compressor_class in COMPRESSORS.items():
+            for level in compressor_class.levels:
+                compressor = compressor_class(level)
+                start = time.process_time()
+                for _ in range(options['repeat']):
+                    size = len(compressor.compress(payload))
+                elapsed = (time.process_time() - start) / options['repeat']
+                self.stdout.write(
+                    f'{encoding:>8} {level:>5} {size:>9} '
+                    f'{len(payload) / size:>6.1f} {elapsed * 1000:>8.2f} '
+                    f'{len(payload) / elapsed / 1e6 if elapsed else 0:>8.1f}'
+                )
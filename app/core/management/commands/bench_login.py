@@ -0,0 +1,61 @@
+"""
+Django command to benchmark password verification throughput of logins.
+"""
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+from core.backends import run_hasher
+
+
+PASSWORD = 'correct horse battery staple'
+
+
+class Command(BaseCommand):
+    help = ('Measure how many password checks per second the login path '
+            'sustains with each configured hasher and cost.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Logins simulated per hasher.')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Concurrent request threads.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{options['requests']} logins per hasher, "
+            f"{options['concurrency']} threads, "
+            f'process pool size {settings.PASSWORD_HASH_POOL_SIZE}'
+        )
+        for hasher_path in settings.PASSWORD_HASHERS:
+            hasher = import_string(hasher_path)()
+            try:
+                encoded = hasher.encode(PASSWORD, hasher.salt())
+            except ValueError as exc:
+                self.stdout.write(f'{hasher.algorithm:>14}: skipped ({exc})')
+                continue
+            self.bench(hasher.algorithm, encoded, options['requests'],
+                       options['concurrency'])
+
+    def bench(self, algorithm, encoded, requests, concurrency):
+        def login(_):
+            start = time.perf_counter()
+            assert run_hasher(check_password, PASSWORD, encoded)
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = sorted(executor.map(login, range(requests)))
+        elapsed = time.perf_counter() - start
+
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        self.stdout.write(
+            f'{algorithm:>14}: {requests / elapsed:8.1f} logins/s, '
+            f'p50 {statistics.median(latencies) * 1000:7.1f} ms, '
+            f'p95 {p95 * 1000:7.1f} ms'
+        )
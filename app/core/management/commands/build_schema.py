@@ -0,0 +1,30 @@
+"""
+Django command to write the OpenAPI schema served by /api/schema/.
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.schema import render_schema, write_schema
+
+
+class Command(BaseCommand):
+    help = ('Generate the OpenAPI schema in every served format and '
+            'encoding and write it to SCHEMA_CACHE_DIR. Run it whenever the '
+            'code is deployed, stale files are served as they are.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-dir', default=settings.SCHEMA_CACHE_DIR,
+                            help='Directory to write to.')
+
+    def handle(self, *args, **options):
+        directory = options['output_dir']
+        if not directory:
+            raise CommandError('Set SCHEMA_CACHE_DIR or pass --output-dir.')
+        variants = render_schema()
+        write_schema(directory, variants)
+        for fmt, variant in variants.items():
+            sizes = ', '.join(f'{encoding} {len(content)}'
+                              for encoding, content in
+                              variant.compressed.items())
+            self.stdout.write(self.style.SUCCESS(
+                f'schema.{fmt}: {len(variant.content)} bytes ({sizes})'))
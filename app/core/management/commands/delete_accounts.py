@@ -0,0 +1,43 @@
+"""
+Django command to delete the accounts queued for deletion in batches.
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.deletion import process_deletions
+
+
+class Command(BaseCommand):
+    help = ('Delete the deactivated accounts queued for deletion and '
+            'everything they own, in batches of short transactions. Safe '
+            'to run in several processes at once and to restart.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int,
+            default=settings.ACCOUNT_DELETION_BATCH_SIZE,
+            help='Rows deleted per transaction.',
+        )
+        parser.add_argument(
+            '--lease', type=int,
+            default=settings.ACCOUNT_DELETION_LEASE_SECONDS,
+            help='Seconds without progress after which another worker '
+                 'takes over an account.',
+        )
+
+    def handle(self, *args, **options):
+        def report(deletion, model, count):
+            if options['verbosity'] > 1:
+                self.stdout.write(
+                    f'User {deletion.user_id}: deleted {count} '
+                    f'{model._meta.label} rows, {deletion.deleted_rows} '
+                    f'in total.')
+
+        done = process_deletions(options['batch_size'], options['lease'],
+                                 report)
+        for deletion in done:
+            self.stdout.write(
+                f'Deleted user {deletion.user_id} and '
+                f'{deletion.deleted_rows} rows.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {len(done)} accounts.'))
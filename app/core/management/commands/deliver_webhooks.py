@@ -0,0 +1,50 @@
+"""
+Django command to post the outbox events to the webhooks.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.webhooks import ConnectionPool, deliver_events
+
+
+class Command(BaseCommand):
+    help = ('Post the queued recipe, tag and ingredient events to the '
+            'active webhooks in batches, retrying failures with backoff. '
+            'Safe to run in several processes at once.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.WEBHOOK_BATCH_SIZE,
+            help='Events posted per request.',
+        )
+        parser.add_argument(
+            '--lease', type=int, default=60,
+            help='Seconds after which events claimed by a worker that '
+                 'died are delivered by another.',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Keep delivering, polling every this many seconds, '
+                 'instead of exiting once the outbox is drained.',
+        )
+
+    def handle(self, *args, **options):
+        # Connections are kept open across polls
+        pool = ConnectionPool(settings.WEBHOOK_POOL_SIZE,
+                              settings.WEBHOOK_TIMEOUT)
+        with ThreadPoolExecutor(settings.WEBHOOK_POOL_SIZE) as executor:
+            try:
+                while True:
+                    delivered, failed = deliver_events(
+                        pool, executor, options['batch_size'],
+                        options['lease'])
+                    self.stdout.write(self.style.SUCCESS(
+                        f'Delivered {delivered} events, {failed} failed.'))
+                    if not options['interval']:
+                        break
+                    time.sleep(options['interval'])
+            finally:
+                pool.close()
@@ -0,0 +1,28 @@
+"""
+Django command to merge tags and ingredients whose names only differ by
+case or whitespace.
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.dedup import merge_duplicates
+from core.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Merge tags and ingredients whose normalized names collide on '
+            'every shard, relinking their recipes to the oldest object of '
+            'each group.')
+
+    def handle(self, *args, **options):
+        for field_name in ('tags', 'ingredients'):
+            field = Recipe._meta.get_field(field_name)
+            model = field.related_model
+            removed = sum(
+                merge_duplicates(model, field.remote_field.through,
+                                 field.m2m_reverse_field_name(), using=alias)
+                for alias in settings.DATABASE_SHARDS)
+            self.stdout.write(self.style.SUCCESS(
+                f'Merged {removed} duplicate '
+                f'{model._meta.verbose_name_plural}.'
+            ))
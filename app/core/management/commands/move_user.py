@@ -0,0 +1,31 @@
+"""
+Django command to move a user's recipe data to another shard.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core.sharding import move_user
+
+
+class Command(BaseCommand):
+    help = ('Move the recipes, tags, ingredients, tokens and sync state of '
+            'a user to another shard while the API keeps serving. The '
+            "user's writes wait until the move is done.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help='User to move.')
+        parser.add_argument('shard', choices=settings.DATABASE_SHARDS,
+                            help='Database alias to move the user to.')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        try:
+            user = User.objects.get(email=options['email'])
+        except User.DoesNotExist:
+            raise CommandError(f'No user {options["email"]}.')
+        source = user.shard
+        copied = move_user(user, options['shard'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {copied} rows of {user.email} from {source} to '
+            f'{user.shard}.'))
@@ -0,0 +1,35 @@
+"""
+Django command to hash partition the recipe tables by user.
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core.partitioning import TABLES, partition_by_user
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the recipe, tag, ingredient and link tables of every '
+            'shard as tables hash partitioned by user (Postgres only). '
+            'Locks the tables while they are copied, stop the API first.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--partitions', type=int, default=16,
+            help='Number of partitions of each table.',
+        )
+
+    def handle(self, *args, **options):
+        if options['partitions'] < 2:
+            raise CommandError('--partitions must be at least 2.')
+        for alias in settings.DATABASE_SHARDS:
+            connection = connections[alias]
+            if connection.vendor != 'postgresql':
+                raise CommandError('Partitioning needs PostgreSQL.')
+            if not partition_by_user(connection, options['partitions']):
+                self.stdout.write(
+                    f'The tables of {alias} are already partitioned.')
+                continue
+            self.stdout.write(self.style.SUCCESS(
+                f'Partitioned {", ".join(TABLES)} of {alias} into '
+                f'{options["partitions"]} partitions each.'))
@@ -0,0 +1,75 @@
+"""
+Django command to profile the import time and memory of process startup.
+"""
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+# Run in a fresh interpreter, so nothing is imported yet.
+SCRIPT = '''
+import json, resource
+import django
+django.setup()
+if {warm_up!r}:
+    from core.warmup import warm_up
+    warm_up()
+try:
+    with open('/proc/self/status') as f:
+        rss = next(int(line.split()[1]) for line in f
+                   if line.startswith('VmRSS:'))
+except OSError:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{'rss_kb': rss}}))
+'''
+
+
+def parse_importtime(output):
+    """Return {top level package: self import time in us} from the output
+    of python -X importtime"""
+    totals = defaultdict(int)
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        totals[name.strip().split('.')[0]] += int(self_us)
+    return totals
+
+
+class Command(BaseCommand):
+    help = ('Start a fresh process with the current settings (see '
+            '--settings) and report the import time per top level package '
+            'and the resident memory once Django is set up.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20,
+                            help='Packages listed.')
+        parser.add_argument('--warm-up', action='store_true',
+                            help='Also run the pre-fork warm-up.')
+
+    def handle(self, *args, **options):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c',
+             SCRIPT.format(warm_up=options['warm_up'])],
+            capture_output=True, text=True, env=os.environ.copy(),
+        )
+        if result.returncode:
+            raise CommandError(result.stderr)
+
+        totals = parse_importtime(result.stderr)
+        total = sum(totals.values())
+        self.stdout.write(f"{'package':<32} {'ms':>8} {'share':>6}")
+        for name, us in sorted(totals.items(), key=lambda item: -item[1])[
+                :options['top']]:
+            self.stdout.write(f'{name:<32} {us / 1000:>8.1f} '
+                              f'{us / total:>6.1%}')
+        rss_kb = json.loads(result.stdout.splitlines()[-1])['rss_kb']
+        self.stdout.write(self.style.SUCCESS(
+            f'{os.environ["DJANGO_SETTINGS_MODULE"]}: {len(totals)} '
+            f'packages imported in {total / 1000:.1f} ms, '
+            f'RSS {rss_kb / 1024:.1f} MiB'
+        ))
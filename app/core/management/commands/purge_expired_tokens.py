@@ -0,0 +1,34 @@
+"""
+Django command to delete expired API tokens in batches.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import AuthToken
+
+
+class Command(BaseCommand):
+    help = ('Delete expired API tokens of every shard in batches, walking '
+            'the index on their creation time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Tokens deleted per transaction.')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=settings.AUTH_TOKEN_TTL)
+        deleted = 0
+        for alias in settings.DATABASE_SHARDS:
+            tokens = AuthToken.objects.db_manager(alias)
+            expired = tokens.filter(created__lte=cutoff).order_by('created')
+            while True:
+                keys = list(expired.values_list(
+                    'key', flat=True)[:options['batch_size']])
+                if not keys:
+                    break
+                deleted += tokens.revoke(key__in=keys)[0]
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {deleted} expired tokens.'))
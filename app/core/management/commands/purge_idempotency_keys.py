@@ -0,0 +1,35 @@
+"""
+Django command to delete expired idempotency keys in batches.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = ('Delete stored responses of idempotency keys older than '
+            'IDEMPOTENCY_KEY_TTL on every shard, in batches.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Keys deleted per transaction.')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(
+            seconds=settings.IDEMPOTENCY_KEY_TTL)
+        deleted = 0
+        for alias in settings.DATABASE_SHARDS:
+            keys = IdempotencyKey.objects.using(alias)
+            expired = keys.filter(created__lte=cutoff)
+            while True:
+                pks = list(expired.order_by('created').values_list(
+                    'pk', flat=True)[:options['batch_size']])
+                if not pks:
+                    break
+                deleted += keys.filter(pk__in=pks).delete()[0]
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {deleted} idempotency keys.'))
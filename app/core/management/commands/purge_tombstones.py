@@ -0,0 +1,48 @@
+"""
+Django command to delete old delta sync tombstones.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from core.models import SyncState, Tombstone
+
+
+class Command(BaseCommand):
+    help = ('Delete tombstones of objects deleted more than '
+            'SYNC_TOMBSTONE_RETENTION_DAYS ago on every shard. Clients with '
+            'a sync cursor from before them are asked to sync from scratch.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int,
+            default=settings.SYNC_TOMBSTONE_RETENTION_DAYS,
+            help='Keep tombstones younger than this many days.',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        deleted = 0
+        for alias in settings.DATABASE_SHARDS:
+            deleted += self.purge(alias, cutoff)
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {deleted} tombstones.'))
+
+    def purge(self, alias, cutoff):
+        """Delete the tombstones of `alias` older than `cutoff`, return how
+        many"""
+        expired = Tombstone.objects.using(alias).filter(
+            deleted_at__lt=cutoff)
+        with transaction.atomic(using=alias):
+            pruned = expired.values('user_id').annotate(
+                version=Max('version')).order_by()
+            for row in pruned.iterator():
+                SyncState.objects.using(alias).filter(
+                    user_id=row['user_id'],
+                    pruned_version__lt=row['version'],
+                ).update(pruned_version=row['version'])
+            return expired.delete()[0]
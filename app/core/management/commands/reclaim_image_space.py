@@ -0,0 +1,94 @@
+"""
+Django command to deduplicate stored recipe images and delete orphans.
+"""
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.models import RECIPE_IMAGE_DIR, Recipe
+from core.storage import CONTENT_ADDRESSED_NAME_RE, recipe_image_storage
+
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = ('Move recipe images to content addressed names so duplicates '
+            'share one file, then delete image files no recipe references.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report what would be reclaimed without changing anything.',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        moved = self.deduplicate(dry_run)
+        deleted, freed = self.delete_orphans(dry_run)
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {moved} images to content addressed names, deleted '
+            f'{deleted} orphaned files ({freed} bytes).'
+        ))
+
+    def deduplicate(self, dry_run):
+        """Rename legacy (uuid named) images after their content hash"""
+        names = set()
+        for alias in settings.DATABASE_SHARDS:
+            names.update(
+                Recipe.objects.using(alias).exclude(image='')
+                .exclude(image__isnull=True)
+                .values_list('image', flat=True).distinct().order_by()
+            )
+        moved = 0
+        for name in names:
+            if CONTENT_ADDRESSED_NAME_RE.search(name):
+                continue
+            if not recipe_image_storage.exists(name):
+                self.stderr.write(f'Missing image file {name}')
+                continue
+            moved += 1
+            if dry_run:
+                continue
+            with recipe_image_storage.open(name) as content:
+                new_name = recipe_image_storage.save(name, content)
+            # Every recipe sharing the old file is repointed in one query
+            # per shard.
+            for alias in settings.DATABASE_SHARDS:
+                Recipe.objects.using(alias).filter(image=name).update(
+                    image=new_name)
+            recipe_image_storage.delete(name)
+        return moved
+
+    def _stored_files(self):
+        root = recipe_image_storage.path(RECIPE_IMAGE_DIR)
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, recipe_image_storage.location)
+                yield name.replace(os.sep, '/')
+
+    def delete_orphans(self, dry_run):
+        """Delete stored files that no recipe references"""
+        deleted = freed = 0
+        files = self._stored_files()
+        while True:
+            batch = [name for _, name in zip(range(BATCH_SIZE), files)]
+            if not batch:
+                break
+            referenced = set()
+            for alias in settings.DATABASE_SHARDS:
+                referenced.update(Recipe.objects.using(alias).filter(
+                    image__in=batch).values_list('image', flat=True))
+            for name in batch:
+                if name in referenced:
+                    continue
+                size = recipe_image_storage.size(name)
+                if dry_run or recipe_image_storage.delete_if_orphaned(
+                        name, [Recipe.objects.using(alias).filter(image=name)
+                               for alias in settings.DATABASE_SHARDS]):
+                    deleted += 1
+                    freed += size
+        return deleted, freed
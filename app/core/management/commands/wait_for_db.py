@@ -2,6 +2,7 @@
 Django command to check if the database is up and running.
 """
 from typing import Any, Optional
+from django.conf import settings
 from django.core.management.base import BaseCommand
 import time
 from psycopg2 import OperationalError as Psycopg2Error
@@ -9,7 +10,7 @@ from django.db.utils import OperationalError
 
 
 class Command(BaseCommand):
-    help = 'Check if the database is up and running.'
+    help = 'Check if the databases of every shard are up and running.'
 
     def handle(self, *args: Any, **options: Any) -> Optional[str]:
         self.stdout.write(self.style.NOTICE('Waiting for database...'))
@@ -17,7 +18,7 @@ class Command(BaseCommand):
         while db_up is False:
             time.sleep(1)
             try:
-                self.check(databases=['default'])
+                self.check(databases=settings.DATABASE_SHARDS)
                 db_up=True
             except (Psycopg2Error, OperationalError):
                 self.stdout.write('Database unavailable, waiting 1 second...')
@@ -0,0 +1,420 @@
+"""
+Process metrics in the Prometheus text exposition format
+
+Metrics are recorded into per-thread shards, so recording takes no lock:
+each thread only ever writes its own dict and a scrape sums copies of all
+of them. When a thread exits its counters and histograms are folded into
+the registry's retired totals and its gauges dropped. With METRICS_DIR
+set, every server process writes its totals to <METRICS_DIR>/<pid>.json
+every METRICS_FLUSH_INTERVAL seconds and a scrape, answered by any one
+process, adds up the files of all of them.
+"""
+import fcntl
+import json
+import math
+import os
+import threading
+import time
+import weakref
+from collections import defaultdict
+
+from django.conf import settings
+
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                    5.0, 10.0)
+
+ARCHIVE_FILE = 'archive.json'
+
+
+class Registry:
+    """Metric definitions and the per-thread shards holding their values
+
+    Values are keyed by (metric name, label values, part), where part is
+    '' for counters and gauges and 'sum', 'count' or a bucket index for
+    histograms.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.callbacks = []
+        self.reset()
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def register_callback(self, callback):
+        """Register `callback()` returning [(metric, labels, value)] read
+        at scrape time, for values owned by something else"""
+        self.callbacks.append(callback)
+        return callback
+
+    def shard(self):
+        """Return the calling thread's values"""
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = defaultdict(float)
+            # The thread's local values, and with them the owner, are
+            # released when the thread exits
+            owner = self._local.owner = _ShardOwner()
+            weakref.finalize(owner, self._retire, self._shards, shard)
+            with self._shards_lock:
+                self._shards[id(shard)] = shard
+            return shard
+
+    def _retire(self, shards, shard):
+        """Fold the shard of an exited thread into the retired totals"""
+        with self._shards_lock:
+            # Left over from before a reset()
+            if shards is not self._shards:
+                return
+            del self._shards[id(shard)]
+            for key, value in shard.copy().items():
+                metric = self.metrics.get(key[0])
+                if metric is not None and metric.kind != 'gauge':
+                    self._retired[key] += value
+
+    def reset(self):
+        """Forget all values, e.g. the ones a forked child inherited"""
+        self._shards = {}
+        self._retired = defaultdict(float)
+        self._local = threading.local()
+        # Only taken when a thread records its first value or exits, and
+        # by scrapes
+        self._shards_lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    def snapshot(self):
+        """Return {key: value} summed over all threads"""
+        with self._shards_lock:
+            totals = self._retired.copy()
+            for shard in self._shards.values():
+                # dict.copy() does not release the GIL, so it cannot see
+                # a half-done update.
+                for key, value in shard.copy().items():
+                    totals[key] += value
+        return totals
+
+    def maybe_flush(self):
+        """Write this process' totals to METRICS_DIR when they are older
+        than METRICS_FLUSH_INTERVAL"""
+        if settings.METRICS_DIR and \
+                time.monotonic() - self._flushed_at >= \
+                settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        self._flushed_at = time.monotonic()
+        _write(os.path.join(settings.METRICS_DIR, f'{os.getpid()}.json'),
+               self.snapshot())
+
+    def collect(self):
+        """Return {key: value} of all processes, with callback values"""
+        if settings.METRICS_DIR:
+            self.flush()
+            totals = _aggregate(settings.METRICS_DIR, self.metrics)
+        else:
+            totals = self.snapshot()
+        for callback in self.callbacks:
+            for metric, labels, value in callback():
+                totals[(metric.name, metric.label_values(labels), '')] = \
+                    value
+        return totals
+
+    def render(self):
+        """Return the metrics in the Prometheus text format"""
+        values = defaultdict(dict)
+        for (name, label_values, part), value in self.collect().items():
+            values[name][(label_values, part)] = value
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            lines.extend(metric.render(values.get(name, {})))
+        return '\n'.join(lines) + '\n'
+
+
+class _ShardOwner:
+    """Held by a thread's local values only, finalized when it exits"""
+
+
+def _write(path, totals):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump([[name, list(labels), part, value]
+                   for (name, labels, part), value in totals.items()], f)
+    os.replace(tmp, path)
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            rows = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    return {(name, tuple(labels), part): value
+            for name, labels, part, value in rows}
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _aggregate(directory, metrics):
+    """Sum the files of all processes in `directory`
+
+    Counters and histograms of exited processes are folded into the
+    archive file so they keep counting up, their gauges are dropped.
+    """
+    totals = defaultdict(float)
+    with open(os.path.join(directory, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        archive_path = os.path.join(directory, ARCHIVE_FILE)
+        archive = defaultdict(float, _read(archive_path))
+        archived = False
+        for filename in os.listdir(directory):
+            pid, ext = os.path.splitext(filename)
+            if ext != '.json' or not pid.isdigit():
+                continue
+            path = os.path.join(directory, filename)
+            values = _read(path)
+            if _alive(int(pid)):
+                for key, value in values.items():
+                    totals[key] += value
+                continue
+            for key, value in values.items():
+                metric = metrics.get(key[0])
+                if metric is not None and metric.kind != 'gauge':
+                    archive[key] += value
+            os.remove(path)
+            archived = True
+        if archived:
+            _write(archive_path, archive)
+    for key, value in archive.items():
+        totals[key] += value
+    return totals
+
+
+def _escape(value):
+    return (value.replace('\\', r'\\').replace('"', r'\"')
+            .replace('\n', r'\n'))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(f'{n}="{_escape(str(v))}"' for n, v in pairs)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    """Base for metrics, label values are given as keyword arguments"""
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(),
+                 registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        (registry or REGISTRY).register(self)
+        self._registry = registry or REGISTRY
+
+    def label_values(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self, values):
+        if not values and not self.labelnames:
+            values = {((), ''): 0}
+        for (label_values, _), value in sorted(values.items()):
+            labels = _format_labels(self.labelnames, label_values)
+            yield f'{self.name}{labels} {_format_value(value)}'
+
+
+class Counter(Metric):
+    """Value that only goes up"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        self._registry.shard()[
+            (self.name, self.label_values(labels), '')] += amount
+
+
+class Gauge(Metric):
+    """Value that goes up and down, summed over threads and processes"""
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        self._registry.shard()[
+            (self.name, self.label_values(labels), '')] += amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        """Set the calling thread's share of the value"""
+        self._registry.shard()[
+            (self.name, self.label_values(labels), '')] = value
+
+    def track_inprogress(self, **labels):
+        """Context manager counting the calls in progress"""
+        return _InProgress(self, labels)
+
+
+class _InProgress:
+
+    def __init__(self, gauge, labels):
+        self.gauge = gauge
+        self.labels = labels
+
+    def __enter__(self):
+        self.gauge.inc(**self.labels)
+
+    def __exit__(self, *exc_info):
+        self.gauge.dec(**self.labels)
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DURATION_BUCKETS, registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        label_values = self.label_values(labels)
+        shard = self._registry.shard()
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                shard[(self.name, label_values, index)] += 1
+                break
+        shard[(self.name, label_values, 'sum')] += value
+        shard[(self.name, label_values, 'count')] += 1
+
+    def time(self, **labels):
+        """Context manager observing the duration of its block"""
+        return _Timer(self, labels)
+
+    def render(self, values):
+        series = defaultdict(dict)
+        for (label_values, part), value in values.items():
+            series[label_values][part] = value
+        for label_values, parts in sorted(series.items()):
+            cumulative = 0
+            for index, bound in enumerate(self.buckets):
+                cumulative += parts.get(index, 0)
+                labels = _format_labels(self.labelnames, label_values,
+                                        [('le', _format_value(bound))])
+                yield f'{self.name}_bucket{labels} {int(cumulative)}'
+            labels = _format_labels(self.labelnames, label_values)
+            yield (f'{self.name}_sum{labels} '
+                   f'{_format_value(parts.get("sum", 0))}')
+            yield (f'{self.name}_count{labels} '
+                   f'{int(parts.get("count", 0))}')
+
+
+class _Timer:
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start,
+                               **self.labels)
+
+
+REGISTRY = Registry()
+# A forked worker starts counting from zero instead of repeating the
+# values of the process it was forked from.
+os.register_at_fork(after_in_child=REGISTRY.reset)
+
+
+HTTP_REQUESTS = Counter(
+    'http_requests_total', 'HTTP requests by route, method and status.',
+    ['route', 'method', 'status'])
+HTTP_REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route.',
+    ['route', 'method'])
+DB_QUERIES = Counter(
+    'db_queries_total', 'Database queries executed.', ['alias'])
+DB_QUERY_DURATION = Counter(
+    'db_query_duration_seconds_total', 'Time spent in database queries.',
+    ['alias'])
+DB_CONNECTIONS_OPENED = Counter(
+    'db_connections_opened_total', 'Database connections opened.',
+    ['alias'])
+DB_CONNECTIONS_OPEN = Gauge(
+    'db_connections_open', 'Database connections held between requests.',
+    ['alias'])
+CACHE_REQUESTS = Counter(
+    'cache_requests_total', 'Cache lookups by cache and result.',
+    ['cache', 'result'])
+IMAGE_RENDERS_IN_PROGRESS = Gauge(
+    'image_renders_in_progress', 'Recipe image renditions being rendered.')
+IMAGE_RENDER_DURATION = Histogram(
+    'image_render_duration_seconds', 'Recipe image rendition render time.')
+PASSWORD_HASHES_IN_PROGRESS = Gauge(
+    'password_hashes_in_progress',
+    'Password hashes being computed, in the pool or inline.')
+LOGIN_DURATION = Histogram(
+    'auth_login_duration_seconds', 'Password authentication latency.',
+    ['result'])
+THROTTLE_DECISIONS = Counter(
+    'throttle_decisions_total',
+    'Throttle decisions by scope, shared by all processes.',
+    ['scope', 'outcome'])
+
+
+def _time_query(execute, sql, params, many, context):
+    """Database execute wrapper counting queries and their time"""
+    alias = context['connection'].alias
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        DB_QUERY_DURATION.inc(time.perf_counter() - start, alias=alias)
+        DB_QUERIES.inc(alias=alias)
+
+
+def instrument_connection(sender, connection, **kwargs):
+    """connection_created receiver timing the connection's queries"""
+    DB_CONNECTIONS_OPENED.inc(alias=connection.alias)
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+def count_open_connections(sender, **kwargs):
+    """request_finished receiver recording the connections this thread
+    keeps open (CONN_MAX_AGE) after the request"""
+    from django.db import connections
+    for conn in connections.all(initialized_only=True):
+        DB_CONNECTIONS_OPEN.set(int(conn.connection is not None),
+                                alias=conn.alias)
+
+
+@REGISTRY.register_callback
+def throttle_decisions():
+    from core.throttling import THROTTLE_SCOPES, throttle_metrics
+    return [(THROTTLE_DECISIONS, {'scope': scope, 'outcome': outcome}, value)
+            for scope, counts in throttle_metrics(THROTTLE_SCOPES).items()
+            for outcome, value in counts.items()]
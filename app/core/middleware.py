@@ -0,0 +1,179 @@
+"""
+Middleware for the app
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import add_never_cache_headers, patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+from core import metrics
+from core.compression import negotiate
+
+
+class ReadinessCheck:
+    """Whether the database is reachable, checked at most once every
+    READINESS_CHECK_INTERVAL seconds per process"""
+
+    def __init__(self):
+        self._checked_at = None
+        self._ready = False
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        interval = settings.READINESS_CHECK_INTERVAL
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at is None or now - self._checked_at >= interval:
+                self._ready = self._check()
+                self._checked_at = now
+            return self._ready
+
+    def _check(self):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except DatabaseError:
+            return False
+        return True
+
+
+readiness_check = ReadinessCheck()
+
+
+class HealthCheckMiddleware:
+    """Answer liveness (HEALTH_CHECK_PATH) and readiness
+    (READINESS_CHECK_PATH) probes
+
+    Comes first in MIDDLEWARE, so probes skip the other middleware and the
+    ALLOWED_HOSTS check, probes address the pod and not the site. Liveness
+    never touches the database, readiness uses `readiness_check`.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.path == settings.HEALTH_CHECK_PATH:
+            response = JsonResponse({'status': 'ok'})
+        elif request.path == settings.READINESS_CHECK_PATH:
+            ready = readiness_check()
+            response = JsonResponse(
+                {'status': 'ok' if ready else 'unavailable'},
+                status=200 if ready else 503,
+            )
+        else:
+            return self.get_response(request)
+        add_never_cache_headers(response)
+        return response
+
+
+class MetricsMiddleware:
+    """Count requests and their latency per route, and answer scrapes of
+    METRICS_PATH
+
+    Comes right after HealthCheckMiddleware, so the latency covers the
+    rest of the middleware and probes are not counted. Routes are URL
+    names, so the labels stay few whatever the URL parameters.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.path == settings.METRICS_PATH:
+            return self.scrape(request)
+
+        start = time.perf_counter()
+        response = self.get_response(request)
+        match = request.resolver_match
+        route = match.view_name if match else 'unmatched'
+        metrics.HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - start, route=route, method=request.method)
+        metrics.HTTP_REQUESTS.inc(route=route, method=request.method,
+                                  status=response.status_code)
+        metrics.REGISTRY.maybe_flush()
+        return response
+
+    def scrape(self, request):
+        token = settings.METRICS_TOKEN
+        # Without a token the metrics are only public while debugging
+        if not token and not settings.DEBUG or \
+                token and request.headers.get('Authorization') != \
+                f'Bearer {token}':
+            return HttpResponse(status=403)
+        response = HttpResponse(
+            metrics.REGISTRY.render(),
+            content_type='text/plain; version=0.0.4; charset=utf-8',
+        )
+        add_never_cache_headers(response)
+        return response
+
+
+def is_compressible(content_type):
+    """Return True for text-like content types worth compressing"""
+    mime = content_type.split(';', 1)[0].strip().lower()
+    return (mime.startswith('text/') or
+            mime.endswith(('+json', '+xml')) or
+            mime in settings.RESPONSE_COMPRESSION_TYPES)
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """Compress text-like responses with the best encoding the client
+    accepts (zstd, brotli or gzip)
+
+    Responses under RESPONSE_COMPRESSION_MIN_SIZE and media types that are
+    already compressed, such as images, are sent as they are. Streaming
+    responses are compressed chunk by chunk.
+    """
+
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding') or \
+                response.status_code == 206 or \
+                not is_compressible(response.get('Content-Type', '')):
+            return response
+        if not response.streaming and \
+                len(response.content) < settings.RESPONSE_COMPRESSION_MIN_SIZE:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        compressor = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if compressor is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = self._stream(
+                compressor, response.streaming_content, response.is_async)
+            # The compressed length is unknown until the stream ends.
+            del response.headers['Content-Length']
+        else:
+            compressed = compressor.compress(response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        # A strong ETag would claim the compressed bytes equal the
+        # uncompressed ones, see RFC 9110 section 8.8.1.
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = compressor.encoding
+        return response
+
+    def _stream(self, compressor, content, is_async):
+        compress_chunk, finish = compressor.stream()
+        if is_async:
+            async def compressed():
+                async for chunk in content:
+                    yield compress_chunk(chunk)
+                yield finish()
+        else:
+            def compressed():
+                for chunk in content:
+                    yield compress_chunk(chunk)
+                yield finish()
+        return compressed()
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.10 on 2026-10-19 09:12
+
+from django.db import migrations
+
+
+INDEXES = [
+    ('core_tag', 'core_tag_user_lower_name_idx'),
+    ('core_ingredient', 'core_ingredient_user_lower_name_idx'),
+]
+
+
+def create_prefix_indexes(apps, schema_editor):
+    """Index (user, lower(name)) for LIKE 'prefix%' lookups on Postgres"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, name in INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} '
+            f'ON {table} (user_id, lower(name) varchar_pattern_ops)'
+        )
+
+
+def drop_prefix_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, name in INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('core', '0005_recipe_image'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_prefix_indexes, drop_prefix_indexes),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.10 on 2026-10-19 10:05
+
+from django.db import migrations, models
+
+
+def normalize_name(name):
+    """Copy of core.models.normalize_name as of this migration"""
+    return ' '.join(name.split()).casefold()
+
+
+def populate_normalized_names(apps, schema_editor):
+    """Fill normalized_name for existing tags and ingredients in batches"""
+    for model_name in ('Tag', 'Ingredient'):
+        model = apps.get_model('core', model_name)
+        batch = []
+        for obj in model.objects.only('id', 'name').iterator(chunk_size=2000):
+            obj.normalized_name = normalize_name(obj.name)
+            batch.append(obj)
+            if len(batch) == 2000:
+                model.objects.bulk_update(batch, ['normalized_name'])
+                batch = []
+        model.objects.bulk_update(batch, ['normalized_name'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_tag_ingredient_name_prefix_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='normalized_name',
+            field=models.CharField(default='', editable=False, max_length=255),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='normalized_name',
+            field=models.CharField(default='', editable=False, max_length=255),
+            preserve_default=False,
+        ),
+        migrations.RunPython(populate_normalized_names,
+                             migrations.RunPython.noop),
+    ]
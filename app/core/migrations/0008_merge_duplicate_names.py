@@ -0,0 +1,82 @@
+# Generated by Django 4.2.10 on 2026-10-19 10:05
+
+from django.db import migrations, models
+from django.db.models import Case, Count, Exists, F, Min, OuterRef, Q, When
+
+
+def merge_duplicates(model, through, field_name, using):
+    """Copy of core.dedup.merge_duplicates as of this migration: merge
+    the duplicates of each (user, normalized_name) into the oldest one,
+    relinking their recipes with one UPDATE per batch of groups"""
+    column = f'{field_name}_id'
+    objects = model.objects.db_manager(using)
+    links = through.objects.db_manager(using)
+    groups = list(
+        objects.values('user_id', 'normalized_name')
+        .annotate(keep_id=Min('id'), count=Count('id'))
+        .filter(count__gt=1)
+        .order_by()
+        .values_list('user_id', 'normalized_name', 'keep_id')
+    )
+    for start in range(0, len(groups), 200):
+        keep_ids = {(user_id, name): keep_id
+                    for user_id, name, keep_id in groups[start:start + 200]}
+        candidates = objects.filter(
+            user_id__in={user_id for user_id, _ in keep_ids},
+            normalized_name__in={name for _, name in keep_ids},
+        ).values_list('id', 'user_id', 'normalized_name')
+        targets = {}
+        for pk, user_id, name in candidates:
+            keep_id = keep_ids.get((user_id, name), pk)
+            if keep_id != pk:
+                targets[pk] = keep_id
+
+        target = Case(*[When(**{column: duplicate_id}, then=keep_id)
+                        for duplicate_id, keep_id in targets.items()],
+                      default=F(column), output_field=models.BigIntegerField())
+        moved = links.filter(**{f'{column}__in': targets})
+        # A recipe keeps its link to the kept object, else the oldest of
+        # its links to the duplicates.
+        moved.annotate(target=target).filter(Exists(
+            links.annotate(target=target).filter(
+                Q(**{column: OuterRef('target')}) | Q(id__lt=OuterRef('id')),
+                recipe_id=OuterRef('recipe_id'),
+                target=OuterRef('target'),
+            )
+        )).delete()
+        moved.update(**{column: target})
+        objects.filter(id__in=targets).delete()
+
+
+def merge_duplicate_names(apps, schema_editor):
+    """Merge remaining duplicates so the unique constraints can be added.
+
+    On large tables run `manage.py merge_duplicate_names` after migrating
+    to 0007 instead, this step is then a no-op.
+    """
+    recipe = apps.get_model('core', 'Recipe')
+    for field_name in ('tags', 'ingredients'):
+        field = recipe._meta.get_field(field_name)
+        merge_duplicates(field.related_model, field.remote_field.through,
+                         field.m2m_reverse_field_name(),
+                         schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_tag_ingredient_normalized_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_names,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('user', 'normalized_name'), name='unique_ingredient_name_per_user'),
+        ),
+        migrations.AddConstraint(
+            model_name='tag',
+            constraint=models.UniqueConstraint(fields=('user', 'normalized_name'), name='unique_tag_name_per_user'),
+        ),
+    ]
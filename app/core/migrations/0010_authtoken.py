@@ -0,0 +1,45 @@
+# Generated by Django 4.2.10 on 2026-10-19 12:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_existing_tokens(apps, schema_editor):
+    """Carry over rest_framework.authtoken tokens so clients stay logged in"""
+    Token = apps.get_model('authtoken', 'Token')
+    AuthToken = apps.get_model('core', 'AuthToken')
+    batch = []
+    for token in Token.objects.iterator(chunk_size=2000):
+        batch.append(AuthToken(key=token.key, user_id=token.user_id,
+                               created=token.created))
+        if len(batch) == 2000:
+            AuthToken.objects.bulk_create(batch)
+            batch = []
+    AuthToken.objects.bulk_create(batch)
+    # created is auto_now_add, so bulk_create() stored the current time,
+    # which would restart the expiry of every token
+    AuthToken.objects.update(created=models.Subquery(
+        Token.objects.filter(key=models.OuterRef('key')).values('created')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_recipe_image_content_addressed'),
+        ('authtoken', '0003_tokenproxy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthToken',
+            fields=[
+                ('key', models.CharField(max_length=40, primary_key=True, serialize=False)),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('last_used', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='api_token', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(copy_existing_tokens,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,110 @@
+# Generated by Django 4.2.10 on 2026-10-19 14:20
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def assign_versions(apps, schema_editor):
+    """Give existing recipes, tags and ingredients distinct versions per
+    user so a first sync from version 0 returns them all"""
+    versions = {}
+    for model_name in ('Recipe', 'Tag', 'Ingredient'):
+        model = apps.get_model('core', model_name)
+        batch = []
+        objs = model.objects.only('id', 'user_id').order_by('user_id', 'id')
+        for obj in objs.iterator(chunk_size=2000):
+            versions[obj.user_id] = obj.version = \
+                versions.get(obj.user_id, 0) + 1
+            batch.append(obj)
+            if len(batch) == 2000:
+                model.objects.bulk_update(batch, ['version'])
+                batch = []
+        model.objects.bulk_update(batch, ['version'])
+
+    SyncState = apps.get_model('core', 'SyncState')
+    SyncState.objects.bulk_create(
+        [SyncState(user_id=user_id, version=version)
+         for user_id, version in versions.items()],
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_authtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncState',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sync_state', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('version', models.BigIntegerField(default=0)),
+                ('pruned_version', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=50)),
+                ('object_id', models.BigIntegerField()),
+                ('version', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='version',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='version',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='version',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(assign_versions, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(fields=['user', 'version'], name='ingredient_user_version_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['user', 'version'], name='recipe_user_version_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['user', 'version'], name='tag_user_version_idx'),
+        ),
+        migrations.AddField(
+            model_name='tombstone',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tombstones', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['user', 'version'], name='tombstone_user_version_idx'),
+        ),
+    ]
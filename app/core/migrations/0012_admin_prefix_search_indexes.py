@@ -0,0 +1,42 @@
+# Generated by Django 4.2.10 on 2026-10-19 15:02
+
+from django.db import migrations
+
+
+INDEXES = [
+    ('core_user', 'core_user_lower_email_idx', 'email'),
+    ('core_recipe', 'core_recipe_lower_title_idx', 'title'),
+    ('core_tag', 'core_tag_lower_name_idx', 'name'),
+    ('core_ingredient', 'core_ingredient_lower_name_idx', 'name'),
+]
+
+
+def create_search_indexes(apps, schema_editor):
+    """Index lower(<field>) for the admin prefix search on Postgres"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, name, column in INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} '
+            f'ON {table} (lower({column}) varchar_pattern_ops)'
+        )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, name, column in INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('core', '0011_sync_versions'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.10 on 2026-10-19 17:45
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_user_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountDeletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('requested', models.DateTimeField(auto_now_add=True)),
+                ('leased_until', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('deleted_rows', models.BigIntegerField(default=0)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('user', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('finished__isnull', True)), fields=['requested'], name='accountdeletion_pending_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 4.2.10 on 2026-10-19 18:30
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class AddIndex(AddIndexConcurrently):
+    """Build the index without locking out writes on Postgres, as 0012
+    does, with a plain CREATE INDEX elsewhere and on partitioned tables
+    (see `manage.py partition_tables`), which Postgres cannot index
+    concurrently"""
+
+    def _concurrently(self, schema_editor, app_label, state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return False
+        model = state.apps.get_model(app_label, self.model_name)
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT NOT EXISTS (SELECT 1 FROM pg_partitioned_table '
+                'WHERE partrelid = %s::regclass)', [model._meta.db_table])
+            return cursor.fetchone()[0]
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        if self._concurrently(schema_editor, app_label, to_state):
+            super().database_forwards(app_label, schema_editor, from_state,
+                                      to_state)
+        else:
+            migrations.AddIndex.database_forwards(
+                self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        if self._concurrently(schema_editor, app_label, from_state):
+            super().database_backwards(app_label, schema_editor, from_state,
+                                       to_state)
+        else:
+            migrations.AddIndex.database_backwards(
+                self, app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('core', '0016_account_deletion'),
+    ]
+
+    operations = [
+        AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['user', 'id'], name='recipe_user_id_idx'),
+        ),
+        AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['user', 'price', 'id'], name='recipe_user_price_idx'),
+        ),
+        AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['user', 'time_minutes', 'id'], name='recipe_user_time_idx'),
+        ),
+        AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['user', 'title', 'id'], name='recipe_user_title_idx'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='recipes', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.10 on 2026-10-19 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_outbox_webhooks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncstate',
+            name='moved_to',
+            field=models.CharField(blank=True, editable=False, max_length=50),
+        ),
+    ]
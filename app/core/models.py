@@ -2,23 +2,44 @@
 Database models
 """
 
+import binascii
 import uuid
 import os
+from collections import Counter
+from datetime import timedelta
 
 
 from django.conf import settings
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, router, transaction
+from django.utils import timezone
 from django.contrib.auth.models import (AbstractBaseUser,
                                         BaseUserManager,
                                         PermissionsMixin)
 
+from core.events import notify_change
+from core.sharding import UserMoved, shard_for_new_user
+from core.storage import recipe_image_storage
+
+
+RECIPE_IMAGE_DIR = 'uploads/recipe/'
+
 
 def recipe_image_file_path(instance, filename):
-    """Generate file path for new recipe image"""
+    """Generate file path for new recipe image
+
+    `recipe_image_storage` keeps the directory and extension and replaces
+    the file name with the hash of the image content.
+    """
     ext = filename.split('.')[-1]
     filename = f'{uuid.uuid4()}.{ext}'
 
-    return os.path.join('uploads/recipe/', filename)
+    return os.path.join(RECIPE_IMAGE_DIR, filename)
+
+
+def normalize_name(name):
+    """Return the case and whitespace insensitive form of a name"""
+    return ' '.join(name.split()).casefold()
 
 
 class UserManager(BaseUserManager):
@@ -31,7 +52,9 @@ class UserManager(BaseUserManager):
             raise ValueError('Users must have an email address')
         if not password:
             raise ValueError('Users must have a password')
-        user = self.model(email=self.normalize_email(email), **extra_fields)
+        email = self.normalize_email(email)
+        extra_fields.setdefault('shard', shard_for_new_user(email))
+        user = self.model(email=email, **extra_fields)
         user.set_password(password)
         user.save(using=self._db)
 
@@ -63,16 +86,280 @@ class User(AbstractBaseUser, PermissionsMixin):
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    # Database alias holding the user's recipe data, see core.sharding
+    shard = models.CharField(max_length=50, default='default',
+                             editable=False)
 
     objects = UserManager()
 
     USERNAME_FIELD = 'email'
 
 
-class Recipe(models.Model):
+class AuthTokenManager(models.Manager):
+    """Manager for API tokens"""
+
+    def get_or_rotate(self, user):
+        """Return the user's token, replacing it if it has expired"""
+        token = self.db_manager(user.shard).filter(user=user).first()
+        if token is None or token.is_expired:
+            token = self.rotate(user)
+        return token
+
+    def rotate(self, user):
+        """Replace the user's token with a new one, on the user's shard"""
+        tokens = self.db_manager(user.shard)
+        with transaction.atomic(using=user.shard):
+            tokens.revoke(user_id=user.id)
+            return tokens.create(user=user)
+
+    def revoke(self, **filters):
+        """Delete the tokens matching `filters`, e.g. user_id__in=[...]
+
+        Deleting sends post_delete, which drops the tokens from the
+        authentication cache.
+        """
+        return self.filter(**filters).delete()
+
+
+class AuthToken(models.Model):
+    """API token that expires AUTH_TOKEN_TTL seconds after creation"""
+    key = models.CharField(max_length=40, primary_key=True)
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        db_constraint=False,
+        on_delete=models.CASCADE,
+        related_name='api_token'
+    )
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    last_used = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    objects = AuthTokenManager()
+
+    def save(self, *args, **kwargs):
+        if not self.key:
+            # The user id prefix tells authentication which shard to
+            # look the token up on.
+            prefix = f'{self.user_id}.'
+            self.key = prefix + binascii.hexlify(
+                os.urandom((40 - len(prefix)) // 2)).decode()
+        super().save(*args, **kwargs)
+
+    @property
+    def expires(self):
+        return self.created + timedelta(seconds=settings.AUTH_TOKEN_TTL)
+
+    @property
+    def is_expired(self):
+        return self.expires <= timezone.now()
+
+    def __str__(self):
+        return self.key
+
+
+class SyncStateManager(models.Manager):
+    """Manager for the per-user change counters"""
+
+    def next_version(self, user_id, count=1):
+        """Advance the user's change counter by `count` and return its new
+        value, the last of the `count` versions reserved
+
+        The counter row stays locked until the surrounding transaction
+        ends, so the user's changes become visible in version order.
+        Raises UserMoved if the user's data moved to another shard.
+        """
+        state = self.filter(user_id=user_id, moved_to='')
+        if not state.update(version=models.F('version') + count):
+            if self.get_or_create(user_id=user_id)[0].moved_to:
+                raise UserMoved()
+            state.update(version=models.F('version') + count)
+        notify_change(self.db, user_id)
+        return state.values_list('version', flat=True).get()
+
+
+class SyncState(models.Model):
+    """Version of the latest change to a user's recipe book"""
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        db_constraint=False,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='sync_state'
+    )
+    version = models.BigIntegerField(default=0)
+    # Tombstones up to this version were purged, older cursors must resync
+    pruned_version = models.BigIntegerField(default=0)
+    # Shard the user moved to, the counter is left behind as a fence
+    moved_to = models.CharField(max_length=50, blank=True, editable=False)
+
+    objects = SyncStateManager()
+
+
+class VersionedQuerySet(models.QuerySet):
+    """QuerySet of versioned objects"""
+
+    def update_versioned(self, **fields):
+        """Update the objects like update() does, giving each of them a
+        new version so the change reaches the delta sync, and queue their
+        updated events
+
+        Runs one UPDATE per batch of objects, no save() or signals.
+        """
+        with transaction.atomic(using=self.db):
+            rows = list(self.order_by('pk').values_list('pk', 'user_id'))
+            counts = Counter(user_id for _, user_id in rows)
+            states = SyncState.objects.db_manager(self.db)
+            versions = {
+                user_id: states.next_version(user_id, count) -
+                count + 1
+                for user_id, count in counts.items()
+            }
+            now = timezone.now()
+            objs = []
+            for pk, user_id in rows:
+                objs.append(self.model(pk=pk, updated_at=now,
+                                       version=versions[user_id], **fields))
+                versions[user_id] += 1
+            self.model.objects.db_manager(self.db).bulk_update(
+                objs, [*fields, 'version', 'updated_at'], batch_size=1000
+            )
+            for start in range(0, len(rows), 1000):
+                record_events(list(self.model._base_manager.using(
+                    self.db).filter(pk__in=[
+                        pk for pk, _ in rows[start:start + 1000]
+                    ]).order_by('pk')), 'updated', self.db)
+        return len(rows)
+
+
+class VersionConflict(Exception):
+    """The object was changed since the version it was read at"""
+
+
+class VersionedModel(models.Model):
+    """Base for per-user objects tracked by the delta sync
+
+    Every save takes the next version of the owner's change counter.
+    Plain queryset updates bypass save() and are not picked up by the
+    sync, use update_versioned() instead. The version also serves for
+    optimistic concurrency, see save().
+    """
+    updated_at = models.DateTimeField(auto_now=True)
+    version = models.BigIntegerField(default=0, editable=False)
+
+    objects = VersionedQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+        indexes = [
+            models.Index(fields=['user', 'version'],
+                         name='%(class)s_user_version_idx'),
+        ]
+
+    def save(self, *args, expected_version=None, event=True, **kwargs):
+        """Save the object with a new version
+
+        With `expected_version`, the UPDATE only applies if the stored
+        version still is that one, VersionConflict is raised otherwise.
+        With `event` False no webhook event is queued, for callers that
+        change more (e.g. links) and call record_events() once done.
+        """
+        using = kwargs.get('using') or \
+            router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            self.version = SyncState.objects.db_manager(
+                using).next_version(self.user_id)
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {
+                    *update_fields, 'version', 'updated_at'
+                }
+            self._expected_version = expected_version
+            self._record_event = event
+            try:
+                super().save(*args, **kwargs)
+            finally:
+                self._expected_version = None
+                self._record_event = True
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields,
+                   forced_update):
+        expected = getattr(self, '_expected_version', None)
+        if expected is None:
+            return super()._do_update(base_qs, using, pk_val, values,
+                                      update_fields, forced_update)
+        if not super()._do_update(base_qs.filter(version=expected), using,
+                                  pk_val, values, update_fields,
+                                  forced_update):
+            raise VersionConflict(pk_val)
+        return True
+
+    def touch(self):
+        """Give the object a new version without changing it"""
+        self.save(update_fields=[])
+
+
+class Tombstone(models.Model):
+    """Record of a deleted versioned object for the delta sync"""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        db_constraint=False,
+        on_delete=models.CASCADE,
+        related_name='tombstones'
+    )
+    model = models.CharField(max_length=50)
+    object_id = models.BigIntegerField()
+    version = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'version'],
+                         name='tombstone_user_version_idx'),
+        ]
+
+
+def _deleting_user(origin):
+    """Return True if the deletion started from a user"""
+    meta = getattr(getattr(origin, 'model', origin), '_meta', None)
+    return meta is not None and meta.label == settings.AUTH_USER_MODEL
+
+
+def record_tombstone(sender, instance, using, origin=None, **kwargs):
+    """post_delete receiver recording the deletion of a versioned object
+
+    Objects deleted along with their user need no tombstone.
+    """
+    if _deleting_user(origin):
+        return
+    Tombstone.objects.using(using).create(
+        user_id=instance.user_id,
+        model=sender._meta.model_name,
+        object_id=instance.pk,
+        version=SyncState.objects.db_manager(using).next_version(
+            instance.user_id),
+    )
+
+
+def touch_changed_recipes(sender, instance, action, reverse, pk_set,
+                          using, **kwargs):
+    """m2m_changed receiver giving recipes whose tags or ingredients
+    changed a new version"""
+    if action not in ('post_add', 'post_remove', 'post_clear') or \
+            (action != 'post_clear' and not pk_set):
+        return
+    if not reverse:
+        instance.touch()
+    elif pk_set:
+        for recipe in Recipe.objects.using(using).filter(pk__in=pk_set):
+            recipe.touch()
+
+
+class Recipe(VersionedModel):
     """Recipe object"""
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
+        db_constraint=False,
+        # Covered by recipe_user_id_idx
+        db_index=False,
         on_delete=models.CASCADE,
         related_name='recipes'
     )
@@ -81,35 +368,353 @@ class Recipe(models.Model):
     description = models.TextField(blank=True)
     time_minutes = models.IntegerField()
     link = models.CharField(max_length=255, blank=True)
-    tags = models.ManyToManyField("Tag")
-    ingredients = models.ManyToManyField('Ingredient')
-    image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    tags = models.ManyToManyField("Tag", through='RecipeTag')
+    ingredients = models.ManyToManyField('Ingredient',
+                                         through='RecipeIngredient')
+    image = models.ImageField(null=True,
+                              upload_to=recipe_image_file_path,
+                              storage=recipe_image_storage,
+                              db_index=True)
+
+    class Meta(VersionedModel.Meta):
+        # The recipe list orderings, filtered by the user and ending with
+        # the id for keyset pagination, see recipe.pagination
+        indexes = VersionedModel.Meta.indexes + [
+            models.Index(fields=['user', 'id'], name='recipe_user_id_idx'),
+            models.Index(fields=['user', 'price', 'id'],
+                         name='recipe_user_price_idx'),
+            models.Index(fields=['user', 'time_minutes', 'id'],
+                         name='recipe_user_time_idx'),
+            models.Index(fields=['user', 'title', 'id'],
+                         name='recipe_user_title_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the stored image to release it once replaced"""
+        instance = super().from_db(db, field_names, values)
+        instance._stored_image = instance.__dict__.get('image')
+        return instance
 
     def __str__(self):
         """Return the model as a string in admin"""
         return self.title
 
 
-class Tag(models.Model):
-    """Tag for filtering recipes."""
+def release_recipe_image(name, using=None):
+    """Delete an image file once no recipe on any shard references it any
+    more"""
+    if name:
+        transaction.on_commit(lambda: recipe_image_storage.delete_if_orphaned(
+            name, [Recipe.objects.using(alias).filter(image=name)
+                   for alias in settings.DATABASE_SHARDS]
+        ), using=using)
+
+
+def release_replaced_recipe_image(sender, instance, using, **kwargs):
+    """post_save receiver releasing the image a recipe no longer uses"""
+    stored = getattr(instance, '_stored_image', None)
+    instance._stored_image = instance.image.name
+    if stored and stored != instance.image.name:
+        release_recipe_image(stored, using)
+
+
+def release_deleted_recipe_image(sender, instance, using, **kwargs):
+    """post_delete receiver releasing the image of a deleted recipe"""
+    release_recipe_image(instance.image.name, using)
+
+
+class NamedObjectManager(models.Manager.from_queryset(VersionedQuerySet)):
+    """Manager for per-user objects identified by their normalized name"""
+
+    def get_or_create_by_name(self, user, name):
+        """Return the user's object matching `name` ignoring case and
+        whitespace, creating it with `name` if there is none"""
+        return self.get_or_create(
+            user=user,
+            normalized_name=normalize_name(name),
+            defaults={'name': name}
+        )
+
+
+class NamedObject(VersionedModel):
+    """Base for per-user objects whose names are unique ignoring case and
+    whitespace, so "Salt", "salt " and "SALT" are the same object."""
     name = models.CharField(max_length=255)
+    normalized_name = models.CharField(max_length=255, editable=False)
+
+    objects = NamedObjectManager()
+
+    class Meta(VersionedModel.Meta):
+        abstract = True
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'normalized_name'],
+                name='unique_%(class)s_name_per_user'
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_name(self.name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'name' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'normalized_name'}
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.name
+
+
+class Tag(NamedObject):
+    """Tag for filtering recipes."""
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
+        db_constraint=False,
         on_delete=models.CASCADE,
         related_name="tags")
 
-    def __str__(self):
-        return self.name
-
 
-class Ingredient(models.Model):
+class Ingredient(NamedObject):
     """Ingredients for recipes"""
-    name = models.CharField(max_length=255)
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
+        db_constraint=False,
         on_delete=models.CASCADE,
         related_name="ingredients"
     )
 
+
+class RecipeLinkQuerySet(models.QuerySet):
+    """QuerySet of recipe links filling in the recipe's user
+
+    The related managers (recipe.tags.add() and the like) create links
+    with bulk_create() and no user, the user is looked up here.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        recipe_ids = {obj.recipe_id for obj in objs if obj.user_id is None}
+        if recipe_ids:
+            owners = dict(Recipe.objects.using(self.db).filter(
+                pk__in=recipe_ids).values_list('pk', 'user_id'))
+            for obj in objs:
+                if obj.user_id is None:
+                    obj.user_id = owners[obj.recipe_id]
+        return super().bulk_create(objs, *args, **kwargs)
+
+
+class RecipeLink(models.Model):
+    """Base for the recipe M2M through models
+
+    Links carry the recipe's user so the tables can be partitioned by
+    user like the tables they link, see core.partitioning.
+    """
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        db_constraint=False,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+
+    objects = RecipeLinkQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+
+class RecipeTag(RecipeLink):
+    """Tag of a recipe"""
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
+
+    class Meta:
+        db_table = 'core_recipe_tags'
+        unique_together = [['recipe', 'tag']]
+
+
+class RecipeIngredient(RecipeLink):
+    """Ingredient of a recipe"""
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
+
+    class Meta:
+        db_table = 'core_recipe_ingredients'
+        unique_together = [['recipe', 'ingredient']]
+
+
+class AccountDeletionManager(models.Manager):
+    """Manager for the queue of account deletions"""
+
+    def enqueue(self, user):
+        """Deactivate the user at once and queue the deletion of their
+        account and everything they own"""
+        with transaction.atomic():
+            user.is_active = False
+            user.save(update_fields=['is_active'])
+            return self.get_or_create(user=user)[0]
+
+    def claim(self, lease):
+        """Lease the oldest pending deletion for `lease` seconds and
+        return it, or None if there is none
+
+        Deletions leased by other workers are skipped without waiting, an
+        expired lease (its worker died) can be claimed again.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            deletion = self.select_for_update(skip_locked=True).filter(
+                models.Q(leased_until__isnull=True) |
+                models.Q(leased_until__lte=now),
+                finished__isnull=True,
+            ).order_by('requested').first()
+            if deletion is not None:
+                deletion.leased_until = now + timedelta(seconds=lease)
+                deletion.attempts += 1
+                deletion.save(update_fields=['leased_until', 'attempts'])
+        return deletion
+
+
+class AccountDeletion(models.Model):
+    """Queued deletion of a deactivated user, see core.deletion"""
+    # Kept once the user is gone, to report the deletion
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        db_constraint=False,
+        on_delete=models.DO_NOTHING,
+        related_name='+'
+    )
+    requested = models.DateTimeField(auto_now_add=True)
+    leased_until = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    deleted_rows = models.BigIntegerField(default=0)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    objects = AccountDeletionManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['requested'],
+                         condition=models.Q(finished__isnull=True),
+                         name='accountdeletion_pending_idx'),
+        ]
+
+
+class IdempotencyKey(models.Model):
+    """Response of a request sent with an Idempotency-Key header, replayed
+    to repeats of the request for IDEMPOTENCY_KEY_TTL seconds, stored on
+    the shard of the user who sent it, see core.idempotency"""
+    # Who sent the key, user:<id> or anon:<client address>
+    scope = models.CharField(max_length=100)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField()
+    response = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'],
+                                    name='unique_idempotency_key'),
+        ]
+
+
+class Webhook(models.Model):
+    """URL the recipe, tag and ingredient events are posted to, see
+    core.webhooks"""
+    url = models.URLField(max_length=500)
+    # Key of the HMAC-SHA256 signature of the posted body, if set
+    secret = models.CharField(max_length=255, blank=True)
+    is_active = models.BooleanField(default=True)
+    created = models.DateTimeField(auto_now_add=True)
+
     def __str__(self):
-        return self.name
+        return self.url
+
+
+class OutboxEvent(models.Model):
+    """Change of a recipe, tag or ingredient waiting to be posted to the
+    webhooks, written in the transaction of the change"""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        db_constraint=False,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    # e.g. recipe.created, tag.deleted
+    type = models.CharField(max_length=50)
+    object_id = models.BigIntegerField()
+    data = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created = models.DateTimeField(default=timezone.now)
+    # Ids of the webhooks that have the event
+    delivered_to = models.JSONField(default=list)
+    attempts = models.PositiveIntegerField(default=0)
+    # None once the attempts ran out
+    next_attempt = models.DateTimeField(null=True, default=timezone.now)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_attempt', 'id'],
+                         name='outboxevent_due_idx'),
+        ]
+
+
+def _event_data(instance):
+    """Return the stored fields of a saved object"""
+    data = {}
+    for field in instance._meta.concrete_fields:
+        value = field.value_from_object(instance)
+        if isinstance(value, models.fields.files.FieldFile):
+            value = value.name or None
+        data[field.attname] = value
+    return data
+
+
+def record_events(objs, action, using):
+    """Queue `action` (created or updated) events of saved objects of one
+    model, with the stored fields and the ids of their m2m links
+
+    Reads the links with one query per m2m field and writes the events
+    with one INSERT.
+    """
+    if not objs:
+        return
+    model = type(objs[0])
+    data = {obj.pk: _event_data(obj) for obj in objs}
+    for field in model._meta.many_to_many:
+        for obj in objs:
+            data[obj.pk][field.name] = []
+        source = field.m2m_column_name()
+        links = field.remote_field.through.objects.using(using).filter(
+            **{f'{source}__in': list(data)}).order_by('pk')
+        for obj_id, linked_id in links.values_list(
+                source, field.m2m_reverse_name()):
+            data[obj_id][field.name].append(linked_id)
+    OutboxEvent.objects.using(using).bulk_create([
+        OutboxEvent(user_id=obj.user_id,
+                    type=f'{model._meta.model_name}.{action}',
+                    object_id=obj.pk, data=data[obj.pk])
+        for obj in objs
+    ])
+
+
+def record_saved_event(sender, instance, created, raw, using, **kwargs):
+    """post_save receiver queueing a created or updated event
+
+    Copies of a user's rows to another shard (raw saves) are no changes,
+    and saves with event=False leave the event to their caller.
+    """
+    if raw or not getattr(instance, '_record_event', True):
+        return
+    record_events([instance], 'created' if created else 'updated', using)
+
+
+def record_deleted_event(sender, instance, using, origin=None, **kwargs):
+    """post_delete receiver queueing a deleted event, none for objects
+    deleted along with their user"""
+    if _deleting_user(origin):
+        return
+    OutboxEvent.objects.using(using).create(
+        user_id=instance.user_id,
+        type=f'{sender._meta.model_name}.deleted',
+        object_id=instance.pk,
+    )
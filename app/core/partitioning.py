@@ -0,0 +1,167 @@
+"""
+Hash partitioning of the per-user tables by user_id on Postgres
+"""
+import json
+
+from django.db import transaction
+
+
+# Partitioned together: a foreign key to a partitioned table has to
+# include its partition key, so links reference recipes, tags and
+# ingredients by (id, user_id).
+TABLES = [
+    'core_recipe',
+    'core_tag',
+    'core_ingredient',
+    'core_recipe_tags',
+    'core_recipe_ingredients',
+]
+
+
+def is_partitioned(cursor, table):
+    cursor.execute(
+        'SELECT EXISTS (SELECT 1 FROM pg_partitioned_table '
+        'WHERE partrelid = %s::regclass)', [table])
+    return cursor.fetchone()[0]
+
+
+def _indexes(cursor, table):
+    """Return the definitions of the table's indexes that do not back
+    one of its constraints"""
+    cursor.execute('''
+        SELECT pg_get_indexdef(i.indexrelid) FROM pg_index i
+        WHERE i.indrelid = %s::regclass AND NOT EXISTS (
+            SELECT 1 FROM pg_constraint c
+            WHERE c.conrelid = i.indrelid AND c.conindid = i.indexrelid
+        )
+    ''', [table])
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _constraints(cursor, table):
+    """Return (name, definition) of the table's unique, check and foreign
+    key constraints, rewritten to include user_id where partitioning
+    requires it"""
+    cursor.execute('''
+        SELECT c.conname, c.contype, pg_get_constraintdef(c.oid),
+               c.confrelid::regclass::text,
+               ARRAY(SELECT a.attname::text
+                     FROM unnest(c.conkey) WITH ORDINALITY k(num, n)
+                     JOIN pg_attribute a ON a.attrelid = c.conrelid
+                                        AND a.attnum = k.num
+                     ORDER BY k.n),
+               ARRAY(SELECT a.attname::text
+                     FROM unnest(c.confkey) WITH ORDINALITY k(num, n)
+                     JOIN pg_attribute a ON a.attrelid = c.confrelid
+                                        AND a.attnum = k.num
+                     ORDER BY k.n)
+        FROM pg_constraint c
+        WHERE c.conrelid = %s::regclass AND c.contype IN ('u', 'c', 'f')
+    ''', [table])
+    constraints = []
+    for name, kind, definition, target, columns, ref_columns in \
+            cursor.fetchall():
+        if kind == 'u' and 'user_id' not in columns:
+            definition = f'UNIQUE (user_id, {", ".join(columns)})'
+        elif kind == 'f' and target in TABLES:
+            definition = (
+                f'FOREIGN KEY ({", ".join(columns)}, user_id) '
+                f'REFERENCES {target} ({", ".join(ref_columns)}, user_id) '
+                f'DEFERRABLE INITIALLY DEFERRED'
+            )
+        constraints.append((kind, name, definition))
+    return constraints
+
+
+def _referencing_tables(cursor, table):
+    cursor.execute(
+        'SELECT conrelid::regclass::text FROM pg_constraint '
+        'WHERE contype = %s AND confrelid = %s::regclass', ['f', table])
+    return {row[0] for row in cursor.fetchall()}
+
+
+def _sequence_value(cursor, table):
+    """Return (last_value, is_called) of the sequence of the table's id,
+    which may start at its shard's id range, see core.sharding"""
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+    sequence = cursor.fetchone()[0]
+    cursor.execute(f'SELECT last_value, is_called FROM {sequence}')
+    return cursor.fetchone()
+
+
+def partition_by_user(connection, partitions):
+    """Turn TABLES into tables hash partitioned by user_id
+
+    Each table is rebuilt: renamed, recreated with `partitions`
+    partitions, copied and dropped, with its indexes and constraints
+    recreated. Primary keys become (id, user_id), as must every unique
+    constraint, and ids go on from where the old sequence was. Runs in
+    one transaction holding exclusive locks on the tables, so the API
+    must be stopped for it. Returns False if the tables are already
+    partitioned.
+    """
+    with transaction.atomic(using=connection.alias), \
+            connection.cursor() as cursor:
+        if is_partitioned(cursor, TABLES[0]):
+            return False
+        for table in TABLES:
+            outside = _referencing_tables(cursor, table) - set(TABLES)
+            if outside:
+                raise ValueError(f'{table} is referenced by {outside}, '
+                                 f'which is not partitioned')
+        indexes = {table: _indexes(cursor, table) for table in TABLES}
+        constraints = {table: _constraints(cursor, table)
+                       for table in TABLES}
+        sequences = {table: _sequence_value(cursor, table)
+                     for table in TABLES}
+
+        for table in TABLES:
+            old = f'{table}_unpartitioned'
+            cursor.execute(f'ALTER TABLE {table} RENAME TO {old}')
+            # LIKE copies the columns in order, without the identity.
+            cursor.execute(f'CREATE TABLE {table} (LIKE {old} INCLUDING '
+                           f'DEFAULTS) PARTITION BY HASH (user_id)')
+            for remainder in range(partitions):
+                cursor.execute(
+                    f'CREATE TABLE {table}_p{remainder} PARTITION OF '
+                    f'{table} FOR VALUES WITH (MODULUS {partitions}, '
+                    f'REMAINDER {remainder})')
+            cursor.execute(f'INSERT INTO {table} SELECT * FROM {old}')
+        for table in TABLES:
+            cursor.execute(f'DROP TABLE {table}_unpartitioned CASCADE')
+
+        for table in TABLES:
+            cursor.execute(f'ALTER TABLE {table} ADD PRIMARY KEY '
+                           f'(id, user_id)')
+            # Named like Django's, so pg_get_serial_sequence() finds it.
+            cursor.execute(f'CREATE SEQUENCE {table}_id_seq '
+                           f'OWNED BY {table}.id')
+            cursor.execute(f"ALTER TABLE {table} ALTER COLUMN id SET "
+                           f"DEFAULT nextval('{table}_id_seq')")
+            cursor.execute('SELECT setval(%s, %s, %s)',
+                           [f'{table}_id_seq', *sequences[table]])
+            for definition in indexes[table]:
+                cursor.execute(definition)
+        # Foreign keys last, they need the referenced primary keys.
+        for kinds in ('uc', 'f'):
+            for table in TABLES:
+                for kind, name, definition in constraints[table]:
+                    if kind in kinds:
+                        cursor.execute(f'ALTER TABLE {table} ADD '
+                                       f'CONSTRAINT {name} {definition}')
+        for table in TABLES:
+            cursor.execute(f'ANALYZE {table}')
+    return True
+
+
+def scanned_relations(plan):
+    """Return the names of the tables and partitions read by the plan of
+    QuerySet.explain(format='json')"""
+    relations = set()
+    nodes = [node['Plan'] for node in json.loads(plan)]
+    while nodes:
+        node = nodes.pop()
+        if 'Relation Name' in node:
+            relations.add(node['Relation Name'])
+        nodes.extend(node.get('Plans', []))
+    return relations
@@ -0,0 +1,149 @@
+"""
+OpenAPI schema built once per process and served from memory
+"""
+import hashlib
+import os
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import (get_conditional_response,
+                                patch_cache_control,
+                                patch_vary_headers)
+from drf_spectacular.renderers import OpenApiJsonRenderer, OpenApiYamlRenderer
+from drf_spectacular.settings import spectacular_settings
+from drf_spectacular.utils import extend_schema
+from drf_spectacular.views import SCHEMA_KWARGS, SpectacularAPIView
+
+from core.compression import COMPRESSORS, negotiate
+
+
+# Renderer format to renderer of the served schema variants
+FORMATS = {'yaml': OpenApiYamlRenderer, 'json': OpenApiJsonRenderer}
+# File name suffixes of the precompressed variants
+SUFFIXES = {'gzip': '.gz', 'br': '.br', 'zstd': '.zst'}
+
+
+class SchemaVariant:
+    """The schema rendered in one format, with precompressed encodings"""
+
+    def __init__(self, content, compressed):
+        self.content = content
+        self.compressed = compressed
+        # Weak, the encodings share it
+        self.etag = 'W/"%s"' % hashlib.sha256(content).hexdigest()[:32]
+
+
+def render_schema():
+    """Generate the public schema and return {format: SchemaVariant}"""
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS(
+        urlconf=spectacular_settings.SERVE_URLCONF)
+    schema = generator.get_schema(request=None, public=True)
+    variants = {}
+    for fmt, renderer_class in FORMATS.items():
+        content = renderer_class().render(schema, renderer_context={})
+        # Compressed once, so at the highest level.
+        variants[fmt] = SchemaVariant(content, {
+            encoding: compressor(max(compressor.levels)).compress(content)
+            for encoding, compressor in COMPRESSORS.items()
+        })
+    return variants
+
+
+def _path(directory, fmt, encoding=None):
+    suffix = SUFFIXES.get(encoding, '')
+    return os.path.join(directory, f'schema.{fmt}{suffix}')
+
+
+def write_schema(directory, variants):
+    """Write the schema variants to `directory`"""
+    os.makedirs(directory, exist_ok=True)
+    for fmt, variant in variants.items():
+        files = {None: variant.content, **variant.compressed}
+        for encoding, content in files.items():
+            path = _path(directory, fmt, encoding)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(content)
+            os.replace(path + '.tmp', path)
+
+
+def load_schema(directory):
+    """Return the schema variants written to `directory`, or None"""
+    variants = {}
+    for fmt in FORMATS:
+        try:
+            with open(_path(directory, fmt), 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        compressed = {}
+        for encoding in COMPRESSORS:
+            try:
+                with open(_path(directory, fmt, encoding), 'rb') as f:
+                    compressed[encoding] = f.read()
+            except FileNotFoundError:
+                pass
+        variants[fmt] = SchemaVariant(content, compressed)
+    return variants
+
+
+class SchemaCache:
+    """Schema variants loaded from SCHEMA_CACHE_DIR, or generated, on
+    first use"""
+
+    def __init__(self):
+        self._variants = None
+        self._lock = threading.Lock()
+
+    def get(self, fmt):
+        """Return the SchemaVariant for the renderer format `fmt`"""
+        with self._lock:
+            if self._variants is None:
+                if settings.SCHEMA_CACHE_DIR:
+                    self._variants = load_schema(settings.SCHEMA_CACHE_DIR)
+                if self._variants is None:
+                    self._variants = render_schema()
+            return self._variants[fmt]
+
+    def clear(self):
+        with self._lock:
+            self._variants = None
+
+
+schema_cache = SchemaCache()
+
+
+class CachedSchemaView(SpectacularAPIView):
+    """SpectacularAPIView serving the schema from `schema_cache`
+
+    Responses carry an ETag and are sent precompressed when the client
+    accepts one of the encodings. Requests for a particular API version or
+    language are generated as usual.
+    """
+
+    @extend_schema(**SCHEMA_KWARGS)
+    def get(self, request, *args, **kwargs):
+        if self.custom_settings or request.GET.get('lang') or \
+                request.GET.get('version'):
+            return super().get(request, *args, **kwargs)
+
+        renderer = request.accepted_renderer
+        variant = schema_cache.get(renderer.format)
+        response = get_conditional_response(request, etag=variant.etag)
+        if response is None:
+            compressor = negotiate(request.META.get('HTTP_ACCEPT_ENCODING',
+                                                    ''))
+            encoding = compressor and compressor.encoding
+            if encoding in variant.compressed:
+                response = HttpResponse(variant.compressed[encoding])
+                response['Content-Encoding'] = encoding
+            else:
+                response = HttpResponse(variant.content)
+            response['Content-Type'] = renderer.media_type
+            response['Content-Disposition'] = (
+                f'inline; filename="{self._get_filename(request, None)}"')
+        response['ETag'] = variant.etag
+        patch_vary_headers(response, ['Accept', 'Accept-Encoding'])
+        patch_cache_control(response, public=True,
+                            max_age=settings.SCHEMA_CACHE_MAX_AGE)
+        return response
@@ -0,0 +1,222 @@
+"""
+Per-user sharding of the recipe data over several databases
+
+Users live on the default database, which holds the shard map (the
+User.shard column). Everything else a user owns lives on their shard, one
+of the DATABASE_SHARDS aliases. Queries are routed to the shard of the
+instance they are about or else to the current shard, which token
+authentication sets for the request. Each shard hands out primary keys
+from its own range, so rows keep them when a user moves.
+"""
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+# In the order they are copied, they are deleted in reverse
+SHARDED_MODELS = [
+    'core.syncstate',
+    'core.tag',
+    'core.ingredient',
+    'core.recipe',
+    'core.recipetag',
+    'core.recipeingredient',
+    'core.tombstone',
+    'core.outboxevent',
+    'core.authtoken',
+]
+
+# Primary keys of the shard at position n of DATABASE_SHARDS start after
+# n * SHARD_ID_RANGE, keeping ids below 2**53 for 8192 shards
+SHARD_ID_RANGE = 2 ** 40
+
+_current_shard = ContextVar('current_shard', default=None)
+# Database `manage.py migrate` is migrating, data migrations use it only
+_migrating = ContextVar('migrating', default=None)
+
+
+class UserMoved(APIException):
+    """The user's data moved to another shard since the request was routed
+    to this one"""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _('Your recipes are being moved, try again.')
+    default_code = 'user_moved'
+    # Sent as Retry-After
+    wait = 1
+
+
+def activate_shard(alias):
+    """Route queries without an instance to `alias` for the rest of the
+    request"""
+    _current_shard.set(alias)
+
+
+def reset_shard(sender=None, **kwargs):
+    """request_started/request_finished receiver clearing the current
+    shard, so it does not outlive the request"""
+    _current_shard.set(None)
+
+
+def start_migration(sender, using, **kwargs):
+    """pre_migrate receiver routing every query to the database being
+    migrated, so data migrations read and write that one"""
+    _migrating.set(using)
+
+
+def end_migration(sender, **kwargs):
+    """post_migrate receiver undoing start_migration"""
+    _migrating.set(None)
+
+
+@contextmanager
+def use_shard(alias):
+    """Route queries without an instance to `alias` within the block"""
+    token = _current_shard.set(alias)
+    try:
+        yield
+    finally:
+        _current_shard.reset(token)
+
+
+def shard_for_new_user(email):
+    """Return the shard a new user is placed on, chosen among
+    DATABASE_SHARDS_FOR_NEW_USERS by the hash of the email"""
+    aliases = settings.DATABASE_SHARDS_FOR_NEW_USERS
+    return aliases[zlib.crc32(email.encode()) % len(aliases)]
+
+
+class ShardRouter:
+    """Route the per-user models to their user's shard and the rest to the
+    default database"""
+
+    def _db(self, model, **hints):
+        if _migrating.get():
+            return _migrating.get()
+        if model._meta.label_lower not in SHARDED_MODELS:
+            # Not the database of a sharded instance given as a hint
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db and \
+                instance._meta.label_lower in SHARDED_MODELS:
+            return instance._state.db
+        return _current_shard.get()
+
+    db_for_read = _db
+    db_for_write = _db
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Users on the default database own objects on every shard.
+        return True
+
+
+def _models():
+    from django.apps import apps
+    return [apps.get_model(label) for label in SHARDED_MODELS]
+
+
+def reserve_ids(sender, using, **kwargs):
+    """post_migrate receiver moving the primary key sequences of the
+    sharded tables of the `using` shard to the start of its id range"""
+    if using not in settings.DATABASE_SHARDS:
+        return
+    start = settings.DATABASE_SHARDS.index(using) * SHARD_ID_RANGE
+    connection = connections[using]
+    if not start or connection.vendor not in ('postgresql', 'sqlite'):
+        return
+    tables = set(connection.introspection.table_names())
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        for model in _models():
+            table = model._meta.db_table
+            if table not in tables or \
+                    model._meta.pk.get_internal_type() != 'BigAutoField':
+                continue
+            if connection.vendor == 'sqlite':
+                cursor.execute('SELECT seq FROM sqlite_sequence '
+                               'WHERE name = %s', [table])
+                row = cursor.fetchone()
+                if row is None:
+                    cursor.execute('INSERT INTO sqlite_sequence (name, seq) '
+                                   'VALUES (%s, %s)', [table, start])
+                elif row[0] < start:
+                    cursor.execute('UPDATE sqlite_sequence SET seq = %s '
+                                   'WHERE name = %s', [start, table])
+                continue
+            cursor.execute('SELECT pg_get_serial_sequence(%s, %s)',
+                           [table, model._meta.pk.column])
+            sequence = cursor.fetchone()[0]
+            if sequence is not None:
+                cursor.execute(f'SELECT setval(%s, %s) FROM {sequence} '
+                               f'WHERE last_value < %s',
+                               [sequence, start, start])
+
+
+def delete_user_data(alias, user_id, keep=()):
+    """Delete everything the user owns on the `alias` database but the
+    models labelled in `keep`, without signals, so no tombstones are
+    recorded"""
+    connection = connections[alias]
+    with transaction.atomic(using=alias), connection.cursor() as cursor:
+        for model in reversed(_models()):
+            if model._meta.label_lower in keep:
+                continue
+            table = connection.ops.quote_name(model._meta.db_table)
+            cursor.execute(f'DELETE FROM {table} WHERE user_id = %s',
+                           [user_id])
+
+
+def delete_sharded_user_data(sender, instance, **kwargs):
+    """pre_delete receiver deleting the data of a user on another shard,
+    which the cascade on the default database does not reach"""
+    if instance.shard != DEFAULT_DB_ALIAS:
+        delete_user_data(instance.shard, instance.pk)
+
+
+def move_user(user, target):
+    """Move everything `user` owns to the `target` shard
+
+    The user's change counter stays locked on the source shard while the
+    rows are copied, so their writes wait for the move to finish and
+    their reads keep being served. The counter is then left behind
+    flagged with the target, writers that waited for it and requests
+    still routed to the source fail with UserMoved. Rows keep their
+    primary keys, which are unique across shards. Returns the number of
+    rows copied.
+    """
+    from core.authentication import forget_tokens
+    from core.models import AuthToken, SyncState
+    source = user.shard
+    if source == target:
+        return 0
+    # Left over by an interrupted move, or the flag of an earlier move
+    delete_user_data(target, user.pk)
+    copied = 0
+    with transaction.atomic(using=source):
+        list(SyncState.objects.using(source).select_for_update()
+             .filter(user_id=user.pk))
+        keys = list(AuthToken.objects.using(source).filter(
+            user_id=user.pk).values_list('key', flat=True))
+        # Authentication looks the user's shard up again from now on
+        forget_tokens(keys)
+        with transaction.atomic(using=target):
+            for model in _models():
+                objs = model._base_manager.using(source).filter(
+                    user_id=user.pk).order_by('pk')
+                for obj in objs.iterator(chunk_size=1000):
+                    # As loaddata does, raw keeps auto_now values and
+                    # skips save().
+                    model.save_base(obj, using=target, raw=True,
+                                    force_insert=True)
+                    copied += 1
+        type(user)._base_manager.filter(pk=user.pk).update(shard=target)
+        SyncState.objects.using(source).filter(user_id=user.pk).update(
+            moved_to=target)
+        delete_user_data(source, user.pk, keep=['core.syncstate'])
+    user.shard = target
+    forget_tokens(keys)
+    return copied
@@ -0,0 +1,113 @@
+"""
+Content addressed storage for uploaded recipe images
+"""
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+CONTENT_ADDRESSED_NAME_RE = re.compile(
+    r'(^|/)[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$'
+)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage naming files after the SHA-256 of their content
+
+    Only the directory and extension of the name proposed by `upload_to`
+    are kept, the file is stored as ``<dir>/<hash[:2]>/<hash><ext>``.
+    Saving content that is already stored reuses the existing file, so
+    identical uploads share one file on disk.
+    """
+
+    def _save(self, name, content):
+        directory = os.path.dirname(name)
+        ext = os.path.splitext(name)[1].lower()
+        digest = getattr(content, 'sha256', None)
+
+        if digest is None or not hasattr(content, 'temporary_file_path'):
+            return self._save_streaming(directory, ext, content)
+
+        # The upload handler already hashed the upload while receiving it.
+        name = self._content_name(directory, digest, ext)
+        if self._reuse(name):
+            return name
+        full_path = self.path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        file_move_safe(content.temporary_file_path(), full_path,
+                       allow_overwrite=True)
+        self._set_permissions(full_path)
+        return name
+
+    def _save_streaming(self, directory, ext, content):
+        """Hash the content while writing it to a temporary file next to
+        its final location, then rename it into place."""
+        tmp_dir = self.path(directory)
+        os.makedirs(tmp_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, suffix='.upload')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    tmp.write(chunk)
+
+            name = self._content_name(directory, digest.hexdigest(), ext)
+            if self._reuse(name):
+                os.unlink(tmp_path)
+                return name
+            full_path = self.path(name)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            # Identical content, so replacing a concurrent write is safe.
+            os.replace(tmp_path, full_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self._set_permissions(full_path)
+        return name
+
+    def _content_name(self, directory, digest, ext):
+        return os.path.join(directory, digest[:2], f'{digest}{ext}')
+
+    def _reuse(self, name):
+        """Return True when `name` is already stored, refreshing its mtime
+        so a concurrent orphan cleanup leaves it alone."""
+        try:
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _set_permissions(self, full_path):
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+
+    def delete_if_orphaned(self, name, references):
+        """Delete `name` when none of `references` (querysets, one per
+        shard) finds a row using it, unless the file was written or reused
+        within the last IMAGE_ORPHAN_GRACE_SECONDS. Returns True if the
+        file was deleted."""
+        if any(queryset.exists() for queryset in references):
+            return False
+        grace = settings.IMAGE_ORPHAN_GRACE_SECONDS
+        try:
+            if os.path.getmtime(self.path(name)) > time.time() - grace:
+                return False
+        except FileNotFoundError:
+            return False
+        self.delete(name)
+        return True
+
+
+recipe_image_storage = ContentAddressedStorage()
@@ -0,0 +1,14 @@
+"""
+Functions the process pool tests run in pool processes, which unpickle
+them without setting up Django, so this module imports no models
+"""
+import os
+
+
+def exit_outside(pid, marker):
+    """Kill the calling process unless it is `pid`, creating the file
+    `marker` first"""
+    if os.getpid() != pid:
+        open(marker, 'w').close()
+        os._exit(1)
+    return pid
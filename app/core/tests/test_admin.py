@@ -2,11 +2,19 @@
 Test for Django Admin Modifications
 """
 
+from decimal import Decimal
+from unittest import skipUnless
+
+from django.conf import settings
 from django.test import TestCase, Client
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 
+from core.models import OutboxEvent, Recipe, Tag
+
 
+@skipUnless('django.contrib.admin' in settings.INSTALLED_APPS,
+            'The admin is left out of the API-only settings')
 class AdminSiteTests(TestCase):
     """Tests for Django Admin"""
 
@@ -51,3 +59,72 @@ class AdminSiteTests(TestCase):
 
         # check that the response is 200 OK
         self.assertEqual(res.status_code, 200)
+
+    def test_recipe_changelist_search(self):
+        """Test recipes are searched by title prefix"""
+        Recipe.objects.create(user=self.user, title='Pasta bake',
+                              time_minutes=5, price=Decimal('1.00'))
+        Recipe.objects.create(user=self.user, title='Baked pasta',
+                              time_minutes=5, price=Decimal('1.00'))
+        url = reverse('admin:core_recipe_changelist')
+
+        res = self.client.get(url, {'q': 'PASTA'})
+
+        self.assertContains(res, 'Pasta bake')
+        self.assertNotContains(res, 'Baked pasta')
+
+    def test_recipe_change_page(self):
+        """Test the recipe edit page does not list users or tags"""
+        recipe = Recipe.objects.create(user=self.user, title='Soup',
+                                       time_minutes=5, price=Decimal('1.00'))
+        other = get_user_model().objects.create_user(
+            email='other@example.com', password='Other@123')
+        url = reverse('admin:core_recipe_change', args=[recipe.id])
+
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertContains(res, 'admin-autocomplete')
+        self.assertNotContains(res, other.email)
+
+    def test_detach_tags_action(self):
+        """Test the bulk action unlinks tags and bumps recipe versions"""
+        recipe = Recipe.objects.create(user=self.user, title='Soup',
+                                       time_minutes=5, price=Decimal('1.00'))
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe.tags.add(tag)
+        recipe.refresh_from_db()
+        version = recipe.version
+
+        self.client.post(reverse('admin:core_tag_changelist'), {
+            'action': 'detach_from_recipes',
+            '_selected_action': [tag.id],
+        })
+
+        recipe.refresh_from_db()
+        self.assertFalse(recipe.tags.exists())
+        self.assertGreater(recipe.version, version)
+
+    def test_change_recipe_tags(self):
+        """Test tags are linked by id on the recipe page, with one event
+        carrying the links"""
+        recipe = Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5,
+            price=Decimal('1.00'), image='uploads/recipe/soup.jpg')
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        links = {f'{prefix}-{name}': value
+                 for prefix in ('recipetag_set', 'recipeingredient_set')
+                 for name, value in (('TOTAL_FORMS', 0),
+                                     ('INITIAL_FORMS', 0))}
+        links.update({'recipetag_set-TOTAL_FORMS': 1,
+                      'recipetag_set-0-tag': tag.id})
+
+        res = self.client.post(
+            reverse('admin:core_recipe_change', args=[recipe.id]), {
+                'user': self.user.id, 'title': 'Soup', 'time_minutes': 5,
+                'price': '1.00', **links})
+
+        self.assertEqual(res.status_code, 302)
+        self.assertEqual(list(recipe.tags.all()), [tag])
+        event = OutboxEvent.objects.get(type='recipe.updated')
+        self.assertEqual(event.data['tags'], [tag.id])
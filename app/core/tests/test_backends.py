@@ -0,0 +1,132 @@
+"""
+Tests for password hashing and the authentication backend
+"""
+import os
+import tempfile
+
+from django.contrib.auth import authenticate, get_user_model
+from django.test import TestCase, override_settings
+
+from core import backends
+from core.tests._pool_helpers import exit_outside
+
+
+PBKDF2 = 'core.hashers.TunablePBKDF2PasswordHasher'
+MD5 = 'django.contrib.auth.hashers.MD5PasswordHasher'
+
+
+@override_settings(PASSWORD_HASHERS=[PBKDF2, MD5],
+                   PASSWORD_HASH_PBKDF2_ITERATIONS=1000)
+class PooledModelBackendTests(TestCase):
+    """Test authenticating users with the pooled backend"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='test@123'
+        )
+
+    def test_authenticate(self):
+        """Test users authenticate with the right password only"""
+        self.assertEqual(
+            authenticate(email='user@example.com', password='test@123'),
+            self.user
+        )
+        self.assertIsNone(
+            authenticate(email='user@example.com', password='wrong')
+        )
+        self.assertIsNone(
+            authenticate(email='nobody@example.com', password='test@123')
+        )
+
+    def test_cost_from_settings(self):
+        """Test the hash cost is taken from settings"""
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$1000$'))
+
+    def test_rehash_on_cost_change(self):
+        """Test passwords are rehashed with the new cost on login"""
+        with self.settings(PASSWORD_HASH_PBKDF2_ITERATIONS=2000):
+            authenticate(email='user@example.com', password='test@123')
+
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$2000$'))
+
+    def test_rehash_on_hasher_change(self):
+        """Test passwords are rehashed with the preferred hasher on login"""
+        with self.settings(PASSWORD_HASHERS=[MD5, PBKDF2]):
+            authenticate(email='user@example.com', password='test@123')
+
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('md5$'))
+        self.assertTrue(self.user.check_password('test@123'))
+
+
+@override_settings(PASSWORD_HASHERS=[PBKDF2, MD5],
+                   PASSWORD_HASH_PBKDF2_ITERATIONS=1000,
+                   PASSWORD_HASH_POOL_SIZE=1,
+                   PASSWORD_HASH_POOL_QUEUE=0)
+class PasswordHashPoolTests(TestCase):
+    """Test hashing passwords in the process pool"""
+
+    def setUp(self):
+        self.addCleanup(self.shutdown_pool)
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='test@123'
+        )
+
+    def shutdown_pool(self):
+        if backends._pool is not None:
+            backends._pool.shutdown()
+        backends._pool = backends._pool_slots = None
+
+    def test_authenticate_in_pool(self):
+        """Test users authenticate with passwords checked in the pool"""
+        pool, _ = backends._get_pool()
+        self.assertNotEqual(backends.run_hasher(os.getpid), os.getpid())
+        self.assertEqual(
+            authenticate(email='user@example.com', password='test@123'),
+            self.user
+        )
+        self.assertIsNone(
+            authenticate(email='user@example.com', password='wrong')
+        )
+        self.assertIsNone(
+            authenticate(email='nobody@example.com', password='test@123')
+        )
+        # Not broken, so none of it fell back to hashing inline
+        self.assertIs(backends._get_pool()[0], pool)
+
+    def test_saturated_pool_hashes_inline(self):
+        """Test hashing runs in the calling process with no free slot"""
+        _, slots = backends._get_pool()
+        self.assertTrue(slots.acquire(blocking=False))
+        self.addCleanup(slots.release)
+
+        self.assertEqual(backends.run_hasher(os.getpid), os.getpid())
+        self.assertEqual(
+            authenticate(email='user@example.com', password='test@123'),
+            self.user
+        )
+
+    def test_broken_pool_replaced(self):
+        """Test hashing runs inline when a pool process dies, and the next
+        hash starts a new pool"""
+        pool, _ = backends._get_pool()
+        self.addCleanup(pool.shutdown)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        marker = os.path.join(directory.name, 'exited')
+
+        self.assertEqual(
+            backends.run_hasher(exit_outside, os.getpid(), marker),
+            os.getpid())
+
+        self.assertTrue(os.path.exists(marker))
+
+        self.assertIsNot(backends._get_pool()[0], pool)
+        self.assertEqual(
+            authenticate(email='user@example.com', password='test@123'),
+            self.user
+        )
+        self.assertNotEqual(backends.run_hasher(os.getpid), os.getpid())
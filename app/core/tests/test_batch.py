@@ -0,0 +1,162 @@
+"""
+Tests for the batch endpoint
+"""
+import io
+import shutil
+import tempfile
+from decimal import Decimal
+from unittest import mock
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core.models import AuthToken, Recipe, Tag
+
+
+BATCH_URL = reverse('api-batch')
+
+
+class BatchTestMixin:
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'user@example.com', 'test@123', name='Test User')
+        self.recipe = Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5,
+            price=Decimal('1.00'))
+        Tag.objects.create(user=self.user, name='Quick')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + str(
+            AuthToken.objects.get_or_rotate(self.user)))
+
+    def batch(self, *requests):
+        return self.client.post(BATCH_URL, {'requests': [
+            dict(zip(['method', 'path', 'body'], request))
+            for request in requests]}, format='json')
+
+
+class BatchTests(BatchTestMixin, TestCase):
+    """Test running several API requests in one call"""
+
+    def test_batch_reads(self):
+        """Test the results of the requests come back in order"""
+        res = self.batch(
+            ('GET', '/api/user/me/'),
+            ('GET', '/api/recipe/tags/'),
+            ('GET', '/api/recipe/recipes/?ordering=price'),
+            ('GET', '/api/recipe/recipes/0/'),
+        )
+
+        self.assertEqual(res.status_code, 200)
+        statuses = [r['status'] for r in res.data['responses']]
+        self.assertEqual(statuses, [200, 200, 200, 404])
+        me, tags, recipes, _ = res.data['responses']
+        self.assertEqual(me['data']['email'], 'user@example.com')
+        self.assertEqual(tags['data'][0]['name'], 'Quick')
+        self.assertEqual(recipes['data'][0]['id'], self.recipe.id)
+
+    def test_batch_authenticates_once(self):
+        """Test the token is looked up once and a repeated read runs
+        once"""
+        self.batch(('GET', '/api/user/me/'))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.batch(('GET', '/api/recipe/tags/'),
+                       ('GET', '/api/recipe/tags/'))
+
+        self.assertEqual(len(queries), 1)
+
+    def test_batch_writes_in_order(self):
+        """Test reads after a write see it"""
+        res = self.batch(
+            ('GET', '/api/recipe/tags/'),
+            ('POST', '/api/recipe/tags/', {'name': 'Cheap'}),
+            ('GET', '/api/recipe/tags/'),
+        )
+
+        before, created, after = res.data['responses']
+        self.assertEqual(created['status'], 201)
+        self.assertEqual(len(before['data']), 1)
+        self.assertEqual(len(after['data']), 2)
+
+    def test_batch_closes_file_responses(self):
+        """Test the file of an image read in a batch is closed"""
+        renditions = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, renditions)
+        image = io.BytesIO()
+        Image.new('RGB', (10, 10)).save(image, format='PNG')
+        self.recipe.image.save('photo.png', ContentFile(image.getvalue()))
+        self.addCleanup(self.recipe.image.delete)
+        opened = []
+
+        def recording_open(*args, **kwargs):
+            opened.append(open(*args, **kwargs))
+            return opened[-1]
+
+        with self.settings(IMAGE_RENDITION_ROOT=renditions), \
+                mock.patch('recipe.images.open', recording_open,
+                           create=True):
+            res = self.batch(
+                ('GET', f'/api/recipe/recipes/{self.recipe.id}/image/'))
+
+        self.assertEqual(res.data['responses'][0]['status'], 200)
+        self.assertEqual(len(opened), 1)
+        self.assertTrue(opened[0].closed)
+
+    def test_batch_outside_api_rejected(self):
+        """Test only the user and recipe APIs can be called"""
+        res = self.batch(('GET', '/api/schema/'), ('GET', '/nowhere/'))
+
+        self.assertEqual([r['status'] for r in res.data['responses']],
+                         [404, 404])
+
+    def test_batch_size_capped(self):
+        """Test a batch of too many requests is rejected"""
+        res = self.batch(*[('GET', '/api/user/me/')] * 21)
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_batch_requires_authentication(self):
+        """Test the batch endpoint needs a token"""
+        res = APIClient().post(BATCH_URL, {'requests': []}, format='json')
+
+        self.assertEqual(res.status_code, 401)
+
+
+@override_settings(BATCH_READ_WORKERS=4)
+class ConcurrentBatchTests(BatchTestMixin, TransactionTestCase):
+    """Test running the reads of a batch in threads"""
+
+    def test_batch_reads_concurrently(self):
+        """Test concurrent reads return the same as sequential ones"""
+        res = self.batch(
+            ('GET', '/api/user/me/'),
+            ('GET', '/api/recipe/tags/'),
+            ('GET', '/api/recipe/recipes/'),
+        )
+
+        self.assertEqual([r['status'] for r in res.data['responses']],
+                         [200, 200, 200])
+        self.assertEqual(res.data['responses'][2]['data'][0]['id'],
+                         self.recipe.id)
+
+    def test_pool_threads_keep_connections(self):
+        """Test the read threads keep their connections between batches,
+        closing only obsolete ones as requests do"""
+        reads = [('GET', '/api/user/me/'), ('GET', '/api/recipe/tags/')]
+        with mock.patch.object(connections, 'close_all') as close_all, \
+                mock.patch('core.batch.close_old_connections') as close_old:
+            res = self.batch(*reads)
+
+        self.assertEqual([r['status'] for r in res.data['responses']],
+                         [200, 200])
+        close_all.assert_not_called()
+        self.assertEqual(close_old.call_count, 2 * len(reads))
@@ -1,12 +1,23 @@
 """
 Test Custom Django Management Commands
 """
+import json
+from decimal import Decimal
+from io import StringIO
+from unittest import skipUnless
 from unittest.mock import patch
 from psycopg2 import OperationalError as Psycopg2Error
 
+from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.core.management import call_command
+from django.db import connection
 from django.db.utils import OperationalError
-from django.test import SimpleTestCase
+from django.test import SimpleTestCase, TestCase
+
+from core.management.commands.profile_startup import parse_importtime
+from core.models import Recipe, Tag
+from core.partitioning import is_partitioned, scanned_relations
 
 
 @patch('core.management.commands.wait_for_db.Command.check')
@@ -19,7 +30,8 @@ class CommandsTest(SimpleTestCase):
 
         call_command('wait_for_db')
 
-        patched_check.assert_called_once_with(databases=['default'])
+        patched_check.assert_called_once_with(
+            databases=settings.DATABASE_SHARDS)
 
     @patch('time.sleep')
     def test_wait_for_db_delay(self, patched_sleep, patched_check):
@@ -31,4 +43,73 @@ class CommandsTest(SimpleTestCase):
 
         self.assertEqual(patched_check.call_count, 6)
 
-        patched_check.assert_called_with(databases=['default'])
+        patched_check.assert_called_with(databases=settings.DATABASE_SHARDS)
+
+
+class ProfileStartupTests(SimpleTestCase):
+    """ Test the startup profile """
+
+    def test_parse_importtime(self):
+        """ Test import times are summed per top level package """
+        output = (
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       100 |        100 |   django.utils\n'
+            'import time:        50 |        150 | django\n'
+            'import time:        20 |         20 | json\n'
+        )
+
+        self.assertEqual(parse_importtime(output),
+                         {'django': 150, 'json': 20})
+
+
+class PartitioningTests(SimpleTestCase):
+    """ Test reading partition pruning from EXPLAIN output """
+
+    def test_scanned_relations(self):
+        """ Test the relations read anywhere in the plan are returned """
+        plan = json.dumps([{'Plan': {
+            'Node Type': 'Nested Loop',
+            'Plans': [
+                {'Node Type': 'Index Scan', 'Relation Name': 'core_tag_p3'},
+                {'Node Type': 'Append', 'Plans': [
+                    {'Node Type': 'Seq Scan',
+                     'Relation Name': 'core_recipe_tags_p3'},
+                ]},
+            ],
+        }}])
+
+        self.assertEqual(scanned_relations(plan),
+                         {'core_tag_p3', 'core_recipe_tags_p3'})
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Partitioning needs Postgres')
+class PartitionTablesTests(TestCase):
+    """ Test partitioning the recipe tables by user """
+    databases = '__all__'
+
+    def test_partition_tables(self):
+        """ Test the tables are partitioned keeping their rows and ids,
+        and a user's recipes are read from one partition """
+        user = get_user_model().objects.create_user(
+            email='user@example.com', password='test@123')
+        Recipe.objects.create(user=user, title='Soup', time_minutes=5,
+                              price=Decimal('1.00')).tags.add(
+            Tag.objects.create(user=user, name='Quick'))
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT setval(pg_get_serial_sequence("
+                           "'core_recipe', 'id')::regclass, 1000)")
+
+        call_command('partition_tables', '--partitions', '4',
+                     stdout=StringIO())
+
+        with connection.cursor() as cursor:
+            self.assertTrue(is_partitioned(cursor, 'core_recipe'))
+        self.assertEqual(list(Recipe.objects.get().tags.values_list(
+            'name', flat=True)), ['Quick'])
+        recipe = Recipe.objects.create(user=user, title='Stew',
+                                       time_minutes=5, price=Decimal('1.00'))
+        self.assertEqual(recipe.pk, 1001)
+        relations = scanned_relations(
+            Recipe.objects.filter(user=user).explain(format='json'))
+        self.assertEqual(len(relations), 1)
+        self.assertRegex(relations.pop(), r'^core_recipe_p\d$')
@@ -0,0 +1,120 @@
+"""
+Tests for merging tags and ingredients with colliding names
+"""
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from core.dedup import merge_duplicates
+from core.models import (Ingredient, OutboxEvent, Recipe, RecipeTag,
+                         SyncState, Tag)
+from recipe.sync import changes
+
+
+class MergeDuplicatesTests(TransactionTestCase):
+    """Test merging duplicates left from before names were unique"""
+    databases = '__all__'
+
+    def setUp(self):
+        # Duplicates cannot be created while the constraints exist. SQLite
+        # rebuilds the table from the model, which must not have it either.
+        for model in (Tag, Ingredient):
+            constraint, = model._meta.constraints
+            with mock.patch.object(model._meta, 'constraints', []), \
+                    connection.schema_editor() as editor:
+                editor.remove_constraint(model, constraint)
+            self.addCleanup(self.restore_constraint, model, constraint)
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com', password='test@123')
+
+    def restore_constraint(self, model, constraint):
+        model.objects.all().delete()
+        with connection.schema_editor() as editor:
+            editor.add_constraint(model, constraint)
+
+    def create_recipe(self, *tags):
+        recipe = Recipe.objects.create(user=self.user, title='Soup',
+                                       time_minutes=5, price=Decimal('1.00'))
+        recipe.tags.add(*tags)
+        return recipe
+
+    def create_tags(self, *names):
+        return [Tag.objects.create(user=self.user, name=name)
+                for name in names]
+
+    def merge_tags(self):
+        return merge_duplicates(Tag, RecipeTag, 'tag')
+
+    def link_queries(self, queries):
+        return [query for query in queries
+                if RecipeTag._meta.db_table in query['sql']]
+
+    def test_merge_relinks_recipes(self):
+        """Test duplicates are merged into the oldest tag of each name,
+        keeping one link per recipe"""
+        keep, first, second = self.create_tags('Quick', 'quick', ' QUICK')
+        other = Tag.objects.create(user=get_user_model().objects.create_user(
+            email='other@example.com', password='test@123'), name='quick')
+        both_duplicates = self.create_recipe(first, second)
+        kept_and_duplicate = self.create_recipe(second, keep)
+        duplicate = self.create_recipe(first)
+
+        self.assertEqual(self.merge_tags(), 2)
+
+        self.assertEqual(list(Tag.objects.order_by('id')), [keep, other])
+        for recipe in (both_duplicates, kept_and_duplicate, duplicate):
+            self.assertEqual(list(recipe.tags.all()), [keep])
+
+    def test_merged_recipes_in_delta(self):
+        """Test relinked recipes come with the next delta sync, and their
+        updated events are queued"""
+        keep, duplicate = self.create_tags('Quick', 'quick')
+        relinked = self.create_recipe(duplicate)
+        self.create_recipe(keep)
+        since = SyncState.objects.get(user=self.user).version
+
+        self.merge_tags()
+
+        delta = changes(self.user, since, 100, {})
+        self.assertEqual([recipe['id'] for recipe in delta['recipes']],
+                         [relinked.id])
+        self.assertEqual(delta['recipes'][0]['tags'][0]['id'], keep.id)
+        self.assertEqual(delta['deleted']['tags'], [duplicate.id])
+        event = OutboxEvent.objects.filter(type='recipe.updated').last()
+        self.assertEqual(event.object_id, relinked.id)
+        self.assertEqual(event.data['tags'], [keep.id])
+
+    def test_relink_queries_independent_of_groups(self):
+        """Test relinking takes as many queries for one group as for
+        several"""
+        self.create_recipe(*self.create_tags('Quick', 'quick'))
+        with CaptureQueriesContext(connection) as one_group:
+            self.merge_tags()
+
+        self.create_recipe(*self.create_tags('Vegan', 'vegan', 'Spicy',
+                                             'spicy', 'Cheap', 'cheap'))
+        with CaptureQueriesContext(connection) as three_groups:
+            self.assertEqual(self.merge_tags(), 3)
+
+        self.assertEqual(len(self.link_queries(three_groups)),
+                         len(self.link_queries(one_group)))
+        self.assertEqual(Tag.objects.count(), 4)
+
+    def test_merge_command(self):
+        """Test the command merges tags and ingredients"""
+        self.create_tags('Quick', 'quick')
+        Ingredient.objects.create(user=self.user, name='Salt')
+        Ingredient.objects.create(user=self.user, name='salt ')
+
+        out = StringIO()
+        call_command('merge_duplicate_names', stdout=out)
+
+        self.assertEqual(Tag.objects.count(), 1)
+        self.assertEqual(Ingredient.objects.count(), 1)
+        self.assertIn('Merged 1 duplicate tags', out.getvalue())
@@ -0,0 +1,77 @@
+"""
+Tests for the batched deletion of accounts
+"""
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from core.models import (AccountDeletion,
+                         AuthToken,
+                         Recipe,
+                         RecipeTag,
+                         SyncState,
+                         Tag,
+                         Tombstone)
+
+
+class AccountDeletionTests(TestCase):
+    """Test queueing and processing account deletions"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'user@example.com', 'test@123')
+        self.other = get_user_model().objects.create_user(
+            'other@example.com', 'test@123')
+
+    def create_recipes(self, user, count):
+        tag = Tag.objects.create(user=user, name='Quick')
+        for i in range(count):
+            recipe = Recipe.objects.create(
+                user=user, title=f'Recipe {i}', time_minutes=5,
+                price=Decimal('1.00'))
+            recipe.tags.add(tag)
+        AuthToken.objects.rotate(user)
+
+    def test_delete_accounts_in_batches(self):
+        """Test the worker deletes the user and all they own, and only
+        them"""
+        self.create_recipes(self.user, 3)
+        self.create_recipes(self.other, 1)
+        deletion = AccountDeletion.objects.enqueue(self.user)
+
+        out = StringIO()
+        call_command('delete_accounts', batch_size=2, verbosity=2,
+                     stdout=out)
+
+        deletion.refresh_from_db()
+        self.assertIsNotNone(deletion.finished)
+        # 3 recipes, 3 links, a tag, a token, the sync state and the 7
+        # webhook events of the changes
+        self.assertEqual(deletion.deleted_rows, 16)
+        self.assertIn('deleted 2 core.Recipe rows', out.getvalue())
+        self.assertFalse(get_user_model().objects.filter(
+            pk=self.user.pk).exists())
+        for model in (Recipe, RecipeTag, Tag, AuthToken, SyncState):
+            self.assertFalse(model.objects.filter(
+                user_id=self.user.pk).exists())
+            self.assertTrue(model.objects.filter(user=self.other).exists())
+        self.assertFalse(Tombstone.objects.exists())
+
+    def test_claim_skips_leased_deletions(self):
+        """Test a leased deletion is only claimed again once its lease
+        expired"""
+        deletion = AccountDeletion.objects.enqueue(self.user)
+
+        self.assertEqual(AccountDeletion.objects.claim(60), deletion)
+        self.assertIsNone(AccountDeletion.objects.claim(60))
+
+        AccountDeletion.objects.filter(pk=deletion.pk).update(
+            leased_until=timezone.now() - timedelta(seconds=1))
+        claimed = AccountDeletion.objects.claim(60)
+        self.assertEqual(claimed, deletion)
+        self.assertEqual(claimed.attempts, 2)
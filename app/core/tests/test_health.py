@@ -0,0 +1,37 @@
+"""
+Tests for the health and readiness probes
+"""
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from core.middleware import readiness_check
+
+
+class HealthCheckTests(TestCase):
+    """Test the probe endpoints"""
+
+    def setUp(self):
+        readiness_check._checked_at = None
+
+    def test_health_skips_database_and_host_check(self):
+        """Test liveness answers for any host without a query"""
+        with self.assertNumQueries(0):
+            res = self.client.get('/health/', HTTP_HOST='10.1.2.3:8000')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('no-cache', res['Cache-Control'])
+
+    def test_readiness_checks_database_once_per_interval(self):
+        """Test readiness probes reuse the last database check"""
+        with self.assertNumQueries(1):
+            for _ in range(3):
+                res = self.client.get('/ready/')
+                self.assertEqual(res.status_code, 200)
+
+    def test_not_ready_without_database(self):
+        """Test readiness fails when the database is unreachable"""
+        with patch.object(readiness_check, '_check', return_value=False):
+            res = self.client.get('/ready/')
+
+        self.assertEqual(res.status_code, 503)
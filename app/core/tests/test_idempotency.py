@@ -0,0 +1,150 @@
+"""
+Tests for Idempotency-Key support
+"""
+import io
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.db.models import QuerySet
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+
+from core.idempotency import try_lock
+from core.models import IdempotencyKey, Recipe
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+CREATE_USER_URL = reverse('user:create')
+
+
+class IdempotencyTests(TestCase):
+    """Test requests repeated with the same Idempotency-Key"""
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'user@example.com', 'test@123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.payload = {'title': 'Soup', 'time_minutes': 10,
+                        'price': '2.50'}
+
+    def post(self, payload, key='key-1'):
+        return self.client.post(RECIPES_URL, payload, format='json',
+                                HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_repeat_is_replayed(self):
+        """Test a repeated request gets the first response and creates
+        nothing more"""
+        first = self.post(self.payload)
+        repeat = self.post(self.payload)
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(repeat.status_code, 201)
+        self.assertEqual(repeat.data, first.data)
+        self.assertEqual(repeat['Idempotent-Replayed'], 'true')
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    def test_other_key_runs_again(self):
+        """Test a request with another key is not a repeat"""
+        self.post(self.payload)
+        self.post(self.payload, key='key-2')
+
+        self.assertEqual(Recipe.objects.count(), 2)
+
+    def test_key_reused_for_other_request(self):
+        """Test reusing a key for a different request is rejected"""
+        self.post(self.payload)
+        res = self.post({**self.payload, 'title': 'Stew'})
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    def test_concurrent_repeat_conflicts(self):
+        """Test a repeat arriving while the first request runs gets 409"""
+        with try_lock(f'user:{self.user.pk}:key-1') as locked:
+            self.assertTrue(locked)
+            res = self.post(self.payload)
+
+        self.assertEqual(res.status_code, 409)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_expired_key_runs_again(self):
+        """Test a key older than IDEMPOTENCY_KEY_TTL is forgotten"""
+        self.post(self.payload)
+        IdempotencyKey.objects.update(
+            created=timezone.now() - timedelta(days=2))
+
+        self.post(self.payload)
+
+        self.assertEqual(Recipe.objects.count(), 2)
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+    def test_key_stored_with_change(self):
+        """Test the change is rolled back if its key cannot be stored"""
+        with mock.patch.object(QuerySet, 'update_or_create',
+                               side_effect=DatabaseError), \
+                self.assertRaises(DatabaseError):
+            self.post(self.payload)
+
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_upload_hashed_by_content(self):
+        """Test a repeated upload is replayed and another file of the same
+        size sent with the key is rejected"""
+        recipe = Recipe.objects.create(user=self.user, title='Soup',
+                                       time_minutes=5, price=Decimal('1.00'))
+        url = reverse('recipe:recipe-upload-image', args=[recipe.id])
+
+        def upload(color):
+            image = io.BytesIO()
+            Image.new('RGB', (10, 10), color).save(image, format='BMP')
+            image.seek(0)
+            image.name = 'photo.bmp'
+            return self.client.post(url, {'image': image},
+                                    format='multipart',
+                                    HTTP_IDEMPOTENCY_KEY='key-1')
+
+        first = upload('red')
+        self.addCleanup(lambda: Recipe.objects.get(pk=recipe.pk).image
+                        .delete())
+        repeat = upload('red')
+        other = upload('blue')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(repeat['Idempotent-Replayed'], 'true')
+        self.assertEqual(other.status_code, 422)
+
+    def test_signup_is_idempotent(self):
+        """Test a repeated anonymous signup creates one user"""
+        payload = {'email': 'new@example.com', 'password': 'test123',
+                   'name': 'New'}
+        for _ in range(2):
+            res = APIClient().post(CREATE_USER_URL, payload,
+                                   HTTP_IDEMPOTENCY_KEY='signup')
+            self.assertEqual(res.status_code, 201)
+
+        self.assertEqual(get_user_model().objects.filter(
+            email='new@example.com').count(), 1)
+
+    def test_purge_idempotency_keys(self):
+        """Test the purge deletes expired keys only"""
+        self.post(self.payload)
+        self.post(self.payload, key='key-2')
+        IdempotencyKey.objects.filter(key='key-1').update(
+            created=timezone.now() - timedelta(days=2))
+
+        call_command('purge_idempotency_keys', stdout=StringIO())
+
+        self.assertEqual(list(IdempotencyKey.objects.values_list(
+            'key', flat=True)), ['key-2'])
@@ -0,0 +1,113 @@
+"""
+Tests for the metrics endpoint
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from core import metrics
+
+
+@override_settings(METRICS_TOKEN='secret')
+class MetricsTests(TestCase):
+    """Test recording and scraping metrics"""
+
+    def setUp(self):
+        metrics.REGISTRY.reset()
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Bearer secret'
+
+    def test_requests_counted_per_route(self):
+        """Test requests are counted by URL name, method and status"""
+        self.client.get(reverse('recipe:recipe-list'))
+        self.client.get('/nowhere/')
+
+        res = self.client.get('/metrics')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res['Content-Type'].startswith('text/plain'))
+        body = res.content.decode()
+        self.assertIn('http_requests_total{route="recipe:recipe-list",'
+                      'method="GET",status="401"} 1', body)
+        self.assertIn('http_requests_total{route="unmatched",'
+                      'method="GET",status="404"} 1', body)
+        self.assertIn('http_request_duration_seconds_bucket{'
+                      'route="recipe:recipe-list",method="GET",le="+Inf"} 1',
+                      body)
+
+    def test_login_and_database_metrics(self):
+        """Test logins record their latency and queries are counted"""
+        get_user_model().objects.create_user(
+            email='user@example.com', password='test@123')
+
+        self.client.post(reverse('user:token'), {
+            'email': 'user@example.com', 'password': 'wrong'})
+
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn(
+            'auth_login_duration_seconds_count{result="failure"} 1', body)
+        self.assertIn('db_queries_total{alias="default"}', body)
+        self.assertIn('password_hashes_in_progress 0', body)
+
+    def test_token_required(self):
+        """Test scrapes need the bearer token"""
+        res = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer nope')
+        self.assertEqual(res.status_code, 403)
+
+        res = self.client.get('/metrics')
+        self.assertEqual(res.status_code, 200)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_no_token_only_with_debug(self):
+        """Test metrics without a token set are only public with DEBUG"""
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_exited_threads_retired(self):
+        """Test an exited thread's values are kept without its shard,
+        except for its gauges"""
+        def work():
+            metrics.CACHE_REQUESTS.inc(cache='autocomplete', result='hit')
+            metrics.IMAGE_RENDERS_IN_PROGRESS.inc()
+
+        for _ in range(3):
+            thread = threading.Thread(target=work)
+            thread.start()
+            thread.join()
+
+        self.assertEqual(metrics.REGISTRY._shards, {})
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('cache_requests_total{cache="autocomplete",'
+                      'result="hit"} 3', body)
+        self.assertIn('image_renders_in_progress 0', body)
+
+    def test_processes_aggregated(self):
+        """Test a scrape adds up the files of all processes, keeping the
+        counters of exited ones and dropping their gauges"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        exited = [['cache_requests_total', ['autocomplete', 'hit'], '', 2],
+                  ['image_renders_in_progress', [], '', 1]]
+        # Beyond pid_max, so no such process exists
+        with open(os.path.join(directory, '99999999.json'), 'w') as f:
+            json.dump(exited, f)
+        metrics.CACHE_REQUESTS.inc(cache='autocomplete', result='hit')
+
+        with override_settings(METRICS_DIR=directory):
+            body = self.client.get('/metrics').content.decode()
+            metrics.REGISTRY.reset()
+            again = self.client.get('/metrics').content.decode()
+
+        self.assertIn('cache_requests_total{cache="autocomplete",'
+                      'result="hit"} 3', body)
+        self.assertIn('image_renders_in_progress 0', body)
+        self.assertIn('cache_requests_total{cache="autocomplete",'
+                      'result="hit"} 2', again)
+        self.assertNotIn('99999999.json', os.listdir(directory))
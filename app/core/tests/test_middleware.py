@@ -0,0 +1,70 @@
+"""
+Tests for response compression
+"""
+import gzip
+import json
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase
+
+from core.compression import COMPRESSORS, negotiate
+from core.middleware import CompressionMiddleware
+
+
+PAYLOAD = json.dumps([{'name': 'tag %d' % i} for i in range(200)]).encode()
+
+
+class CompressionMiddlewareTests(SimpleTestCase):
+    """Test negotiated response compression"""
+
+    def setUp(self):
+        self.request = RequestFactory().get(
+            '/', HTTP_ACCEPT_ENCODING='gzip;q=1, identity;q=0.5')
+
+    def process(self, response, request=None):
+        middleware = CompressionMiddleware(lambda request: response)
+        return middleware(request or self.request)
+
+    def test_json_is_compressed(self):
+        """Test large JSON responses are gzip compressed"""
+        response = HttpResponse(PAYLOAD, content_type='application/json')
+        response['ETag'] = '"abc"'
+
+        res = self.process(response)
+
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertEqual(res['Vary'], 'Accept-Encoding')
+        self.assertEqual(res['ETag'], 'W/"abc"')
+        self.assertEqual(int(res['Content-Length']), len(res.content))
+        self.assertEqual(gzip.decompress(res.content), PAYLOAD)
+
+    def test_small_and_media_responses_are_not_compressed(self):
+        """Test short responses and images are sent as they are"""
+        small = HttpResponse(b'{}', content_type='application/json')
+        image = HttpResponse(PAYLOAD, content_type='image/jpeg')
+
+        for response in (small, image):
+            res = self.process(response)
+            self.assertFalse(res.has_header('Content-Encoding'))
+
+    def test_streaming_response_is_compressed(self):
+        """Test streamed responses are compressed chunk by chunk"""
+        response = StreamingHttpResponse(
+            (PAYLOAD[i:i + 1000] for i in range(0, len(PAYLOAD), 1000)),
+            content_type='text/plain',
+        )
+
+        res = self.process(response)
+
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(res.streaming_content)),
+                         PAYLOAD)
+
+    def test_negotiate(self):
+        """Test the encoding follows the client's q-values"""
+        self.assertIsNone(negotiate(''))
+        self.assertIsNone(negotiate('gzip;q=0, identity'))
+        self.assertEqual(negotiate('*').encoding, next(iter(COMPRESSORS)))
+        self.assertEqual(negotiate('br;q=0.5, gzip;q=0.8').encoding, 'gzip')
+        expected = 'br' if 'br' in COMPRESSORS else 'gzip'
+        self.assertEqual(negotiate('gzip;q=0.8, br').encoding, expected)
@@ -0,0 +1,33 @@
+"""
+Tests for the data migrations
+"""
+from datetime import timedelta
+from importlib import import_module
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from core.models import AuthToken
+
+
+class CopyExistingTokensTests(TestCase):
+    """Test carrying over rest_framework.authtoken tokens"""
+
+    def test_created_kept(self):
+        """Test copied tokens keep their creation time, and so their
+        expiry"""
+        migration = import_module('core.migrations.0010_authtoken')
+        user = get_user_model().objects.create_user(
+            email='user@example.com', password='test@123')
+        token = Token.objects.create(user=user)
+        created = timezone.now() - timedelta(days=3)
+        Token.objects.filter(pk=token.pk).update(created=created)
+
+        migration.copy_existing_tokens(apps, None)
+
+        copied = AuthToken.objects.get(user=user)
+        self.assertEqual(copied.key, token.key)
+        self.assertEqual(copied.created, created)
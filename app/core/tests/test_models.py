@@ -100,6 +100,36 @@ class ModelTests(TestCase):
         )
         self.assertEqual(str(ingredient), ingredient.name)
 
+    def test_tag_normalized_name(self):
+        """Test tag names are normalized ignoring case and whitespace"""
+        user = create_user()
+        tag = models.Tag.objects.create(name='  Gluten   FREE ', user=user)
+
+        self.assertEqual(tag.normalized_name, 'gluten free')
+
+    def test_get_or_create_by_name(self):
+        """Test names differing by case reuse the same ingredient"""
+        user = create_user()
+        salt = models.Ingredient.objects.create(name='Salt', user=user)
+
+        ingredient, created = models.Ingredient.objects.get_or_create_by_name(
+            user=user, name='SALT')
+
+        self.assertFalse(created)
+        self.assertEqual(ingredient, salt)
+
+    def test_recipe_links_take_recipe_user(self):
+        """Test links added without a user get the recipe's user"""
+        user = create_user()
+        recipe = models.Recipe.objects.create(
+            user=user, title='Soup', time_minutes=5, price=Decimal('1.00'))
+        tag = models.Tag.objects.create(name='Quick', user=user)
+
+        tag.recipe_set.add(recipe)
+
+        link = models.RecipeTag.objects.get(recipe=recipe, tag=tag)
+        self.assertEqual(link.user, user)
+
     @patch('core.models.uuid.uuid4')
     def test_recipe_file_name_uuid(self, mock_uuid):
         """Test that image is saved in the correct location"""
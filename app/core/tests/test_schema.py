@@ -0,0 +1,64 @@
+"""
+Tests for the cached OpenAPI schema
+"""
+import gzip
+import shutil
+import tempfile
+from io import StringIO
+from unittest import SkipTest
+
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from core.schema import schema_cache
+
+
+if 'drf_spectacular' not in settings.INSTALLED_APPS:
+    raise SkipTest('The schema is not served by the API-only settings')
+
+SCHEMA_URL = reverse('api-schema')
+
+
+class SchemaTests(TestCase):
+    """Test serving the schema built once"""
+
+    def setUp(self):
+        schema_cache.clear()
+
+    def tearDown(self):
+        schema_cache.clear()
+
+    def test_schema_precompressed_with_etag(self):
+        """Test the schema is served gzipped and revalidated by ETag"""
+        res = self.client.get(SCHEMA_URL, HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertIn(b'openapi:', gzip.decompress(res.content))
+
+        res = self.client.get(SCHEMA_URL, HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, 304)
+
+    def test_json_format(self):
+        """Test the JSON schema is negotiated from the Accept header"""
+        res = self.client.get(
+            SCHEMA_URL, HTTP_ACCEPT='application/vnd.oai.openapi+json')
+
+        self.assertEqual(res['Content-Type'],
+                         'application/vnd.oai.openapi+json')
+        self.assertIn('paths', res.json())
+
+    def test_schema_served_from_build_schema_files(self):
+        """Test the view serves the files written by build_schema"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        call_command('build_schema', output_dir=directory, stdout=StringIO())
+        with open(f'{directory}/schema.yaml', 'ab') as f:
+            f.write(b'# built\n')
+
+        with override_settings(SCHEMA_CACHE_DIR=directory):
+            res = self.client.get(SCHEMA_URL)
+
+        self.assertTrue(res.content.endswith(b'# built\n'))
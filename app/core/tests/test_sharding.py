@@ -0,0 +1,264 @@
+"""
+Tests for sharding user data over several databases
+"""
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import skipUnless
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import router
+from django.test import Client, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+
+from core.models import (AccountDeletion,
+                         AuthToken,
+                         IdempotencyKey,
+                         Recipe,
+                         RecipeTag,
+                         SyncState,
+                         Tag,
+                         Tombstone)
+from core.sharding import (SHARD_ID_RANGE,
+                           UserMoved,
+                           end_migration,
+                           move_user,
+                           start_migration,
+                           use_shard)
+
+
+# Run with DB_SHARDS set, e.g. DB_SHARDS=shard1
+SHARD = next((alias for alias in settings.DATABASE_SHARDS
+              if alias != 'default'), None)
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+@skipUnless(SHARD, 'needs a second shard, see DB_SHARDS')
+class ShardingTests(TestCase):
+    """Test routing, moving and deleting the data of sharded users"""
+    databases = '__all__'
+
+    def create_user(self, **params):
+        return get_user_model().objects.create_user(
+            email='user@example.com', password='test@123', **params)
+
+    def login(self):
+        res = APIClient().post(reverse('user:token'), {
+            'email': 'user@example.com', 'password': 'test@123'})
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {res.data["token"]}')
+        return client
+
+    def test_requests_use_user_shard(self):
+        """Test a user's token and recipes are stored on their shard"""
+        user = self.create_user(shard=SHARD)
+        client = self.login()
+
+        res = client.post(RECIPES_URL, {
+            'title': 'Soup', 'time_minutes': 10, 'price': '2.50',
+            'tags': [{'name': 'Quick'}]}, format='json')
+
+        self.assertEqual(res.status_code, 201)
+        self.assertTrue(AuthToken.objects.using(SHARD).filter(
+            user=user).exists())
+        self.assertTrue(RecipeTag.objects.using(SHARD).filter(
+            user=user).exists())
+        self.assertFalse(Recipe.objects.using('default').exists())
+        self.assertEqual(len(client.get(RECIPES_URL).data), 1)
+
+    def test_idempotency_key_on_user_shard(self):
+        """Test an Idempotency-Key is stored on the user's shard"""
+        self.create_user(shard=SHARD)
+
+        self.login().post(RECIPES_URL, {
+            'title': 'Soup', 'time_minutes': 10, 'price': '2.50'},
+            format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+
+        self.assertTrue(IdempotencyKey.objects.using(SHARD).filter(
+            key='key-1').exists())
+        self.assertFalse(IdempotencyKey.objects.using('default').exists())
+
+    def test_move_user(self):
+        """Test moving a user keeps their data, versions and token"""
+        user = self.create_user()
+        client = self.login()
+        recipe = Recipe.objects.create(
+            user=user, title='Soup', time_minutes=5, price=Decimal('1.00'))
+        recipe.tags.add(Tag.objects.create(user=user, name='Quick'))
+        recipe.refresh_from_db()
+        token = AuthToken.objects.get(user=user)
+
+        call_command('move_user', user.email, SHARD, stdout=StringIO())
+
+        user.refresh_from_db()
+        self.assertEqual(user.shard, SHARD)
+        self.assertFalse(Recipe.objects.using('default').exists())
+        self.assertFalse(AuthToken.objects.using('default').exists())
+        moved = Recipe.objects.using(SHARD).get(pk=recipe.pk)
+        self.assertEqual(moved.version, recipe.version)
+        self.assertEqual(list(moved.tags.values_list('name', flat=True)),
+                         ['Quick'])
+        self.assertEqual(
+            AuthToken.objects.using(SHARD).get(pk=token.pk).created,
+            token.created)
+        self.assertEqual(SyncState.objects.using(SHARD).get(
+            user=user).version, 3)
+        res = client.get(RECIPES_URL)
+        self.assertEqual([r['id'] for r in res.data], [recipe.pk])
+
+    def test_shard_id_ranges(self):
+        """Test each shard hands out ids from its own range"""
+        user = self.create_user(shard=SHARD)
+        recipe = Recipe.objects.using(SHARD).create(
+            user=user, title='Soup', time_minutes=5, price=Decimal('1.00'))
+
+        index = settings.DATABASE_SHARDS.index(SHARD)
+        self.assertGreater(recipe.pk, index * SHARD_ID_RANGE)
+
+    def test_move_user_to_shard_with_data(self):
+        """Test moving a user next to another user's data, and back"""
+        other = get_user_model().objects.create_user(
+            email='other@example.com', password='test@123', shard=SHARD)
+        with use_shard(SHARD):
+            Recipe.objects.create(user=other, title='Stew', time_minutes=5,
+                                  price=Decimal('1.00')).tags.add(
+                Tag.objects.create(user=other, name='Slow'))
+        user = self.create_user()
+        Recipe.objects.create(user=user, title='Soup', time_minutes=5,
+                              price=Decimal('1.00')).tags.add(
+            Tag.objects.create(user=user, name='Quick'))
+
+        move_user(user, SHARD)
+
+        self.assertEqual(Recipe.objects.using(SHARD).count(), 2)
+        self.assertEqual(RecipeTag.objects.using(SHARD).count(), 2)
+
+        move_user(user, 'default')
+
+        self.assertEqual(list(Recipe.objects.using('default').values_list(
+            'title', flat=True)), ['Soup'])
+        self.assertEqual(list(Recipe.objects.using(SHARD).values_list(
+            'title', flat=True)), ['Stew'])
+        self.assertEqual(SyncState.objects.using('default').get(
+            user=user).moved_to, '')
+
+    def test_requests_routed_to_old_shard_fail(self):
+        """Test writes and syncs on the shard a user left are refused"""
+        user = self.create_user()
+        client = self.login()
+        Recipe.objects.create(
+            user=user, title='Soup', time_minutes=5, price=Decimal('1.00'))
+
+        move_user(user, SHARD)
+
+        self.assertEqual(SyncState.objects.using('default').get(
+            user=user).moved_to, SHARD)
+        with use_shard('default'), self.assertRaises(UserMoved):
+            SyncState.objects.next_version(user.pk)
+        with self.settings(AUTH_TOKEN_CACHE_TTL=0):
+            res = client.get(RECIPES_URL)
+        self.assertEqual(len(res.data), 1)
+
+    def test_delete_user_deletes_shard_data(self):
+        """Test deleting a user deletes their data on their shard"""
+        user = self.create_user(shard=SHARD)
+        self.login()
+        Recipe.objects.using(SHARD).create(
+            user=user, title='Soup', time_minutes=5, price=Decimal('1.00'))
+
+        user.delete()
+
+        self.assertFalse(Recipe.objects.using(SHARD).exists())
+        self.assertFalse(AuthToken.objects.using(SHARD).exists())
+
+    def test_delete_account_on_shard(self):
+        """Test the deletion worker deletes a user's data on their shard"""
+        user = self.create_user(shard=SHARD)
+        self.login()
+        Recipe.objects.using(SHARD).create(
+            user=user, title='Soup', time_minutes=5, price=Decimal('1.00'))
+        AccountDeletion.objects.enqueue(user)
+
+        call_command('delete_accounts', stdout=StringIO())
+
+        self.assertFalse(Recipe.objects.using(SHARD).exists())
+        self.assertFalse(AuthToken.objects.using(SHARD).exists())
+        self.assertFalse(get_user_model().objects.exists())
+
+    def test_purges_cover_every_shard(self):
+        """Test expired tokens and old tombstones are purged on shards"""
+        user = self.create_user(shard=SHARD)
+        self.login()
+        AuthToken.objects.using(SHARD).update(
+            created=timezone.now() - timedelta(days=365))
+        with use_shard(SHARD):
+            Recipe.objects.create(user=user, title='Soup', time_minutes=5,
+                                  price=Decimal('1.00')).delete()
+        Tombstone.objects.using(SHARD).update(
+            deleted_at=timezone.now() - timedelta(days=365))
+
+        call_command('purge_expired_tokens', stdout=StringIO())
+        call_command('purge_tombstones', stdout=StringIO())
+
+        self.assertFalse(AuthToken.objects.using(SHARD).exists())
+        self.assertFalse(Tombstone.objects.using(SHARD).exists())
+        self.assertEqual(SyncState.objects.using(SHARD).get(
+            user=user).pruned_version, 2)
+
+    @skipUnless('django.contrib.admin' in settings.INSTALLED_APPS,
+                'The admin is left out of the API-only settings')
+    def test_admin_deactivate_revokes_shard_tokens(self):
+        """Test the admin deactivate action revokes tokens on shards"""
+        user = self.create_user(shard=SHARD)
+        self.login()
+        client = Client()
+        client.force_login(get_user_model().objects.create_superuser(
+            email='admin@example.com', password='Admin@123'))
+
+        client.post(reverse('admin:core_user_changelist'), {
+            'action': 'deactivate', '_selected_action': [user.pk]})
+
+        user.refresh_from_db()
+        self.assertFalse(user.is_active)
+        self.assertFalse(AuthToken.objects.using(SHARD).exists())
+
+    def test_admin_reads_shards(self):
+        """Test the admin lists, shows and acts on objects on shards"""
+        user = self.create_user(shard=SHARD)
+        recipe = Recipe.objects.using(SHARD).create(
+            user=user, title='Soup', time_minutes=5, price=Decimal('1.00'))
+        tag = Tag.objects.using(SHARD).create(user=user, name='Vegan')
+        recipe.tags.add(tag)
+        client = Client()
+        client.force_login(get_user_model().objects.create_superuser(
+            email='admin@example.com', password='Admin@123'))
+        changelist = reverse('admin:core_recipe_changelist')
+
+        self.assertNotContains(client.get(changelist), 'Soup')
+        self.assertContains(client.get(changelist, {'shard': SHARD}),
+                            'Soup')
+        res = client.get(reverse('admin:core_recipe_change',
+                                 args=[recipe.id]))
+        self.assertContains(res, 'Vegan')
+
+        client.post(reverse('admin:core_tag_changelist') + f'?shard={SHARD}',
+                    {'action': 'detach_from_recipes',
+                     '_selected_action': [tag.id]})
+        self.assertFalse(RecipeTag.objects.using(SHARD).exists())
+
+    def test_data_migrations_use_migrated_database(self):
+        """Test queries are routed to the database being migrated"""
+        start_migration(sender=None, using=SHARD)
+        try:
+            self.assertEqual(router.db_for_write(get_user_model()), SHARD)
+            self.assertEqual(router.db_for_read(Recipe), SHARD)
+        finally:
+            end_migration(sender=None, using=SHARD)
+
+        self.assertEqual(router.db_for_write(get_user_model()), 'default')
@@ -0,0 +1,97 @@
+"""
+Tests for content addressed recipe image storage
+"""
+import os
+from io import StringIO
+import shutil
+import tempfile
+from decimal import Decimal
+
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+
+from core.models import Recipe
+from core.storage import recipe_image_storage
+
+
+def create_recipe(user, **params):
+    """Helper function to create a recipe"""
+    defaults = {
+        'title': 'Sample recipe',
+        'time_minutes': 10,
+        'price': Decimal('5.00'),
+    }
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class ContentAddressedStorageTests(TestCase):
+    """Test storing recipe images by content hash"""
+    # Image references are looked up on every shard
+    databases = '__all__'
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.media_root,
+                                          IMAGE_ORPHAN_GRACE_SECONDS=0)
+        self.settings.enable()
+        self.user = get_user_model().objects.create_user(
+            'user@example.com',
+            'test@123'
+        )
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_identical_content_shares_file(self):
+        """Test saving the same content twice stores one file"""
+        name1 = recipe_image_storage.save('uploads/recipe/a.jpg',
+                                          ContentFile(b'image'))
+        name2 = recipe_image_storage.save('uploads/recipe/b.JPG',
+                                          ContentFile(b'image'))
+
+        self.assertEqual(name1, name2)
+        self.assertRegex(name1, r'^uploads/recipe/[0-9a-f]{2}/[0-9a-f]{64}'
+                                r'\.jpg$')
+        self.assertEqual(recipe_image_storage.listdir(
+            os.path.dirname(name1))[1], [os.path.basename(name1)])
+
+    def test_replaced_image_is_released(self):
+        """Test an image file is deleted once no recipe uses it"""
+        recipe1 = create_recipe(self.user)
+        recipe2 = create_recipe(self.user)
+        for recipe in (recipe1, recipe2):
+            recipe.image.save('old.jpg', ContentFile(b'old'))
+        old_name = recipe1.image.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe1.image.save('new.jpg', ContentFile(b'new'))
+        self.assertTrue(recipe_image_storage.exists(old_name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe2.delete()
+        self.assertFalse(recipe_image_storage.exists(old_name))
+        self.assertTrue(recipe_image_storage.exists(recipe1.image.name))
+
+    def test_reclaim_image_space(self):
+        """Test legacy duplicate images are merged and orphans deleted"""
+        legacy = ['uploads/recipe/one.jpg', 'uploads/recipe/two.jpg']
+        for name in legacy + ['uploads/recipe/orphan.jpg']:
+            path = recipe_image_storage.path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(b'same')
+        recipe1 = create_recipe(self.user, image=legacy[0])
+        recipe2 = create_recipe(self.user, image=legacy[1])
+
+        call_command('reclaim_image_space', stdout=StringIO())
+
+        recipe1.refresh_from_db()
+        recipe2.refresh_from_db()
+        self.assertEqual(recipe1.image.name, recipe2.image.name)
+        self.assertTrue(recipe_image_storage.exists(recipe1.image.name))
+        for name in legacy + ['uploads/recipe/orphan.jpg']:
+            self.assertFalse(recipe_image_storage.exists(name))
@@ -0,0 +1,77 @@
+"""
+Tests for request throttling
+"""
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.throttling import (LoginRateThrottle,
+                             ReadRateThrottle,
+                             throttle_metrics)
+
+
+TOKEN_URL = reverse('user:token')
+
+
+class ThrottlingTests(TestCase):
+    """Test per-endpoint request budgets"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_login_throttled_with_retry_after(self):
+        """Test token requests over the budget get 429 and Retry-After"""
+        payload = {'email': 'user@example.com', 'password': 'wrong'}
+        with patch.dict(LoginRateThrottle.THROTTLE_RATES, login='2/min'):
+            for _ in range(2):
+                res = self.client.post(TOKEN_URL, payload)
+                self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            res = self.client.post(TOKEN_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreater(int(res['Retry-After']), 0)
+        self.assertLessEqual(int(res['Retry-After']), 60)
+        metrics = throttle_metrics(['login'])['login']
+        self.assertEqual(metrics, {'allowed': 2, 'throttled': 1})
+
+    def test_budgets_are_per_scope(self):
+        """Test exhausting the login budget leaves other scopes alone"""
+        with patch.dict(LoginRateThrottle.THROTTLE_RATES, login='1/min'):
+            self.client.post(TOKEN_URL, {})
+            res = self.client.post(TOKEN_URL, {})
+            self.assertEqual(res.status_code,
+                             status.HTTP_429_TOO_MANY_REQUESTS)
+
+            res = self.client.post(reverse('user:create'), {})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_previous_window_counts_partially(self):
+        """Test the budget refills gradually after the window ends"""
+        throttle_class = type('Throttle', (ReadRateThrottle,),
+                              {'rate': '10/min'})
+        request = type('Request', (), {
+            'method': 'GET',
+            'user': None,
+            'META': {'REMOTE_ADDR': '10.0.0.1'},
+        })()
+        view = object()
+
+        def allowed_at(now):
+            throttle = throttle_class()
+            throttle.timer = lambda: now
+            return throttle.allow_request(request, view)
+
+        self.assertTrue(all(allowed_at(6000 + i) for i in range(10)))
+        # Unlike a fixed window the budget is not reset at the boundary.
+        self.assertFalse(allowed_at(6060))
+        # Half of the previous window still overlaps 30s into the next one.
+        # The rejected request counts against the budget too.
+        self.assertEqual(sum(allowed_at(6090) for _ in range(10)), 4)
@@ -0,0 +1,177 @@
+"""
+Tests for the outbox and webhook delivery
+"""
+import hashlib
+import hmac
+import json
+import threading
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core.models import OutboxEvent, Recipe, Tag, Webhook
+
+
+class StandIn(ThreadingHTTPServer):
+    """Local HTTP server recording the webhook requests"""
+
+    def __init__(self, status=200):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.status = status
+        self.requests = []
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/hook'
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((dict(self.headers), body))
+        self.send_response(self.server.status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class WebhookTests(TestCase):
+    """Test recording events and posting them to webhooks"""
+    # The outbox of every shard is delivered
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'user@example.com', 'test@123')
+
+    def start_stand_in(self, status=200):
+        server = StandIn(status)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def create_recipe(self):
+        return Recipe.objects.create(user=self.user, title='Soup',
+                                     time_minutes=5, price=Decimal('1.00'))
+
+    def test_events_recorded_with_change(self):
+        """Test changes queue events in their transaction"""
+        recipe = self.create_recipe()
+        recipe_id = recipe.id
+        recipe.title = 'Stew'
+        recipe.save()
+        recipe.delete()
+        with self.assertRaises(ValueError), transaction.atomic():
+            Tag.objects.create(user=self.user, name='Quick')
+            raise ValueError
+
+        self.assertEqual(
+            list(OutboxEvent.objects.order_by('id').values_list(
+                'type', 'object_id')),
+            [('recipe.created', recipe_id), ('recipe.updated', recipe_id),
+             ('recipe.deleted', recipe_id)])
+        self.assertEqual(OutboxEvent.objects.first().data['title'], 'Soup')
+
+    def test_one_event_per_recipe_change_with_links(self):
+        """Test API writes queue one recipe event, after its links"""
+        client = APIClient()
+        client.force_authenticate(self.user)
+        res = client.post(reverse('recipe:recipe-list'), {
+            'title': 'Soup', 'time_minutes': 5, 'price': '1.00',
+            'tags': [{'name': 'Quick'}, {'name': 'Hot'}],
+            'ingredients': [{'name': 'Salt'}]}, format='json')
+        recipe = Recipe.objects.get(pk=res.data['id'])
+
+        self.assertEqual(
+            list(OutboxEvent.objects.order_by('id').values_list(
+                'type', flat=True)),
+            ['tag.created', 'tag.created', 'ingredient.created',
+             'recipe.created'])
+        created = OutboxEvent.objects.get(type='recipe.created')
+        self.assertEqual(sorted(created.data['tags']),
+                         sorted(tag.pk for tag in recipe.tags.all()))
+        self.assertEqual(len(created.data['ingredients']), 1)
+
+        OutboxEvent.objects.all().delete()
+        client.patch(reverse('recipe:recipe-detail', args=[recipe.pk]), {
+            'title': 'Stew', 'tags': [{'name': 'Quick'}]}, format='json')
+
+        updated = OutboxEvent.objects.get()
+        self.assertEqual(updated.type, 'recipe.updated')
+        self.assertEqual(updated.data['title'], 'Stew')
+        self.assertEqual(updated.data['tags'],
+                         [Tag.objects.get(name='Quick').pk])
+
+    def test_update_versioned_records_events(self):
+        """Test bulk versioned updates queue an event per object"""
+        recipes = [self.create_recipe() for _ in range(2)]
+        OutboxEvent.objects.all().delete()
+
+        Recipe.objects.filter(user=self.user).update_versioned(
+            title='Stew')
+
+        events = OutboxEvent.objects.order_by('object_id')
+        self.assertEqual(
+            [(event.type, event.object_id, event.data['title'])
+             for event in events],
+            [('recipe.updated', recipe.pk, 'Stew') for recipe in recipes])
+        self.assertEqual(events[0].data['version'],
+                         Recipe.objects.get(pk=recipes[0].pk).version)
+
+    def test_deliver_batches(self):
+        """Test the events are posted in batches, signed, and deleted"""
+        server = self.start_stand_in()
+        Webhook.objects.create(url=server.url, secret='s3cret')
+        for _ in range(3):
+            self.create_recipe()
+
+        call_command('deliver_webhooks', batch_size=2, stdout=StringIO())
+
+        self.assertEqual(len(server.requests), 2)
+        headers, body = server.requests[0]
+        self.assertEqual(
+            headers['X-Webhook-Signature'],
+            'sha256=' + hmac.new(b's3cret', body, hashlib.sha256).hexdigest())
+        events = [event for _, body in server.requests
+                  for event in json.loads(body)['events']]
+        self.assertEqual([event['type'] for event in events],
+                         ['recipe.created'] * 3)
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_failed_delivery_retried_later(self):
+        """Test events a webhook refused are kept for a retry, without
+        posting them again to the webhooks that took them"""
+        ok = self.start_stand_in()
+        failing = self.start_stand_in(status=503)
+        accepted = Webhook.objects.create(url=ok.url)
+        Webhook.objects.create(url=failing.url)
+        self.create_recipe()
+
+        call_command('deliver_webhooks', stdout=StringIO())
+
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.attempts, 1)
+        self.assertEqual(event.delivered_to, [accepted.pk])
+        self.assertIn('HTTP 503', event.last_error)
+        self.assertIsNotNone(event.next_attempt)
+
+        OutboxEvent.objects.update(next_attempt=event.created)
+        failing.status = 200
+        call_command('deliver_webhooks', stdout=StringIO())
+
+        self.assertEqual(len(ok.requests), 1)
+        self.assertEqual(len(failing.requests), 2)
+        self.assertFalse(OutboxEvent.objects.exists())
@@ -0,0 +1,141 @@
+"""
+Per-user, per-endpoint request throttles backed by atomic cache counters
+"""
+import logging
+
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import SimpleRateThrottle
+
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY = 'throttle-metrics:%s:%s'
+METRIC_OUTCOMES = ('allowed', 'throttled')
+
+
+def _incr(key, timeout):
+    """Atomically increment the counter at `key`, creating it if needed"""
+    if cache.add(key, 1, timeout):
+        return 1
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # The counter expired between add() and incr().
+        cache.add(key, 1, timeout)
+        return 1
+
+
+def throttle_metrics(scopes):
+    """Return {scope: {outcome: count}} for the given throttle scopes"""
+    keys = {(scope, outcome): METRICS_KEY % (scope, outcome)
+            for scope in scopes for outcome in METRIC_OUTCOMES}
+    values = cache.get_many(keys.values())
+    metrics = {scope: dict.fromkeys(METRIC_OUTCOMES, 0) for scope in scopes}
+    for (scope, outcome), key in keys.items():
+        metrics[scope][outcome] = values.get(key, 0)
+    return metrics
+
+
+class ScopedRateThrottle(SimpleRateThrottle):
+    """Throttle requests per user (or client address) and endpoint
+
+    Unlike DRF's throttles, which read and rewrite a list of timestamps,
+    each request costs one atomic cache increment and one read. Counts are
+    kept for fixed windows of the rate's period and the previous window's
+    count is weighted by how much of it still overlaps the sliding window,
+    so budgets refill gradually like a token bucket instead of resetting
+    at the window boundary.
+    """
+    cache = cache
+    cache_format = 'throttle:%(scope)s:%(endpoint)s:%(ident)s'
+    # Methods counted against this throttle's budget, None for all.
+    methods = None
+
+    def get_cache_key(self, request, view):
+        if self.methods is not None and request.method not in self.methods:
+            return None
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {
+            'scope': self.scope,
+            'endpoint': self.get_endpoint(view),
+            'ident': ident,
+        }
+
+    def get_endpoint(self, view):
+        """Name of the endpoint the budget is kept for"""
+        basename = getattr(view, 'basename', None)
+        return basename or view.__class__.__name__
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.now = self.timer()
+        window, elapsed = divmod(self.now, self.duration)
+        current = _incr(f'{self.key}:{int(window)}', self.duration * 2)
+        previous = self.cache.get(f'{self.key}:{int(window) - 1}', 0)
+        overlap = 1 - elapsed / self.duration
+        self.count = previous * overlap + current
+        self.previous, self.elapsed = previous, elapsed
+
+        if self.count > self.num_requests:
+            self.record('throttled')
+            logger.info('Throttled %s', self.key)
+            return self.throttle_failure()
+        self.record('allowed')
+        return True
+
+    def record(self, outcome):
+        """Count the throttle decision for throttle_metrics()"""
+        _incr(METRICS_KEY % (self.scope, outcome), None)
+
+    def wait(self):
+        """Seconds until the weighted count is back under the limit"""
+        # The next request is counted too.
+        excess = self.count + 1 - self.num_requests
+        remaining = self.duration - self.elapsed
+        if self.previous and excess <= self.previous * remaining / \
+                self.duration:
+            # The previous window's requests age out of the count.
+            return excess * self.duration / self.previous
+        return remaining
+
+
+class ReadRateThrottle(ScopedRateThrottle):
+    """Budget for reads of an endpoint"""
+    scope = 'read'
+    methods = SAFE_METHODS
+
+
+class WriteRateThrottle(ScopedRateThrottle):
+    """Budget for writes to an endpoint"""
+    scope = 'write'
+    methods = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+class UploadRateThrottle(ScopedRateThrottle):
+    """Budget for image uploads"""
+    scope = 'upload'
+
+
+class LoginRateThrottle(ScopedRateThrottle):
+    """Budget for token requests, limits password guessing"""
+    scope = 'login'
+
+
+class SignupRateThrottle(ScopedRateThrottle):
+    """Budget for account creation"""
+    scope = 'signup'
+
+
+THROTTLE_SCOPES = [throttle.scope for throttle in (
+    ReadRateThrottle, WriteRateThrottle, UploadRateThrottle,
+    LoginRateThrottle, SignupRateThrottle,
+)]
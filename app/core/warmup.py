@@ -0,0 +1,56 @@
+"""
+Pre-fork warm-up of the state every request shares
+"""
+import gc
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.hashers import get_hashers
+from django.db import connections
+from django.urls import get_resolver
+from PIL import Image
+
+
+def _views(patterns):
+    """Yield the view classes routed by the URL `patterns`"""
+    for pattern in patterns:
+        if hasattr(pattern, 'url_patterns'):
+            yield from _views(pattern.url_patterns)
+        else:
+            view = getattr(pattern.callback, 'cls', None)
+            if view is not None:
+                yield view
+
+
+def warm_up():
+    """Import and build what requests would otherwise build lazily
+
+    Run in the server's master process before it forks its workers (e.g.
+    gunicorn --preload), so the workers share these pages copy-on-write
+    instead of each building a copy. The garbage collector is told to
+    leave the resulting objects alone, as collecting them would write to
+    their pages and unshare them.
+    """
+    # Imports every view module and fills the reverse lookup tables.
+    resolver = get_resolver()
+    resolver.reverse_dict
+
+    for model in apps.get_models():
+        model._meta.get_fields()
+
+    for view in set(_views(resolver.url_patterns)):
+        serializer_class = getattr(view, 'serializer_class', None)
+        if serializer_class is not None:
+            serializer_class().fields
+
+    get_hashers()
+    Image.init()
+
+    if 'drf_spectacular' in settings.INSTALLED_APPS:
+        from core.schema import schema_cache
+        schema_cache.get('json')
+
+    # Database connections must not be inherited by the forked workers.
+    connections.close_all()
+    gc.collect()
+    gc.freeze()
@@ -0,0 +1,180 @@
+"""
+Batched delivery of the outbox events to the registered webhooks
+
+Each shard's outbox is read in batches of due events, claimed with
+SELECT ... FOR UPDATE SKIP LOCKED and a lease so several workers can
+share it. A batch is posted as one JSON body to every active webhook
+that does not have it yet, concurrently, over a bounded pool of
+keep-alive connections. Events every webhook has are deleted, the others
+are retried with exponential backoff.
+"""
+import hashlib
+import hmac
+import http.client
+import json
+import queue
+import threading
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import OutboxEvent, Webhook
+
+
+class DeliveryError(Exception):
+    """A webhook did not accept a batch"""
+
+
+class ConnectionPool:
+    """Keep-alive HTTP connections, at most `size` of them open per host"""
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def _host(self, scheme, netloc):
+        with self._lock:
+            if (scheme, netloc) not in self._hosts:
+                self._hosts[scheme, netloc] = (
+                    threading.BoundedSemaphore(self.size), queue.LifoQueue())
+            return self._hosts[scheme, netloc]
+
+    def post(self, url, body, headers):
+        """POST `body` to `url`, return the response status"""
+        parts = urlsplit(url)
+        slots, idle = self._host(parts.scheme, parts.netloc)
+        with slots:
+            try:
+                connection = idle.get_nowait()
+            except queue.Empty:
+                connection_class = http.client.HTTPSConnection \
+                    if parts.scheme == 'https' else http.client.HTTPConnection
+                connection = connection_class(parts.netloc,
+                                              timeout=self.timeout)
+            path = parts.path or '/'
+            if parts.query:
+                path += f'?{parts.query}'
+            try:
+                connection.request('POST', path, body, headers)
+                response = connection.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                idle.put(connection)
+            return response.status
+
+    def close(self):
+        with self._lock:
+            for _, idle in self._hosts.values():
+                while not idle.empty():
+                    idle.get_nowait().close()
+            self._hosts.clear()
+
+
+def post_events(pool, webhook, events):
+    """Post `events` to `webhook` as one JSON body, raise DeliveryError
+    unless it answers 2xx"""
+    body = json.dumps({'events': [{
+        'id': event.pk,
+        'type': event.type,
+        'user_id': event.user_id,
+        'object_id': event.object_id,
+        'data': event.data,
+        'created': event.created,
+    } for event in events]}, cls=DjangoJSONEncoder).encode()
+    headers = {'Content-Type': 'application/json'}
+    if webhook.secret:
+        headers['X-Webhook-Signature'] = 'sha256=' + hmac.new(
+            webhook.secret.encode(), body, hashlib.sha256).hexdigest()
+    try:
+        status = pool.post(webhook.url, body, headers)
+    except (OSError, http.client.HTTPException) as exc:
+        raise DeliveryError(f'{webhook.url}: {exc}')
+    if not 200 <= status < 300:
+        raise DeliveryError(f'{webhook.url}: HTTP {status}')
+
+
+def claim_events(alias, batch_size, lease):
+    """Lease up to `batch_size` due events of the `alias` outbox, oldest
+    first, skipping those other workers hold"""
+    now = timezone.now()
+    with transaction.atomic(using=alias):
+        events = list(OutboxEvent.objects.using(alias)
+                      .select_for_update(skip_locked=True)
+                      .filter(next_attempt__lte=now)
+                      .order_by('id')[:batch_size])
+        OutboxEvent.objects.using(alias).filter(
+            pk__in=[event.pk for event in events]
+        ).update(next_attempt=now + timedelta(seconds=lease))
+    return events
+
+
+def retry_delay(attempts):
+    """Seconds before the next delivery of an event that failed
+    `attempts` times"""
+    return min(settings.WEBHOOK_RETRY_DELAY * 2 ** (attempts - 1),
+               settings.WEBHOOK_RETRY_MAX_DELAY)
+
+
+def deliver_batch(alias, events, webhooks, pool, executor):
+    """Post `events` to the webhooks missing them and record the outcome,
+    return the number of events delivered to every webhook"""
+    futures = {}
+    for webhook in webhooks:
+        missing = [event for event in events
+                   if webhook.pk not in event.delivered_to]
+        if missing:
+            futures[webhook] = (missing, executor.submit(
+                post_events, pool, webhook, missing))
+
+    errors = {}
+    for webhook, (missing, future) in futures.items():
+        try:
+            future.result()
+        except DeliveryError as exc:
+            for event in missing:
+                errors[event.pk] = str(exc)
+        else:
+            for event in missing:
+                event.delivered_to.append(webhook.pk)
+
+    done = [event.pk for event in events if event.pk not in errors]
+    OutboxEvent.objects.using(alias).filter(pk__in=done).delete()
+    now = timezone.now()
+    failed = [event for event in events if event.pk in errors]
+    for event in failed:
+        event.attempts += 1
+        event.last_error = errors[event.pk]
+        event.next_attempt = None \
+            if event.attempts >= settings.WEBHOOK_MAX_ATTEMPTS else \
+            now + timedelta(seconds=retry_delay(event.attempts))
+    OutboxEvent.objects.using(alias).bulk_update(
+        failed, ['delivered_to', 'attempts', 'last_error', 'next_attempt'])
+    return len(done)
+
+
+def deliver_events(pool, executor, batch_size, lease):
+    """Deliver the due events of every shard through `pool`, posting in
+    the threads of `executor`, return the number of events delivered to
+    every webhook and the number of failed ones"""
+    webhooks = list(Webhook.objects.filter(is_active=True))
+    delivered = failed = 0
+    for alias in settings.DATABASE_SHARDS:
+        while True:
+            events = claim_events(alias, batch_size, lease)
+            if not events:
+                break
+            done = deliver_batch(alias, events, webhooks, pool, executor)
+            delivered += done
+            failed += len(events) - done
+    return delivered, failed
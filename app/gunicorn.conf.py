@@ -0,0 +1,64 @@
+"""
+gunicorn configuration, read from the working directory on start
+
+Worker and thread counts are derived from the CPUs available to the
+container and the database connections one instance may hold, override
+them with GUNICORN_WORKERS and GUNICORN_THREADS. The change stream
+(`app.asgi`, see recipe.stream) is served by its own instance with
+GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker, its workers query in
+as many threads.
+
+Workers are forked from a master that preloaded and warmed up the app
+(see core.warmup), so HUP only restarts workers with the loaded code. To
+deploy new code without dropping requests send USR2, which starts a new
+master next to the old one, then QUIT to the old master.
+"""
+import math
+import os
+
+
+def cpu_count():
+    """CPUs available to this process, honouring a cgroup CPU quota"""
+    count = len(os.sched_getaffinity(0))
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            count = min(count, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return count
+
+
+# Database connections this instance may hold, every thread keeps one open
+DB_MAX_CONNECTIONS = int(os.environ.get('DB_MAX_CONNECTIONS', 20))
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+# Threads overlap the time requests wait on the database and storage
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+# Each worker's batch read threads hold connections too, see core.batch
+batch_threads = int(os.environ.get('BATCH_READ_WORKERS', 0))
+workers = int(os.environ.get(
+    'GUNICORN_WORKERS',
+    max(1, min(2 * cpu_count() + 1,
+               DB_MAX_CONNECTIONS // (threads + batch_threads)))
+))
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+# Recycle workers to cap memory growth, jittered so they do not all
+# restart at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+# Worker heartbeats on tmpfs, a disk backed /tmp can stall them
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+accesslog = '-'
+
+
+def on_starting(server):
+    server.log.info('Starting %d %s workers with %d threads each',
+                    workers, worker_class, threads)
@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class RecipeConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recipe'
+
+    def ready(self):
+        """Keep the autocomplete name index in sync with the database"""
+        from core.models import Tag, Ingredient
+        from recipe.autocomplete import invalidate_name_index
+
+        for model in (Tag, Ingredient):
+            post_save.connect(invalidate_name_index, sender=model)
+            post_delete.connect(invalidate_name_index, sender=model)
@@ -0,0 +1,127 @@
+"""
+In-process name index used by the tag/ingredient autocomplete endpoint
+"""
+import bisect
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models.functions import Lower
+
+from core.metrics import CACHE_REQUESTS
+
+
+# Marker cached for users whose vocabulary is too large to keep in memory,
+# their lookups go straight to the (user, lower(name)) database index.
+TOO_LARGE = object()
+
+
+class NameIndex:
+    """Sorted prefix index over the names of one user's tags/ingredients
+
+    Names are kept as a sorted list of ``(lowercased name, name, id)``
+    tuples, so a prefix lookup is a bisect to the first match followed by
+    a slice of the next ``limit`` entries.
+    """
+
+    def __init__(self, rows):
+        self.entries = sorted((name.lower(), name, pk) for pk, name in rows)
+        self.keys = [entry[0] for entry in self.entries]
+
+    def search(self, prefix, limit):
+        """Return up to `limit` (id, name) pairs starting with `prefix`"""
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self.keys, prefix)
+        results = []
+        for key, name, pk in self.entries[start:start + limit]:
+            if not key.startswith(prefix):
+                break
+            results.append((pk, name))
+        return results
+
+
+class NameIndexCache:
+    """Per-process LRU cache of `NameIndex` objects keyed by model and user
+
+    Entries are dropped when a tag/ingredient is saved or deleted in this
+    process and expire after `AUTOCOMPLETE_CACHE_TTL` seconds so other
+    worker processes pick up changes too.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, model, user_id):
+        return (model._meta.label_lower, user_id)
+
+    def get(self, model, user_id):
+        """Return the cached index, `TOO_LARGE` or None on a miss"""
+        key = self._key(model, user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, index = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return index
+
+    def set(self, model, user_id, index):
+        """Store the index for the user, evicting the oldest entries"""
+        key = self._key(model, user_id)
+        expires = time.monotonic() + settings.AUTOCOMPLETE_CACHE_TTL
+        with self._lock:
+            self._entries[key] = (expires, index)
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.AUTOCOMPLETE_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, model, user_id):
+        """Drop the cached index for the user"""
+        with self._lock:
+            self._entries.pop(self._key(model, user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+name_index_cache = NameIndexCache()
+
+
+def _search_database(queryset, prefix, limit):
+    """Prefix search backed by the (user, lower(name)) index"""
+    return list(
+        queryset.annotate(name_lower=Lower('name'))
+        .filter(name_lower__startswith=prefix.lower())
+        .order_by('name_lower', 'id')
+        .values_list('id', 'name')[:limit]
+    )
+
+
+def autocomplete(model, user, prefix, limit):
+    """Return up to `limit` (id, name) pairs of `user`'s objects whose
+    name starts with `prefix` (case-insensitive), ordered by name."""
+    queryset = model.objects.filter(user=user)
+    index = name_index_cache.get(model, user.id)
+    CACHE_REQUESTS.inc(cache='autocomplete',
+                       result='miss' if index is None else 'hit')
+
+    if index is None:
+        max_size = settings.AUTOCOMPLETE_INDEX_MAX_SIZE
+        rows = list(queryset.values_list('id', 'name')[:max_size + 1])
+        index = TOO_LARGE if len(rows) > max_size else NameIndex(rows)
+        name_index_cache.set(model, user.id, index)
+
+    if index is TOO_LARGE:
+        return _search_database(queryset, prefix, limit)
+    return index.search(prefix, limit)
+
+
+def invalidate_name_index(sender, instance, **kwargs):
+    """Signal receiver dropping the cached index of the instance's user"""
+    name_index_cache.invalidate(sender, instance.user_id)
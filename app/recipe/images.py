@@ -0,0 +1,234 @@
+"""
+Resized recipe image renditions cached on disk
+"""
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import (FileResponse,
+                         HttpResponse,
+                         StreamingHttpResponse)
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from core.metrics import (CACHE_REQUESTS,
+                          IMAGE_RENDER_DURATION,
+                          IMAGE_RENDERS_IN_PROGRESS)
+from core.storage import CONTENT_ADDRESSED_NAME_RE
+
+
+FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 85, 'optimize': True}),
+    'png': ('PNG', 'image/png', {'optimize': True}),
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+}
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Rendition mtimes are refreshed on hits at most this often (seconds) so
+# eviction approximates least recently used without a write per request.
+TOUCH_INTERVAL = 3600
+
+CHUNK_SIZE = 64 * 1024
+
+
+class RenditionError(Exception):
+    """Raised for unsupported rendition parameters"""
+
+
+class UnreadableImage(Exception):
+    """Raised when the source image cannot be decoded"""
+
+
+def rendition_key(source_path, width, fmt):
+    """Content address of a rendition, changes whenever the source does"""
+    identity = source_path
+    if not CONTENT_ADDRESSED_NAME_RE.search(source_path):
+        stat = os.stat(source_path)
+        identity = f'{source_path}:{stat.st_size}:{stat.st_mtime_ns}'
+    return hashlib.sha256(f'{identity}:{width}:{fmt}'.encode()).hexdigest()
+
+
+def rendition_path(key, fmt):
+    """Location of a rendition inside IMAGE_RENDITION_ROOT"""
+    return os.path.join(settings.IMAGE_RENDITION_ROOT, key[:2], f'{key}.{fmt}')
+
+
+def render(source_path, target_path, width, fmt):
+    """Write `source_path` scaled down to `width` pixels in `fmt`"""
+    pil_format, _, save_options = FORMATS[fmt]
+    try:
+        with Image.open(source_path) as img:
+            # Let the JPEG decoder downscale while decoding, far cheaper
+            # than decoding the full image and resizing it afterwards.
+            img.draft('RGB', (width, width * img.height // img.width))
+            # A copy, decoded before the source file is closed
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((width, img.height), Image.LANCZOS)
+    except (UnidentifiedImageError, OSError) as exc:
+        raise UnreadableImage(str(exc)) from exc
+    if pil_format == 'JPEG' and img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    # Write to a temporary file first so concurrent requests never see a
+    # partially written rendition.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target_path))
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            img.save(tmp, pil_format, **save_options)
+        os.replace(tmp_path, target_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _size_key():
+    return f'image-renditions-size:{settings.IMAGE_RENDITION_ROOT}'
+
+
+def record_rendition(path, max_bytes):
+    """Add the new rendition at `path` to the tracked size of the cache,
+    evicting renditions only once it exceeds `max_bytes`
+
+    The size is kept in the default cache, so one scan of the directory
+    counts it and later renditions add to it.
+    """
+    try:
+        total = cache.incr(_size_key(), os.path.getsize(path))
+    except ValueError:
+        # Not counted yet
+        total = None
+    if total is None or total > max_bytes:
+        evict(max_bytes, keep=path)
+
+
+def evict(max_bytes, keep=None):
+    """Delete the least recently used renditions once the cache exceeds
+    `max_bytes`, leaving it at 90% of the limit. The rendition at `keep`
+    is about to be served and is never evicted. Records the size left
+    for record_rendition()."""
+    entries = []
+    total = 0
+    with os.scandir(settings.IMAGE_RENDITION_ROOT) as shards:
+        for shard in shards:
+            if not shard.is_dir():
+                continue
+            with os.scandir(shard.path) as files:
+                for entry in files:
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+    if total > max_bytes:
+        entries.sort()
+        for _, size, path in entries:
+            if total <= max_bytes * 0.9:
+                break
+            if path == keep:
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+    cache.set(_size_key(), total, None)
+
+
+def get_rendition(source_path, width, fmt):
+    """Return (path, key) of the rendition, generating it if needed
+
+    Raises RenditionError for unsupported parameters and UnreadableImage
+    if the source image cannot be decoded.
+    """
+    if width not in settings.IMAGE_RENDITION_WIDTHS:
+        raise RenditionError(
+            f'width must be one of {settings.IMAGE_RENDITION_WIDTHS}')
+    if fmt not in FORMATS:
+        raise RenditionError(f'fmt must be one of {sorted(FORMATS)}')
+
+    key = rendition_key(source_path, width, fmt)
+    path = rendition_path(key, fmt)
+    try:
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        CACHE_REQUESTS.inc(cache='image_rendition', result='miss')
+        with IMAGE_RENDERS_IN_PROGRESS.track_inprogress(), \
+                IMAGE_RENDER_DURATION.time():
+            render(source_path, path, width, fmt)
+        record_rendition(path, settings.IMAGE_RENDITION_CACHE_MAX_BYTES)
+    else:
+        CACHE_REQUESTS.inc(cache='image_rendition', result='hit')
+        if mtime < time.time() - TOUCH_INTERVAL:
+            os.utime(path)
+    return path, key
+
+
+def _iter_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def _parse_range(header, size):
+    """Return (start, end) for a single byte range header, None when the
+    header should be ignored and False when it is unsatisfiable."""
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start > end or start >= size:
+        return False
+    return start, end
+
+
+def rendition_response(request, path, key, fmt):
+    """Serve a rendition with caching headers and byte range support"""
+    etag = quote_etag(key)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        content_type = FORMATS[fmt][1]
+        size = os.path.getsize(path)
+        byte_range = None
+        if 'HTTP_RANGE' in request.META:
+            byte_range = _parse_range(request.META['HTTP_RANGE'], size)
+
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+        elif byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                _iter_range(path, start, end - start + 1),
+                status=206,
+                content_type=content_type
+            )
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        else:
+            # FileResponse lets the server use sendfile() when available.
+            response = FileResponse(open(path, 'rb'),
+                                    content_type=content_type)
+
+    response['ETag'] = etag
+    response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = (
+        f'private, max-age={settings.IMAGE_RENDITION_MAX_AGE}')
+    return response
@@ -0,0 +1,77 @@
+"""
+Django command to show the tables and partitions the API queries read.
+"""
+import re
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.http import HttpRequest, QueryDict
+from rest_framework.request import Request
+
+from core.partitioning import scanned_relations
+from recipe.views import IngredientViewset, RecipeViewset, TagViewset
+
+
+PARTITION_RE = re.compile(r'^(?P<table>.+)_p\d+$')
+
+QUERIES = [
+    ('recipes', RecipeViewset, {}),
+    ('recipes by tag', RecipeViewset, {'tags': '0'}),
+    ('recipes by ingredient', RecipeViewset, {'ingredients': '0'}),
+    ('cheap quick recipes', RecipeViewset,
+     {'max_price': '10', 'max_time': '30', 'ordering': 'price'}),
+    ('tags', TagViewset, {}),
+    ('assigned tags', TagViewset, {'assigned_only': '1'}),
+    ('ingredients', IngredientViewset, {}),
+    ('assigned ingredients', IngredientViewset, {'assigned_only': '1'}),
+]
+
+
+def api_queryset(view_class, user, params):
+    """Return the queryset the list action of `view_class` runs"""
+    http_request = HttpRequest()
+    http_request.GET = QueryDict(mutable=True)
+    http_request.GET.update(params)
+    request = Request(http_request)
+    request.user = user
+    view = view_class(request=request, action='list', args=(), kwargs={},
+                      format_kwarg=None)
+    return view.get_queryset()
+
+
+class Command(BaseCommand):
+    help = ('EXPLAIN the list queries of the recipe API for a user and '
+            'show the tables read, with the partitions read of '
+            'partitioned tables (Postgres only).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help='User the queries are run for.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('EXPLAIN output is read on PostgreSQL only.')
+        try:
+            user = get_user_model().objects.get(email=options['email'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'No user {options["email"]}.')
+
+        pruned = True
+        for name, view_class, params in QUERIES:
+            plan = api_queryset(view_class, user, params).explain(
+                format='json')
+            partitions = {}
+            for relation in sorted(scanned_relations(plan)):
+                match = PARTITION_RE.match(relation)
+                table = match['table'] if match else relation
+                partitions.setdefault(table, []).append(relation)
+            self.stdout.write(f'{name}:')
+            for table, relations in partitions.items():
+                self.stdout.write(f'  {table}: {", ".join(relations)}')
+                pruned &= len(relations) == 1
+        if pruned:
+            self.stdout.write(self.style.SUCCESS(
+                'Every query reads a single partition per table.'))
+        else:
+            self.stdout.write(self.style.WARNING(
+                'Some queries read several partitions of a table.'))
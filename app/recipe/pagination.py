@@ -0,0 +1,118 @@
+"""
+Keyset pagination of the recipe list
+"""
+import binascii
+import json
+from base64 import b64decode, b64encode
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Paginate a queryset ordered by (field, id) with opaque cursors
+
+    The cursor holds the field value and id of the last object of the
+    page, the next page starts after it, so every page is a range scan of
+    a (user, field, id) index however deep it is. Only lists requested
+    with `page_size` are paginated.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return None
+        page_size = max(1, min(page_size, self.max_page_size))
+        self.request = request
+        self.ordering = [name.lstrip('-')
+                         for name in queryset.query.order_by]
+        descending = queryset.query.order_by[0].startswith('-')
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded:
+            cursor = self.decode_cursor(encoded, queryset.model)
+            queryset = queryset.filter(self._after(cursor, descending))
+        page = list(queryset[:page_size + 1])
+        self.next_cursor = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_cursor = self.encode_cursor(page[-1])
+        return page
+
+    def _after(self, values, descending):
+        """Return the filter for the objects ordered after the cursor
+        `values`
+
+        The leading >= (or <=) on the first field bounds the index scan,
+        the rest picks the objects after the cursor among equal values.
+        """
+        op = 'lt' if descending else 'gt'
+        condition = Q(**{f'{self.ordering[-1]}__{op}': values[-1]})
+        for name, value in zip(self.ordering[-2::-1], values[-2::-1]):
+            condition = Q(**{f'{name}__{op}': value}) | \
+                Q(**{name: value}) & condition
+        return Q(**{f'{self.ordering[0]}__{op}e': values[0]}) & condition
+
+    def encode_cursor(self, obj):
+        values = [str(getattr(obj, name)) for name in self.ordering]
+        return b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, encoded, model):
+        """Return the field values of the cursor"""
+        try:
+            cursor = json.loads(b64decode(encoded.encode(), validate=True))
+            if not isinstance(cursor, list) or \
+                    len(cursor) != len(self.ordering):
+                raise ValueError(cursor)
+            return [model._meta.get_field(name).to_python(value)
+                    for name, value in zip(self.ordering, cursor)]
+        except (binascii.Error, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(),
+                                   self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True,
+                         'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Number of results per page, the list is '
+                               'not paginated without it',
+                'schema': {'type': 'integer'},
+            },
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Cursor from the `next` link of the '
+                               'previous page',
+                'schema': {'type': 'string'},
+            },
+        ]
@@ -3,9 +3,24 @@ Serializer for the recipe API
 """
 
 
-from rest_framework import serializers
+from django.db import router, transaction
+from rest_framework import exceptions, serializers
 
-from core.models import Recipe, Tag, Ingredient
+from core.models import (Recipe,
+                         RecipeIngredient,
+                         RecipeTag,
+                         Tag,
+                         Ingredient,
+                         VersionConflict,
+                         record_events)
+from recipe.uploads import ImageUploadError, inspect_image
+
+
+class RecipeConflict(exceptions.APIException):
+    """The recipe was changed since the version the client read"""
+    status_code = 409
+    default_detail = 'The recipe was changed by another request.'
+    default_code = 'conflict'
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -34,6 +49,8 @@ class RecipeSerializer(serializers.ModelSerializer):
     user = serializers.StringRelatedField(read_only=True)
     tags = TagSerializer(many=True, required=False)
     ingredients = IngredientSerializer(many=True, required=False)
+    # Sent back on updates, they fail with 409 if the recipe changed since
+    version = serializers.IntegerField(required=False)
 
     class Meta:
         model = Recipe
@@ -45,34 +62,45 @@ class RecipeSerializer(serializers.ModelSerializer):
                   'user',
                   'tags',
                   'ingredients',
+                  'version',
                   ]
         read_only_fields = ['id']
 
     def create(self, validated_data):
-        """Create a new recipe"""
+        """Create a new recipe
+
+        Its tags and ingredients are looked up or created first and the
+        links written through the link models, so the recipe takes one
+        version instead of one more per m2m_changed signal. Its webhook
+        event is queued once the links are written.
+        """
+        validated_data.pop('version', None)
         tags = validated_data.pop('tags', [])
         ingredients = validated_data.pop('ingredients', [])
-        # Create the recipe with the user and the defaults
-        # and the tags passed in
-        recipe = Recipe.objects.create(**validated_data)
-
         auth_user = self.context['request'].user  # get the authenticated user
 
-        # Create or get tags, and add to the recipe
-        for tag in tags:
-            tag_obj, created = Tag.objects.get_or_create(
-                user=auth_user,
-                **tag
-            )
-            recipe.tags.add(tag_obj)
-
-        # Create or get ingredients, and add to the recipe
-        for ingredient in ingredients:
-            ingredient_obj, created = Ingredient.objects.get_or_create(
-                user=auth_user,
-                **ingredient
-            )
-            recipe.ingredients.add(ingredient_obj)
+        with transaction.atomic(using=router.db_for_write(Recipe)):
+            tag_ids = {
+                Tag.objects.get_or_create_by_name(user=auth_user, **tag)[0].pk
+                for tag in tags
+            }
+            ingredient_ids = {
+                Ingredient.objects.get_or_create_by_name(
+                    user=auth_user, **ingredient)[0].pk
+                for ingredient in ingredients
+            }
+            recipe = Recipe(**validated_data)
+            recipe.save(force_insert=True, event=False)
+            RecipeTag.objects.bulk_create([
+                RecipeTag(recipe=recipe, user=recipe.user, tag_id=tag_id)
+                for tag_id in tag_ids
+            ])
+            RecipeIngredient.objects.bulk_create([
+                RecipeIngredient(recipe=recipe, user=recipe.user,
+                                 ingredient_id=ingredient_id)
+                for ingredient_id in ingredient_ids
+            ])
+            record_events([recipe], 'created', recipe._state.db)
         return recipe
 
 
@@ -83,49 +111,105 @@ class RecipeDetailSerializer(RecipeSerializer):
         fields = RecipeSerializer.Meta.fields + ['description', 'image']
 
     def update(self, instance, validated_data):
-        """Update a recipe"""
+        """Update a recipe
+
+        Only the changed columns are written, with one UPDATE that also
+        checks `version` if the client sent the version it read (409
+        otherwise), and only the tag and ingredient links that differ are
+        deleted or created. All of it in one transaction, which queues one
+        webhook event once the links are written.
+        """
+        expected_version = validated_data.pop('version', None)
         tags = validated_data.pop('tags', None)
         ingredients = validated_data.pop('ingredients', None)
-        if tags is not None:
-            instance.tags.clear()  # delete all the tags
-            for tag in tags:
-                tag_obj, created = Tag.objects.get_or_create(
-                    user=instance.user,
-                    **tag
-                )
-                instance.tags.add(tag_obj)
-
-        if ingredients is not None:
-            # `instance.ingredients.clear()` clears all the ingredients
-            # associated with the recipe instance.
-            #  It removes all the existing ingredients from the
-            # ManyToMany relationship between the Recipe and Ingredient models.
-            # This is done before adding the new ingredients provided in the
-            # `ingredients` field of the validated data.
-            instance.ingredients.clear()  # delete all the ingredients
-            for ingredient in ingredients:
-                ingredient_obj, created = Ingredient.objects.get_or_create(
-                    user=instance.user,
-                    **ingredient
-                )
-                instance.ingredients.add(ingredient_obj)
-
-        for attr, value in validated_data.items():
-            setattr(instance, attr, value)
-
-        instance.save()
+        changed = [attr for attr, value in validated_data.items()
+                   if getattr(instance, attr) != value]
+        for attr in changed:
+            setattr(instance, attr, validated_data[attr])
+
+        with transaction.atomic(using=instance._state.db):
+            links = []
+            if tags is not None:
+                links += self._link_changes(instance, RecipeTag, 'tag', [
+                    Tag.objects.get_or_create_by_name(
+                        user=instance.user, **tag)[0]
+                    for tag in tags
+                ])
+            if ingredients is not None:
+                links += self._link_changes(
+                    instance, RecipeIngredient, 'ingredient', [
+                        Ingredient.objects.get_or_create_by_name(
+                            user=instance.user, **ingredient)[0]
+                        for ingredient in ingredients
+                    ])
+
+            # Saved first, the version check fails before any link is
+            # written and the UPDATE locks the recipe for the rest.
+            if changed or links:
+                try:
+                    instance.save(update_fields=changed,
+                                  expected_version=expected_version,
+                                  event=False)
+                except VersionConflict:
+                    raise RecipeConflict()
+            elif expected_version not in (None, instance.version):
+                raise RecipeConflict()
+
+            # The through models are used directly, so the m2m_changed
+            # receivers do not save the recipe again for every change.
+            for through, removed, added in links:
+                through.objects.filter(pk__in=removed).delete()
+                through.objects.bulk_create(added, ignore_conflicts=True)
+            if changed or links:
+                record_events([instance], 'updated', instance._state.db)
         return instance
-        # return super().update(instance, validated_data)
+
+    def _link_changes(self, instance, through, field, objs):
+        """Return [(through, link ids to delete, links to create)] linking
+        the recipe to exactly `objs`, [] if it already is"""
+        current = dict(through.objects.filter(recipe=instance).values_list(
+            f'{field}_id', 'pk'))
+        wanted = {obj.pk for obj in objs}
+        if current.keys() == wanted:
+            return []
+        removed = [pk for obj_id, pk in current.items()
+                   if obj_id not in wanted]
+        added = [through(recipe=instance, user=instance.user,
+                         **{f'{field}_id': obj_id})
+                 for obj_id in wanted - current.keys()]
+        return [(through, removed, added)]
+
+
+class RecipeImageField(serializers.ImageField):
+    """Image field validated from the image header only
+
+    Uploads received by `RecipeImageUploadHandler` were inspected while
+    streaming, other files have their header read here. Unlike the default
+    ImageField the pixel data is never decoded.
+    """
+
+    def to_internal_value(self, data):
+        file_object = serializers.FileField.to_internal_value(self, data)
+        info = getattr(file_object, 'image_info', None)
+        if info is None and not hasattr(file_object, 'sha256'):
+            try:
+                info = inspect_image(file_object)
+            except ImageUploadError as exc:
+                raise serializers.ValidationError(str(exc))
+            file_object.seek(0)
+        if info is None:
+            self.fail('invalid_image')
+        return file_object
 
 
 class RecipeImageUploadSerializer(serializers.ModelSerializer):
     """Serializer for uploading images to recipes"""
+    image = RecipeImageField(required=True)
 
     class Meta:
         model = Recipe
         fields = ['id', 'image']
         read_only_fields = ['id']
-        extra_kwargs = {'image': {'required': 'True'}}
 
     # def save(self, **kwargs):
     #     """Save the image in the recipe object"""
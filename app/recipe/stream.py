@@ -0,0 +1,179 @@
+"""
+Server-sent events stream of a user's recipe, tag and ingredient changes
+
+A plain ASGI application, so an idle stream is a coroutine waiting on an
+asyncio.Event and thousands of them share one event loop. Each event is
+a page of the delta sync (recipe.sync.changes) with the sync cursor as
+its id, a client reconnecting with Last-Event-ID resumes after it.
+"""
+import asyncio
+import functools
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+from rest_framework import exceptions
+
+from core.authentication import ExpiringTokenAuthentication
+from core.events import broadcaster
+from core.models import SyncState
+from core.sharding import UserMoved, use_shard
+from recipe.sync import CursorExpired, changes
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Return the threads the streams of this process query in, created
+    on first use so each forked server worker gets its own."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.CHANGE_STREAM_DB_THREADS,
+                thread_name_prefix='change-stream')
+        return _executor
+
+
+def _database(func):
+    """Wrap `func` to run in the streams' pool of threads, which bounds
+    the connections they hold, on connections checked as at the start
+    and end of a request"""
+    def run(*args):
+        close_old_connections()
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+
+    @functools.wraps(func)
+    async def wrapper(*args):
+        return await asyncio.get_running_loop().run_in_executor(
+            _get_executor(), run, *args)
+    return wrapper
+
+
+@_database
+def _authenticate(authorization):
+    """Return the user of an `Authorization: Token <key>` header, None if
+    it is not a valid token"""
+    keyword, _, key = authorization.partition(' ')
+    if keyword != 'Token' or not key:
+        return None
+    try:
+        return ExpiringTokenAuthentication().authenticate_credentials(
+            key.strip())[0]
+    except exceptions.AuthenticationFailed:
+        return None
+
+
+@_database
+def _current_version(user):
+    with use_shard(user.shard):
+        return SyncState.objects.filter(user=user).values_list(
+            'version', flat=True).first() or 0
+
+
+@_database
+def _changes(user, since):
+    with use_shard(user.shard):
+        return changes(user, since, settings.SYNC_PAGE_SIZE, {})
+
+
+def _event(name, data, event_id=None):
+    lines = [] if event_id is None else [f'id: {event_id}']
+    lines += [f'event: {name}',
+              f'data: {json.dumps(data, cls=DjangoJSONEncoder)}']
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+async def _send_json(send, status, data):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body',
+                'body': json.dumps(data).encode()})
+
+
+async def _wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def change_stream(scope, receive, send):
+    """Stream the authenticated user's changes as `changes` events
+
+    Starts after the Last-Event-ID header (or `since` parameter) if given,
+    else with the changes made from now on. A cursor that can no longer
+    be resumed from gets an `expired` event, after which the client syncs
+    from 0 and reconnects.
+    """
+    headers = {name.decode('latin-1'): value.decode('latin-1')
+               for name, value in scope['headers']}
+    user = await _authenticate(headers.get('authorization', ''))
+    if user is None:
+        return await _send_json(send, 401, {
+            'detail': 'Authentication credentials were not provided.'})
+    query = parse_qs(scope.get('query_string', b'').decode())
+    since = headers.get('last-event-id') or query.get('since', [None])[0]
+    try:
+        since = None if since is None else int(since)
+    except ValueError:
+        return await _send_json(send, 400, {
+            'since': ['A valid integer is required.']})
+
+    changed = broadcaster.subscribe(user.pk)
+    disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+    try:
+        if since is None:
+            since = await _current_version(user)
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream'),
+                                (b'cache-control', b'no-cache'),
+                                (b'x-accel-buffering', b'no')]})
+        await send({'type': 'http.response.body', 'body': b': connected\n\n',
+                    'more_body': True})
+        # Queried again only once notified of a change, or of a LISTEN
+        # connection lost or listening again (see core.events)
+        query = True
+        while not disconnected.done():
+            if not query:
+                waiting = asyncio.ensure_future(changed.wait())
+                done, _ = await asyncio.wait(
+                    [waiting, disconnected],
+                    timeout=settings.CHANGE_STREAM_HEARTBEAT,
+                    return_when=asyncio.FIRST_COMPLETED)
+                waiting.cancel()
+                if not done:
+                    # Keeps proxies from closing the idle connection
+                    await send({'type': 'http.response.body',
+                                'body': b': heartbeat\n\n',
+                                'more_body': True})
+                    broadcaster.listen()
+                query = changed.is_set()
+                continue
+            changed.clear()
+            try:
+                page = await _changes(user, since)
+            except CursorExpired as exc:
+                await send({'type': 'http.response.body',
+                            'body': _event('expired', {'detail': str(exc)})})
+                return
+            except UserMoved:
+                # Reconnecting routes the client to the user's new shard
+                await send({'type': 'http.response.body', 'body': b''})
+                return
+            if page['cursor'] != since:
+                since = page['cursor']
+                await send({'type': 'http.response.body',
+                            'body': _event('changes', page, since),
+                            'more_body': True})
+            query = page['more']
+    finally:
+        broadcaster.unsubscribe(user.pk, changed)
+        disconnected.cancel()
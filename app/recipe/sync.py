@@ -0,0 +1,76 @@
+"""
+Delta sync of a user's recipes, tags and ingredients
+"""
+from core.models import Ingredient, Recipe, SyncState, Tag, Tombstone
+from core.sharding import UserMoved
+from recipe.serializers import (IngredientSerializer,
+                                RecipeDetailSerializer,
+                                TagSerializer)
+
+
+# Response key, model and serializer of each synced kind of object
+KINDS = [
+    ('recipes', Recipe, RecipeDetailSerializer),
+    ('tags', Tag, TagSerializer),
+    ('ingredients', Ingredient, IngredientSerializer),
+]
+
+
+class CursorExpired(Exception):
+    """Raised for cursors the changes since can no longer be listed for"""
+
+
+def changes(user, since, limit, context):
+    """Return the user's objects changed and deleted after version `since`
+
+    Objects are returned in version order, at most `limit` of them. The
+    returned cursor is the version of the last one, `more` tells whether
+    further changes follow it. When nothing changed this is a single
+    primary key lookup of the user's change counter. Raises UserMoved if
+    the request was routed to a shard the user has left.
+    """
+    current, pruned, moved_to = SyncState.objects.filter(
+        user=user).values_list('version', 'pruned_version',
+                               'moved_to').first() or (0, 0, '')
+    if moved_to:
+        raise UserMoved()
+    # A full sync from 0 needs no tombstones.
+    if since > current or 0 < since < pruned:
+        raise CursorExpired('Sync cursor expired, sync again from 0.')
+
+    result = {'cursor': since, 'more': False}
+    result.update((key, []) for key, _, _ in KINDS)
+    result['deleted'] = {key: [] for key, _, _ in KINDS}
+    if since == current:
+        return result
+
+    # Every list is read up to `limit` + 1 rows, so the first `limit` of
+    # the merged lists are the first `limit` changes overall.
+    changed = []
+    versions = {'version__gt': since, 'version__lte': current}
+    for key, model, _ in KINDS:
+        queryset = model.objects.filter(user=user, **versions)
+        if model is Recipe:
+            queryset = queryset.prefetch_related('tags', 'ingredients')
+        changed += [(obj.version, key, obj)
+                    for obj in queryset.order_by('version')[:limit + 1]]
+    kind_keys = {model._meta.model_name: key for key, model, _ in KINDS}
+    tombstones = Tombstone.objects.filter(user=user, **versions)
+    changed += [(tombstone.version, None, tombstone)
+                for tombstone in tombstones.order_by('version')[:limit + 1]]
+
+    changed.sort(key=lambda change: change[0])
+    result['more'] = len(changed) > limit
+    changed = changed[:limit]
+    result['cursor'] = changed[-1][0] if result['more'] else current
+
+    objects = {key: [] for key, _, _ in KINDS}
+    for _, key, obj in changed:
+        if key is None:
+            result['deleted'][kind_keys[obj.model]].append(obj.object_id)
+        else:
+            objects[key].append(obj)
+    for key, _, serializer_class in KINDS:
+        result[key] = serializer_class(objects[key], many=True,
+                                       context=context).data
+    return result
@@ -12,8 +12,10 @@ from rest_framework import status
 from core.models import Ingredient, Recipe
 
 from recipe.serializers import IngredientSerializer
+from recipe.autocomplete import name_index_cache
 
 INGREDIENTS_LIST = reverse('recipe:ingredient-list')
+INGREDIENTS_AUTOCOMPLETE_URL = reverse('recipe:ingredient-autocomplete')
 
 
 def create_user(**params):
@@ -137,3 +139,19 @@ class PrivateIngredientsApiTests(TestCase):
         res = self.client.get(INGREDIENTS_LIST, {'assigned_only': 1})
 
         self.assertEqual(len(res.data), 1)
+
+    def test_autocomplete_ingredients(self):
+        """Test ingredient name suggestions and cache invalidation"""
+        name_index_cache.clear()
+        salt = Ingredient.objects.create(user=self.user, name='Salt')
+        Ingredient.objects.create(user=self.user, name='Pepper')
+
+        res = self.client.get(INGREDIENTS_AUTOCOMPLETE_URL, {'prefix': 'sa'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [{'id': salt.id, 'name': 'Salt'}])
+
+        salt.delete()
+        res = self.client.get(INGREDIENTS_AUTOCOMPLETE_URL, {'prefix': 'sa'})
+
+        self.assertEqual(res.data, [])
@@ -2,7 +2,11 @@
 Tests for recipe APIs
 """
 import tempfile
+import hashlib
 import os
+import io
+import shutil
+from unittest import mock
 
 from PIL import Image
 
@@ -10,12 +14,14 @@ from decimal import Decimal  # Used to ensure that the price field is a decimal
 
 from django.contrib.auth import get_user_model
 from django.urls import reverse
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework.test import APIClient
 from rest_framework import status
 
-from core.models import Recipe, Tag, Ingredient
+from core.models import Recipe, RecipeTag, SyncState, Tag, Ingredient
 
 from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
 
@@ -33,6 +39,14 @@ def image_upload_url(recipe_id):
     return reverse('recipe:recipe-upload-image', args=[recipe_id])
 
 
+BATCH_URL = reverse('recipe:recipe-batch')
+
+
+def image_url(recipe_id):
+    """Return URL for a recipe image rendition"""
+    return reverse('recipe:recipe-image', args=[recipe_id])
+
+
 def create_recipe(user, **params):
     """Helper function to create a recipe"""
     defaults = {
@@ -226,6 +240,23 @@ class PrivateRecipeApiTests(TestCase):
                 user=self.user, name=tag['name']).exists()
             self.assertTrue(exists)
 
+    def test_create_recipe_versions_each_object_once(self):
+        """Test creating a recipe with tags and ingredients takes one
+        version per object created"""
+        res = self.client.post(RECIPE_URL, {
+            'title': 'Sample recipe',
+            'time_minutes': 10,
+            'price': Decimal('4.99'),
+            'tags': [{'name': 'tag1'}, {'name': 'tag2'}],
+            'ingredients': [{'name': 'Salt'}],
+        }, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data['version'], 4)
+        self.assertEqual(SyncState.objects.get(user=self.user).version, 4)
+        self.assertEqual(len(res.data['tags']), 2)
+        self.assertEqual(len(res.data['ingredients']), 1)
+
     def test_create_recipe_with_existing_tags(self):
         """Test creating a new recipe with existing tags"""
         tag1 = Tag.objects.create(user=self.user, name='tag1')
@@ -253,6 +284,22 @@ class PrivateRecipeApiTests(TestCase):
             ).exists()
             self.assertTrue(exists)
 
+    def test_create_recipe_matches_tags_ignoring_case(self):
+        """Test tag names differing by case or spacing reuse one tag"""
+        tag = Tag.objects.create(user=self.user, name='Salt')
+        payload = {
+            'title': 'Chips',
+            'time_minutes': 10,
+            'price': Decimal('2.50'),
+            'tags': [{'name': 'salt '}, {'name': 'SALT'}],
+        }
+        res = self.client.post(RECIPE_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(id=res.data['id'])
+        self.assertEqual(list(recipe.tags.all()), [tag])
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 1)
+
     def test_create_tag_on_update(self):
         """Test creating tag on update of recipe"""
         recipe = create_recipe(user=self.user)
@@ -383,6 +430,63 @@ class PrivateRecipeApiTests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(recipe.ingredients.count(), 0)
 
+    def test_update_with_current_version(self):
+        """Test an update sending the version it read succeeds and
+        returns the new version"""
+        recipe = create_recipe(user=self.user)
+
+        res = self.client.patch(detail_url(recipe.id), {
+            'title': 'New title', 'version': recipe.version})
+
+        recipe.refresh_from_db()
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(recipe.title, 'New title')
+        self.assertEqual(res.data['version'], recipe.version)
+
+    def test_update_with_stale_version_conflicts(self):
+        """Test an update based on an outdated version is rejected and
+        changes nothing"""
+        recipe = create_recipe(user=self.user)
+        recipe.tags.add(Tag.objects.create(user=self.user, name='tag1'))
+        stale = recipe.version
+        recipe.refresh_from_db()
+        recipe.title = 'Concurrent edit'
+        recipe.save()
+
+        res = self.client.patch(detail_url(recipe.id), {
+            'title': 'Lost edit', 'tags': [], 'version': stale},
+            format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.title, 'Concurrent edit')
+        self.assertEqual(recipe.tags.count(), 1)
+
+    def test_update_writes_changed_columns_and_links_only(self):
+        """Test an update writes the changed columns and keeps the links
+        that stay"""
+        recipe = create_recipe(user=self.user, title='Old')
+        tag1 = Tag.objects.create(user=self.user, name='tag1')
+        recipe.tags.add(tag1, Tag.objects.create(user=self.user,
+                                                 name='tag2'))
+        kept = RecipeTag.objects.get(recipe=recipe, tag=tag1)
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.patch(detail_url(recipe.id), {
+                'title': 'New', 'description': recipe.description,
+                'tags': [{'name': 'tag1'}, {'name': 'tag3'}]},
+                format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        update, = [q['sql'] for q in queries.captured_queries
+                   if q['sql'].startswith('UPDATE "core_recipe"')]
+        self.assertIn('"title"', update)
+        self.assertNotIn('"description"', update)
+        self.assertEqual(
+            sorted(recipe.tags.values_list('name', flat=True)),
+            ['tag1', 'tag3'])
+        self.assertTrue(RecipeTag.objects.filter(pk=kept.pk).exists())
+
     def test_flter_by_tags(self):
         """Test filtering recipes by tags"""
         recipe1 = create_recipe(user=self.user, title='Recipe1')
@@ -427,6 +531,110 @@ class PrivateRecipeApiTests(TestCase):
         self.assertIn(serializer2.data, res.data)
         self.assertNotIn(serializer3.data, res.data)
 
+    def test_filter_by_price_and_time(self):
+        """Test filtering recipes by price range and cooking time"""
+        cheap = create_recipe(user=self.user, price=Decimal('4.00'),
+                              time_minutes=20)
+        create_recipe(user=self.user, price=Decimal('4.00'), time_minutes=45)
+        create_recipe(user=self.user, price=Decimal('12.00'),
+                      time_minutes=20)
+        create_recipe(user=self.user, price=Decimal('1.00'), time_minutes=20)
+
+        params = {'min_price': '2', 'max_price': '10', 'max_time': 30}
+        res = self.client.get(RECIPE_URL, params)
+
+        self.assertEqual([r['id'] for r in res.data], [cheap.id])
+
+    def test_filter_invalid_price(self):
+        """Test a price that is not a number is rejected"""
+        res = self.client.get(RECIPE_URL, {'max_price': 'cheap'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('max_price', res.data)
+
+    def test_ordering(self):
+        """Test ordering recipes, with the id breaking ties"""
+        recipe1 = create_recipe(user=self.user, price=Decimal('3.00'))
+        recipe2 = create_recipe(user=self.user, price=Decimal('1.00'))
+        recipe3 = create_recipe(user=self.user, price=Decimal('3.00'))
+
+        res = self.client.get(RECIPE_URL, {'ordering': 'price'})
+        self.assertEqual([r['id'] for r in res.data],
+                         [recipe2.id, recipe1.id, recipe3.id])
+
+        res = self.client.get(RECIPE_URL, {'ordering': '-price'})
+        self.assertEqual([r['id'] for r in res.data],
+                         [recipe3.id, recipe1.id, recipe2.id])
+
+    def test_ordering_invalid_field(self):
+        """Test ordering by a field without an index is rejected"""
+        res = self.client.get(RECIPE_URL, {'ordering': 'description'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cursor_pagination(self):
+        """Test paging through recipes ordered by a field with ties"""
+        prices = ['2.00', '1.00', '2.00', '2.00', '3.00']
+        recipes = [create_recipe(user=self.user, price=Decimal(price))
+                   for price in prices]
+        expected = [r.id for r in sorted(recipes,
+                                         key=lambda r: (-r.price, -r.id))]
+
+        ids = []
+        params = {'ordering': '-price', 'page_size': 2}
+        res = self.client.get(RECIPE_URL, params)
+        while True:
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(res.data['results']), 2)
+            ids += [r['id'] for r in res.data['results']]
+            if res.data['next'] is None:
+                break
+            res = self.client.get(res.data['next'])
+
+        self.assertEqual(ids, expected)
+
+    def test_cursor_pagination_invalid_cursor(self):
+        """Test a cursor that was not handed out is rejected"""
+        res = self.client.get(RECIPE_URL, {'page_size': 2,
+                                           'cursor': 'bogus'})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_batch_get_recipes(self):
+        """Test fetching recipes by ID in one request, with a query per
+        relation, reporting IDs of other users' recipes as missing"""
+        recipe1 = create_recipe(user=self.user)
+        recipe1.tags.add(Tag.objects.create(user=self.user, name='tag1'))
+        recipe2 = create_recipe(user=self.user)
+        recipe2.ingredients.add(
+            Ingredient.objects.create(user=self.user, name='ing1'))
+        other = get_user_model().objects.create_user(
+            'other@example.com', 'pass@123')
+        foreign = create_recipe(user=other)
+        ids = [recipe2.id, foreign.id, recipe1.id, recipe2.id]
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(BATCH_URL,
+                                  {'ids': ','.join(map(str, ids))})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['results'], [
+            {'id': recipe2.id, 'status': 200,
+             'data': RecipeDetailSerializer(recipe2).data},
+            {'id': foreign.id, 'status': 404, 'detail': 'Not found.'},
+            {'id': recipe1.id, 'status': 200,
+             'data': RecipeDetailSerializer(recipe1).data},
+        ])
+        self.assertEqual(len(queries), 3)
+
+    def test_batch_get_too_many_recipes(self):
+        """Test the number of IDs of a batch is capped"""
+        ids = ','.join(map(str, range(1, 102)))
+
+        res = self.client.get(BATCH_URL, {'ids': ids})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class ImageUploadTests(TestCase):
     """Tests for the image upload API"""
@@ -469,3 +677,152 @@ class ImageUploadTests(TestCase):
         res = self.client.post(url, payload, format='multipart')
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_upload_image_stored_by_content_hash(self):
+        """Test the upload is stored under the hash of its content"""
+        url = image_upload_url(self.recipe.id)
+        image_data = io.BytesIO()
+        Image.new('RGB', (10, 10)).save(image_data, format='PNG')
+        image_data.seek(0)
+        image_data.name = 'photo.png'
+        res = self.client.post(url, {'image': image_data},
+                               format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.recipe.refresh_from_db()
+        digest = hashlib.sha256(image_data.getvalue()).hexdigest()
+        self.assertEqual(self.recipe.image.name,
+                         f'uploads/recipe/{digest[:2]}/{digest}.png')
+
+    def test_upload_non_image_file(self):
+        """Test uploading a file that is not an image fails"""
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
+            image_file.write(b'not an image' * 100)
+            image_file.seek(0)
+            res = self.client.post(url, {'image': image_file},
+                                   format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(RECIPE_IMAGE_MAX_BYTES=1024)
+    def test_upload_image_too_large(self):
+        """Test uploads over the byte limit are rejected"""
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.bmp') as image_file:
+            Image.new('RGB', (100, 100)).save(image_file, format='BMP')
+            image_file.seek(0)
+            res = self.client.post(url, {'image': image_file},
+                                   format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image)
+
+    @override_settings(RECIPE_IMAGE_MAX_PIXELS=99)
+    def test_upload_image_too_many_pixels(self):
+        """Test images with too large dimensions are rejected"""
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
+            Image.new('RGB', (10, 10)).save(image_file, format='JPEG')
+            image_file.seek(0)
+            res = self.client.post(url, {'image': image_file},
+                                   format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ImageRenditionTests(TestCase):
+    """Tests for serving resized recipe images"""
+
+    def setUp(self):
+        self.rendition_root = tempfile.mkdtemp()
+        self.settings = override_settings(
+            IMAGE_RENDITION_ROOT=self.rendition_root)
+        self.settings.enable()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user5@example.com',
+            'test@123'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = create_recipe(user=self.user)
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
+            Image.new('RGB', (400, 200)).save(image_file, format='JPEG')
+            image_file.seek(0)
+            self.client.post(image_upload_url(self.recipe.id),
+                             {'image': image_file}, format='multipart')
+        self.recipe.refresh_from_db()
+
+    def tearDown(self):
+        self.recipe.image.delete()
+        self.settings.disable()
+        shutil.rmtree(self.rendition_root)
+
+    def test_get_resized_image(self):
+        """Test the image is resized and converted on request"""
+        res = self.client.get(image_url(self.recipe.id),
+                              {'width': 160, 'fmt': 'png'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'image/png')
+        self.assertIn('ETag', res)
+        img = Image.open(io.BytesIO(b''.join(res.streaming_content)))
+        self.assertEqual(img.size, (160, 80))
+
+    def test_get_image_not_modified(self):
+        """Test a matching If-None-Match returns 304"""
+        res = self.client.get(image_url(self.recipe.id), {'width': 160})
+        res.close()
+
+        res = self.client.get(image_url(self.recipe.id), {'width': 160},
+                              HTTP_IF_NONE_MATCH=res['ETag'])
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_get_image_range(self):
+        """Test a byte range of the rendition can be requested"""
+        res = self.client.get(image_url(self.recipe.id), {'width': 160},
+                              HTTP_RANGE='bytes=0-9')
+
+        self.assertEqual(res.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(len(b''.join(res.streaming_content)), 10)
+        self.assertTrue(res['Content-Range'].startswith('bytes 0-9/'))
+
+    def test_get_image_invalid_width(self):
+        """Test widths outside the configured set are rejected"""
+        res = self.client.get(image_url(self.recipe.id), {'width': 161})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_image_unreadable(self):
+        """Test an image that cannot be decoded is not found"""
+        with open(self.recipe.image.path, 'wb') as image_file:
+            image_file.write(b'not an image')
+
+        res = self.client.get(image_url(self.recipe.id), {'width': 160})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_rendition_cache_scanned_once(self):
+        """Test the size of the rendition cache is counted once and then
+        tracked, not counted again on every miss"""
+        with mock.patch('os.scandir', wraps=os.scandir) as scandir:
+            for width in (160, 320, 640):
+                self.client.get(image_url(self.recipe.id),
+                                {'width': width}).close()
+
+        scans = [call for call in scandir.call_args_list
+                 if call.args == (self.rendition_root,)]
+        self.assertEqual(len(scans), 1)
+
+    def test_get_image_evicts_old_renditions(self):
+        """Test the rendition cache stays within its size limit"""
+        with override_settings(IMAGE_RENDITION_CACHE_MAX_BYTES=1):
+            for width in (160, 320):
+                self.client.get(image_url(self.recipe.id),
+                                {'width': width}).close()
+
+        files = [f for _, _, names in os.walk(self.rendition_root)
+                 for f in names]
+        self.assertEqual(len(files), 1)
@@ -0,0 +1,170 @@
+"""
+Tests for the server-sent events stream of changes
+"""
+import json
+from decimal import Decimal
+from unittest.mock import patch
+
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import TransactionTestCase, override_settings
+
+from app.asgi import application
+from core.events import broadcaster
+from core.models import AuthToken, Recipe
+from recipe.sync import changes
+
+
+def create_user(**params):
+    """Helper function to create a new user"""
+    default_user = {
+        'email': 'user@example.com',
+        'password': 'user@1234',
+    }
+    default_user.update(params)
+    return get_user_model().objects.create_user(**default_user)
+
+
+def create_recipe(user, **params):
+    """Helper function to create a recipe"""
+    defaults = {
+        'title': 'Sample recipe',
+        'time_minutes': 10,
+        'price': Decimal('5.00'),
+    }
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+def parse_event(body):
+    """Return the fields of a server-sent event"""
+    fields = dict(line.split(': ', 1)
+                  for line in body.decode().strip().split('\n'))
+    fields['data'] = json.loads(fields['data'])
+    return fields
+
+
+class ChangeStreamTests(TransactionTestCase):
+    """Test streaming changes over ASGI
+
+    The stream queries from threads of its own, which only see committed
+    data.
+    """
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = create_user()
+        self.token = AuthToken.objects.get_or_rotate(self.user)
+
+    def connect(self, token=None, last_event_id=None):
+        headers = [(b'authorization',
+                    f'Token {token or self.token}'.encode())]
+        if last_event_id is not None:
+            headers.append((b'last-event-id', str(last_event_id).encode()))
+        return ApplicationCommunicator(application, {
+            'type': 'http',
+            'method': 'GET',
+            'path': settings.CHANGE_STREAM_PATH,
+            'query_string': b'',
+            'headers': headers,
+        })
+
+    async def start(self, stream):
+        await stream.send_input({'type': 'http.request'})
+        start = await stream.receive_output()
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'),
+                      start['headers'])
+        connected = await stream.receive_output()
+        self.assertEqual(connected['body'], b': connected\n\n')
+
+    async def close(self, stream):
+        await stream.send_input({'type': 'http.disconnect'})
+        await stream.wait()
+        self.assertNotIn(self.user.pk, broadcaster._waiters)
+
+    async def test_invalid_token(self):
+        """Test that the stream needs a valid token"""
+        stream = self.connect(token='invalid')
+        await stream.send_input({'type': 'http.request'})
+        start = await stream.receive_output()
+
+        self.assertEqual(start['status'], 401)
+
+    async def test_resume_from_last_event_id(self):
+        """Test that a reconnecting client gets the changes it missed"""
+        recipe = await sync_to_async(create_recipe)(self.user)
+
+        stream = self.connect(last_event_id=0)
+        await self.start(stream)
+        event = parse_event((await stream.receive_output())['body'])
+
+        self.assertEqual(event['event'], 'changes')
+        self.assertEqual(event['id'], str(recipe.version))
+        self.assertEqual(event['data']['cursor'], recipe.version)
+        self.assertEqual(event['data']['recipes'][0]['id'], recipe.id)
+        await self.close(stream)
+
+    async def test_changes_pushed(self):
+        """Test that changes are pushed once committed"""
+        stream = self.connect()
+        await self.start(stream)
+
+        # Idle, waiting for changes
+        self.assertTrue(await stream.receive_nothing())
+        recipe = await sync_to_async(create_recipe)(
+            self.user, title='Pushed')
+        event = parse_event((await stream.receive_output())['body'])
+
+        self.assertEqual(event['id'], str(recipe.version))
+        self.assertEqual([item['title'] for item in event['data']['recipes']],
+                         ['Pushed'])
+        await self.close(stream)
+
+    async def test_expired_cursor(self):
+        """Test that a cursor ahead of the user's changes ends the stream
+        with an expired event"""
+        stream = self.connect(last_event_id=5)
+        await self.start(stream)
+        message = await stream.receive_output()
+
+        self.assertEqual(parse_event(message['body'])['event'], 'expired')
+        self.assertFalse(message.get('more_body', False))
+        await stream.wait()
+
+    @override_settings(CHANGE_STREAM_HEARTBEAT=0.01)
+    async def test_heartbeat(self):
+        """Test that an idle stream sends keep-alive comments"""
+        stream = self.connect()
+        await self.start(stream)
+        message = await stream.receive_output()
+
+        self.assertEqual(message['body'], b': heartbeat\n\n')
+        await self.close(stream)
+
+    @override_settings(CHANGE_STREAM_HEARTBEAT=0.01)
+    async def test_idle_stream_not_queried(self):
+        """Test that an idle stream only queries again once notified"""
+        stream = self.connect()
+        with patch('recipe.stream.changes', wraps=changes) as query:
+            await self.start(stream)
+            for _ in range(3):
+                message = await stream.receive_output()
+                self.assertEqual(message['body'], b': heartbeat\n\n')
+            self.assertEqual(query.call_count, 1)
+
+            broadcaster.publish(self.user.pk)
+            await stream.receive_output()
+            self.assertEqual(query.call_count, 2)
+        await self.close(stream)
+
+    async def test_database_reconnected(self):
+        """Test each query of the stream starts on a usable connection"""
+        stream = self.connect(last_event_id=0)
+        with patch('recipe.stream.close_old_connections') as close:
+            await self.start(stream)
+            await self.close(stream)
+
+        self.assertGreaterEqual(close.call_count, 4)
@@ -0,0 +1,136 @@
+"""
+Tests for the delta sync API
+"""
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+from rest_framework import status
+
+from core.models import Recipe, Tag, Tombstone
+
+
+CHANGES_URL = reverse('recipe:changes')
+
+
+def create_user(**params):
+    """Helper function to create a new user"""
+    default_user = {
+        'email': 'user@example.com',
+        'password': 'user@1234',
+    }
+    default_user.update(params)
+    return get_user_model().objects.create_user(**default_user)
+
+
+def create_recipe(user, **params):
+    """Helper function to create a recipe"""
+    defaults = {
+        'title': 'Sample recipe',
+        'time_minutes': 10,
+        'price': Decimal('5.00'),
+    }
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class ChangesApiTests(TestCase):
+    """Test syncing changes since a cursor"""
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def sync(self, since):
+        res = self.client.get(CHANGES_URL, {'since': since})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res.data
+
+    def test_login_required(self):
+        """Test that login is required to sync"""
+        res = APIClient().get(CHANGES_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_changes_since_cursor(self):
+        """Test only objects changed after the cursor are returned"""
+        recipe = create_recipe(self.user)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        other = create_recipe(create_user(email='other@example.com'))
+        cursor = self.sync(0)['cursor']
+
+        recipe.tags.add(tag)
+        Tag.objects.create(user=self.user, name='Quick')
+        other.delete()
+        data = self.sync(cursor)
+
+        self.assertEqual([r['id'] for r in data['recipes']], [recipe.id])
+        self.assertEqual(data['recipes'][0]['tags'][0]['name'], 'Vegan')
+        self.assertEqual([t['name'] for t in data['tags']], ['Quick'])
+        self.assertFalse(data['more'])
+
+        with self.assertNumQueries(1):
+            unchanged = self.sync(data['cursor'])
+        self.assertEqual(unchanged['recipes'], [])
+        self.assertEqual(unchanged['cursor'], data['cursor'])
+
+    def test_deletes_return_tombstones(self):
+        """Test deleted objects are listed by id"""
+        recipe = create_recipe(self.user)
+        cursor = self.sync(0)['cursor']
+
+        recipe_id = recipe.id
+        recipe.delete()
+        data = self.sync(cursor)
+
+        self.assertEqual(data['recipes'], [])
+        self.assertEqual(data['deleted']['recipes'], [recipe_id])
+
+    def test_paginated_by_version(self):
+        """Test large change sets are returned in version order pages"""
+        with self.settings(SYNC_PAGE_SIZE=2):
+            recipes = [create_recipe(self.user) for _ in range(3)]
+            Tag.objects.create(user=self.user, name='Vegan')
+
+            first = self.sync(0)
+            second = self.sync(first['cursor'])
+
+        self.assertTrue(first['more'])
+        self.assertEqual([r['id'] for r in first['recipes']],
+                         [recipes[0].id, recipes[1].id])
+        self.assertFalse(second['more'])
+        self.assertEqual([r['id'] for r in second['recipes']],
+                         [recipes[2].id])
+        self.assertEqual(len(second['tags']), 1)
+
+    def test_purged_tombstones_expire_old_cursors(self):
+        """Test cursors older than purged tombstones must resync"""
+        recipe = create_recipe(self.user)
+        cursor = self.sync(0)['cursor']
+        recipe.delete()
+        Tombstone.objects.update(
+            deleted_at=timezone.now() - timedelta(days=365))
+
+        call_command('purge_tombstones', stdout=StringIO())
+        res = self.client.get(CHANGES_URL, {'since': cursor})
+
+        self.assertEqual(res.status_code, status.HTTP_410_GONE)
+        self.assertFalse(Tombstone.objects.exists())
+        self.sync(0)
+
+    def test_user_deletion_leaves_no_tombstones(self):
+        """Test deleting a user does not record tombstones"""
+        create_recipe(self.user)
+
+        self.user.delete()
+
+        self.assertFalse(Tombstone.objects.exists())
@@ -2,7 +2,7 @@
 Tests for the tags API.
 """
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 
@@ -12,8 +12,10 @@ from rest_framework import status
 from core.models import Tag, Recipe
 
 from recipe.serializers import TagSerializer
+from recipe.autocomplete import name_index_cache
 
 TAGS_URL = reverse('recipe:tag-list')
+TAGS_AUTOCOMPLETE_URL = reverse('recipe:tag-autocomplete')
 
 
 def detail_url(tag_id):
@@ -92,6 +94,17 @@ class PrivateTagsApiTests(TestCase):
         tag.refresh_from_db()
         self.assertEqual(tag.name, payload['name'])
 
+    def test_update_tag_name_clash(self):
+        """Test renaming a tag to another tag's name fails"""
+        Tag.objects.create(user=self.user, name='Vegan')
+        tag = Tag.objects.create(user=self.user, name='Veg')
+
+        res = self.client.patch(detail_url(tag.id), {'name': 'VEGAN'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        tag.refresh_from_db()
+        self.assertEqual(tag.name, 'Veg')
+
     def test_delete_tag(self):
         """Test deleting a tag"""
         tag = Tag.objects.create(user=self.user, name='Veg')
@@ -145,3 +158,66 @@ class PrivateTagsApiTests(TestCase):
         res = self.client.get(TAGS_URL, {'assigned_only': 1})
 
         self.assertEqual(len(res.data), 1)
+
+
+class TagAutocompleteApiTests(TestCase):
+    """Test the tag autocomplete endpoint"""
+
+    def setUp(self):
+        name_index_cache.clear()
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_autocomplete_prefix(self):
+        """Test suggestions match the prefix case-insensitively"""
+        tag1 = Tag.objects.create(user=self.user, name='Vegan')
+        tag2 = Tag.objects.create(user=self.user, name='vegetarian')
+        Tag.objects.create(user=self.user, name='Dessert')
+
+        res = self.client.get(TAGS_AUTOCOMPLETE_URL, {'prefix': 'VEG'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [
+            {'id': tag1.id, 'name': 'Vegan'},
+            {'id': tag2.id, 'name': 'vegetarian'},
+        ])
+
+    def test_autocomplete_limited_to_user(self):
+        """Test suggestions only include the authenticated user's tags"""
+        user2 = create_user(email='user2@example.com')
+        Tag.objects.create(user=user2, name='Veg')
+
+        res = self.client.get(TAGS_AUTOCOMPLETE_URL, {'prefix': 'veg'})
+
+        self.assertEqual(res.data, [])
+
+    def test_autocomplete_limit(self):
+        """Test the number of suggestions is capped by `limit`"""
+        for name in ['Veg1', 'Veg2', 'Veg3']:
+            Tag.objects.create(user=self.user, name=name)
+
+        res = self.client.get(TAGS_AUTOCOMPLETE_URL,
+                              {'prefix': 'veg', 'limit': 2})
+
+        self.assertEqual([tag['name'] for tag in res.data], ['Veg1', 'Veg2'])
+
+    def test_autocomplete_sees_new_tags(self):
+        """Test creating a tag invalidates the cached name index"""
+        self.client.get(TAGS_AUTOCOMPLETE_URL, {'prefix': 'veg'})
+        Tag.objects.create(user=self.user, name='Veg')
+
+        res = self.client.get(TAGS_AUTOCOMPLETE_URL, {'prefix': 'veg'})
+
+        self.assertEqual(len(res.data), 1)
+
+    @override_settings(AUTOCOMPLETE_INDEX_MAX_SIZE=1)
+    def test_autocomplete_large_vocabulary(self):
+        """Test large vocabularies are searched in the database"""
+        Tag.objects.create(user=self.user, name='Veg')
+        Tag.objects.create(user=self.user, name='Vegan')
+        Tag.objects.create(user=self.user, name='Keto')
+
+        res = self.client.get(TAGS_AUTOCOMPLETE_URL, {'prefix': 'veg'})
+
+        self.assertEqual([tag['name'] for tag in res.data], ['Veg', 'Vegan'])
@@ -0,0 +1,119 @@
+"""
+Streaming, size-bounded upload handling for recipe images
+"""
+import hashlib
+import io
+import os
+import tempfile
+
+from PIL import Image, UnidentifiedImageError
+
+from django.conf import settings
+from django.core.files.uploadedfile import (TemporaryUploadedFile,
+                                            UploadedFile)
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http.multipartparser import MultiPartParserError
+
+from core.models import RECIPE_IMAGE_DIR
+from core.storage import recipe_image_storage
+
+
+# Largest image header read while streaming, JPEG files can carry tens of
+# kilobytes of EXIF data before the frame header with the dimensions.
+HEADER_MAX_BYTES = 256 * 1024
+
+# Multipart framing and form fields sent alongside the image.
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class ImageUploadError(MultiPartParserError):
+    """Raised to abort an upload exceeding the image limits"""
+
+
+def inspect_image(fileobj):
+    """Return (width, height, format) from the image header without
+    decoding the pixel data, or None if it is not a supported image.
+
+    Raises ImageUploadError for images with too many pixels.
+    """
+    try:
+        with Image.open(fileobj) as img:
+            width, height = img.size
+            image_format = img.format
+    except Image.DecompressionBombError:
+        raise ImageUploadError('Image dimensions are too large.')
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        return None
+
+    if width * height > settings.RECIPE_IMAGE_MAX_PIXELS:
+        raise ImageUploadError('Image dimensions are too large.')
+    return width, height, image_format
+
+
+class StagedUploadedFile(TemporaryUploadedFile):
+    """Temporary upload created inside the recipe image storage so saving
+    it is a rename instead of a copy"""
+
+    def __init__(self, name, content_type, size, charset,
+                 content_type_extra=None):
+        directory = recipe_image_storage.path(RECIPE_IMAGE_DIR)
+        os.makedirs(directory, exist_ok=True)
+        _, ext = os.path.splitext(name)
+        file = tempfile.NamedTemporaryFile(suffix='.upload' + ext,
+                                           dir=directory)
+        UploadedFile.__init__(self, file, name, content_type, size, charset,
+                              content_type_extra)
+        self.sha256 = None
+        self.image_info = None
+
+
+class RecipeImageUploadHandler(TemporaryFileUploadHandler):
+    """Upload handler for recipe images
+
+    Rejects uploads over RECIPE_IMAGE_MAX_BYTES as soon as that many bytes
+    have been received, checks the dimensions in the image header before
+    the rest of the file arrives and hashes the content on the way so the
+    storage does not need to read it again.
+    """
+
+    def handle_raw_input(self, input_data, META, content_length, boundary,
+                         encoding=None):
+        limit = settings.RECIPE_IMAGE_MAX_BYTES + MULTIPART_OVERHEAD
+        if content_length and content_length > limit:
+            raise ImageUploadError('Image file is too large.')
+
+    def new_file(self, *args, **kwargs):
+        super(TemporaryFileUploadHandler, self).new_file(*args, **kwargs)
+        self.file = StagedUploadedFile(
+            self.file_name, self.content_type, 0, self.charset,
+            self.content_type_extra
+        )
+        self.digest = hashlib.sha256()
+        self.header = bytearray()
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.RECIPE_IMAGE_MAX_BYTES:
+            raise ImageUploadError('Image file is too large.')
+
+        if self.header is not None:
+            self.header += raw_data[:HEADER_MAX_BYTES - len(self.header)]
+            self._inspect_header(complete=False)
+
+        self.digest.update(raw_data)
+        self.file.write(raw_data)
+
+    def _inspect_header(self, complete):
+        """Read the dimensions once enough of the header has arrived"""
+        info = inspect_image(io.BytesIO(self.header))
+        if info is not None or complete or \
+                len(self.header) >= HEADER_MAX_BYTES:
+            self.file.image_info = info
+            self.header = None
+
+    def file_complete(self, file_size):
+        if self.header is not None:
+            self._inspect_header(complete=True)
+        self.file.sha256 = self.digest.hexdigest()
+        return super().file_complete(file_size)
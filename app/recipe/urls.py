@@ -15,5 +15,6 @@ router.register('ingredients', views.IngredientViewset)
 app_name = 'recipe'
 
 urlpatterns = [
+    path('changes/', views.ChangesView.as_view(), name='changes'),
     path('', include(router.urls)),
 ]
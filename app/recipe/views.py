@@ -7,13 +7,32 @@ from drf_spectacular.utils import (extend_schema,
                                    OpenApiParameter)
 
 
-from rest_framework import viewsets, status
+from rest_framework import viewsets, status, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.views import APIView
 
-from core.models import Recipe, Tag, Ingredient
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import Exists, OuterRef
+
+from core.authentication import ExpiringTokenAuthentication
+from core.idempotency import IDEMPOTENCY_KEY_PARAMETER, idempotent
+from core.models import (Recipe,
+                         RecipeIngredient,
+                         RecipeTag,
+                         Tag,
+                         Ingredient)
+from core.throttling import UploadRateThrottle
+from recipe.autocomplete import autocomplete
+from recipe.images import (RenditionError,
+                           UnreadableImage,
+                           get_rendition,
+                           rendition_response)
+from recipe.sync import CursorExpired, changes
+from recipe.pagination import KeysetPagination
+from recipe.uploads import RecipeImageUploadHandler
 from recipe.serializers import (
     RecipeSerializer,
     RecipeDetailSerializer, TagSerializer,
@@ -22,6 +41,10 @@ from recipe.serializers import (
 )
 
 
+# Each backed by a (user, field, id) index, see Recipe.Meta
+RECIPE_ORDERING_FIELDS = ['id', 'price', 'time_minutes', 'title']
+
+
 @extend_schema_view(
     list=extend_schema(
         parameters=[
@@ -34,58 +57,170 @@ from recipe.serializers import (
                 'ingredients',
                 OpenApiTypes.STR,
                 description='Comma separated list of ingredient IDs to filter',
-            )
+            ),
+            OpenApiParameter(
+                'min_price',
+                OpenApiTypes.DECIMAL,
+                description='Only recipes costing at least this much',
+            ),
+            OpenApiParameter(
+                'max_price',
+                OpenApiTypes.DECIMAL,
+                description='Only recipes costing at most this much',
+            ),
+            OpenApiParameter(
+                'max_time',
+                OpenApiTypes.INT,
+                description='Only recipes taking at most this many minutes',
+            ),
+            OpenApiParameter(
+                'ordering',
+                OpenApiTypes.STR,
+                enum=[f'{direction}{field}'
+                      for field in RECIPE_ORDERING_FIELDS
+                      for direction in ('', '-')],
+                description='Field to order by, - for descending, '
+                            'newest first by default',
+            ),
         ]
+    ),
+    create=extend_schema(parameters=[IDEMPOTENCY_KEY_PARAMETER]),
+    upload_image=extend_schema(parameters=[IDEMPOTENCY_KEY_PARAMETER]),
+    batch=extend_schema(
+        parameters=[
+            OpenApiParameter(
+                'ids',
+                OpenApiTypes.STR,
+                required=True,
+                description='Comma separated list of up to '
+                            f'{settings.RECIPE_BATCH_MAX_IDS} recipe IDs',
+            )
+        ],
+        responses={200: OpenApiTypes.OBJECT}
+    ),
+    image=extend_schema(
+        parameters=[
+            OpenApiParameter(
+                'width',
+                OpenApiTypes.INT,
+                description='Rendition width in pixels',
+            ),
+            OpenApiParameter(
+                'fmt',
+                OpenApiTypes.STR,
+                enum=['jpeg', 'png', 'webp'],
+                description='Rendition image format',
+            )
+        ],
+        responses={(200, 'image/*'): OpenApiTypes.BINARY}
     )
 )
 class RecipeViewset(viewsets.ModelViewSet):
     """Manage recipes in the database"""
     serializer_class = RecipeDetailSerializer
     queryset = Recipe.objects.all()
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [ExpiringTokenAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def _parameters_to_ints(self, query_string):
         """Split query_string by comma and convert each string ID to integer"""
         # query_string = '1,2,3'
         return [int(str_id) for str_id in query_string.split(',')]
 
+    def _parameter(self, name, field):
+        """Return query parameter `name` converted by serializer `field`,
+        None if it is not given"""
+        value = self.request.query_params.get(name)
+        if value is None:
+            return None
+        try:
+            return field.to_internal_value(value)
+        except serializers.ValidationError as exc:
+            raise serializers.ValidationError({name: exc.detail})
+
+    def _ordering(self):
+        """Return the order_by() fields the `ordering` parameter asks for,
+        ending with the id so the order is total"""
+        ordering = self.request.query_params.get('ordering', '-id')
+        field = ordering.lstrip('-')
+        if field not in RECIPE_ORDERING_FIELDS or \
+                len(ordering) - len(field) > 1:
+            raise serializers.ValidationError({'ordering': [
+                f'Order by one of {", ".join(RECIPE_ORDERING_FIELDS)}.']})
+        if field == 'id':
+            return [ordering]
+        return [ordering, '-id' if ordering.startswith('-') else 'id']
+
     def get_queryset(self):
         """Retrieve the recipes for the authenticated user"""
         tags = self.request.query_params.get('tags', None)
         ingredients = self.request.query_params.get('ingredients', None)
+        user = self.request.user
         queryset = self.queryset
 
+        # The links are filtered by user too, so a partitioned link table
+        # is only read in the user's partition.
         if tags:
             tag_ids = self._parameters_to_ints(tags)
-            queryset = queryset.filter(tags__id__in=tag_ids)
+            queryset = queryset.filter(id__in=RecipeTag.objects.filter(
+                user=user, tag_id__in=tag_ids).values('recipe_id'))
 
         if ingredients:
             ingredient_ids = self._parameters_to_ints(ingredients)
-            queryset = queryset.filter(
-                ingredients__id__in=ingredient_ids
-            )
+            queryset = queryset.filter(id__in=RecipeIngredient.objects.filter(
+                user=user, ingredient_id__in=ingredient_ids
+            ).values('recipe_id'))
+
+        price = serializers.DecimalField(max_digits=5, decimal_places=2)
+        min_price = self._parameter('min_price', price)
+        if min_price is not None:
+            queryset = queryset.filter(price__gte=min_price)
+        max_price = self._parameter('max_price', price)
+        if max_price is not None:
+            queryset = queryset.filter(price__lte=max_price)
+        max_time = self._parameter('max_time', serializers.IntegerField())
+        if max_time is not None:
+            queryset = queryset.filter(time_minutes__lte=max_time)
+
         queryset = queryset.filter(
-            user=self.request.user
-        ).order_by('-id').distinct()
+            user=user
+        ).order_by(*self._ordering())
         return queryset
 
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.action == 'upload_image':
+            # Must be set before request.data is first accessed, which
+            # @idempotent does to hash the upload
+            request.upload_handlers = [RecipeImageUploadHandler(request)]
+
     # Override the get_serializer_class method to return
     # the appropriate serializer class based on the action being performed
     def get_serializer_class(self):
         """Return appropriate serializer class"""
         if self.action == 'list':
             return RecipeSerializer
+        elif self.action == 'batch':
+            return RecipeDetailSerializer
         elif self.action == 'upload_image':
             return RecipeImageUploadSerializer
         return self.serializer_class
 
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        """Create a recipe, once per Idempotency-Key"""
+        return super().create(request, *args, **kwargs)
+
     # perform_create method runs before the serializer.save() on post requests
     def perform_create(self, serializer):
         """Create a new recipe"""
         serializer.save(user=self.request.user)
 
-    @action(methods=['POST'], detail=True, url_path='upload-image')
+    # Throttled before the request body is read
+    @action(methods=['POST'], detail=True, url_path='upload-image',
+            throttle_classes=[UploadRateThrottle])
+    @idempotent
     def upload_image(self, request, pk=None):
         """Upload an image to a recipe."""
         # Get the recipe object
@@ -104,6 +239,67 @@ class RecipeViewset(viewsets.ModelViewSet):
             return Response(serializer.errors,
                             status=status.HTTP_400_BAD_REQUEST)
 
+    @action(methods=['GET'], detail=False)
+    def batch(self, request):
+        """Return the details of the recipes in `ids`, in that order, each
+        with its status, 404 for IDs that are not the user's recipes."""
+        try:
+            ids = list(dict.fromkeys(
+                self._parameters_to_ints(request.query_params['ids'])))
+        except (KeyError, ValueError):
+            return Response(
+                {'ids': ['A comma separated list of IDs is required.']},
+                status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > settings.RECIPE_BATCH_MAX_IDS:
+            return Response(
+                {'ids': [f'At most {settings.RECIPE_BATCH_MAX_IDS} IDs '
+                         f'are allowed.']},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        # One query for the recipes and one per relation
+        recipes = Recipe.objects.filter(
+            user=request.user, id__in=ids
+        ).prefetch_related('tags', 'ingredients').in_bulk()
+        results = []
+        for pk in ids:
+            recipe = recipes.get(pk)
+            if recipe is None:
+                results.append({'id': pk, 'status': 404,
+                                'detail': 'Not found.'})
+                continue
+            # The owner is the request user, no need to query it.
+            recipe.user = request.user
+            results.append({'id': pk, 'status': 200,
+                            'data': self.get_serializer(recipe).data})
+        return Response({'results': results})
+
+    @action(methods=['GET'], detail=True, url_path='image')
+    def image(self, request, pk=None):
+        """Serve the recipe image resized to `width` in format `fmt`."""
+        recipe = self.get_object()
+        if not recipe.image:
+            return Response({'detail': 'Recipe has no image.'},
+                            status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            width = int(request.query_params.get(
+                'width', settings.IMAGE_RENDITION_WIDTHS[-1]))
+        except ValueError:
+            return Response({'width': ['A valid integer is required.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        fmt = request.query_params.get('fmt', 'jpeg')
+
+        try:
+            path, key = get_rendition(recipe.image.path, width, fmt)
+        except RenditionError as exc:
+            return Response({'detail': str(exc)},
+                            status=status.HTTP_400_BAD_REQUEST)
+        except UnreadableImage:
+            return Response({'detail': 'Recipe image cannot be read.'},
+                            status=status.HTTP_404_NOT_FOUND)
+
+        return rendition_response(request, path, key, fmt)
+
 
 @extend_schema_view(
     list=extend_schema(
@@ -115,6 +311,20 @@ class RecipeViewset(viewsets.ModelViewSet):
                 description='Filter by items assigned to recipes',
             )
         ]
+    ),
+    autocomplete=extend_schema(
+        parameters=[
+            OpenApiParameter(
+                'prefix',
+                OpenApiTypes.STR,
+                description='Case-insensitive name prefix to complete',
+            ),
+            OpenApiParameter(
+                'limit',
+                OpenApiTypes.INT,
+                description='Maximum number of suggestions to return',
+            )
+        ]
     )
 )
 class BaseRecipeAttrViewSet(viewsets.ModelViewSet):
@@ -122,7 +332,7 @@ class BaseRecipeAttrViewSet(viewsets.ModelViewSet):
         I use this for both ingredients and tags
         to avoid duplicating code
     """
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [ExpiringTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
@@ -133,15 +343,50 @@ class BaseRecipeAttrViewSet(viewsets.ModelViewSet):
         queryset = self.queryset
 
         if assigned_only:
-            queryset = queryset.filter(recipe__isnull=False)
+            rel = queryset.model._meta.get_field('recipe')
+            queryset = queryset.filter(Exists(rel.through.objects.filter(
+                user=self.request.user,
+                **{rel.field.m2m_reverse_field_name(): OuterRef('pk')}
+            )))
 
         return queryset.filter(
             user=self.request.user
-        ).order_by('-name').distinct()
+        ).order_by('-name')
 
     def perform_create(self, serializer):
         """ Create a new ingredient """
-        serializer.save(user=self.request.user)
+        self._save_unique_name(serializer, user=self.request.user)
+
+    def perform_update(self, serializer):
+        """ Rename an ingredient or tag """
+        self._save_unique_name(serializer)
+
+    def _save_unique_name(self, serializer, **kwargs):
+        """ Save, reporting a name clash with another object as a
+            validation error instead of a database error """
+        try:
+            with transaction.atomic():
+                serializer.save(**kwargs)
+        except IntegrityError:
+            raise serializers.ValidationError(
+                {'name': ['An item with this name already exists.']}
+            )
+
+    @action(methods=['GET'], detail=False)
+    def autocomplete(self, request):
+        """ Suggest names starting with the `prefix` query parameter """
+        prefix = request.query_params.get('prefix', '')
+        try:
+            limit = int(request.query_params.get(
+                'limit', settings.AUTOCOMPLETE_DEFAULT_LIMIT))
+        except ValueError:
+            return Response({'limit': ['A valid integer is required.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, settings.AUTOCOMPLETE_MAX_LIMIT))
+
+        matches = autocomplete(self.queryset.model, request.user,
+                               prefix, limit)
+        return Response([{'id': pk, 'name': name} for pk, name in matches])
 
 
 class TagViewset(BaseRecipeAttrViewSet):
@@ -154,3 +399,34 @@ class IngredientViewset(BaseRecipeAttrViewSet):
     """ Manage ingredients in the database """
     serializer_class = IngredientSerializer
     queryset = Ingredient.objects.all()
+
+
+class ChangesView(APIView):
+    """ Recipes, tags and ingredients changed since a sync cursor """
+    authentication_classes = [ExpiringTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                'since',
+                OpenApiTypes.INT,
+                description='Cursor returned by the previous sync, '
+                            '0 for everything',
+            )
+        ],
+        responses={200: OpenApiTypes.OBJECT, 410: OpenApiTypes.OBJECT}
+    )
+    def get(self, request):
+        """ List changes after `since`, 410 if it must sync from 0 """
+        try:
+            since = int(request.query_params.get('since', 0))
+        except ValueError:
+            return Response({'since': ['A valid integer is required.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            data = changes(request.user, since, settings.SYNC_PAGE_SIZE,
+                           {'request': request})
+        except CursorExpired as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_410_GONE)
+        return Response(data)
@@ -1,16 +1,27 @@
 """
 Tests for the Users API
 """
-from django.test import TestCase
+import pickle
+from datetime import timedelta
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
+from django.utils import timezone
 
 from rest_framework.test import APIClient
 from rest_framework import status
 
+from core.authentication import token_cache_key
+from core.models import AccountDeletion, AuthToken
+
 CREATE_USER_URL = reverse('user:create')
 TOKEN_URL = reverse('user:token')
 ME_URL = reverse('user:me')
+TOKEN_ROTATE_URL = reverse('user:token-rotate')
 
 
 def create_user(**params):
@@ -167,3 +178,132 @@ class TestAuthenticatedUserApiTests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(self.user.name, payload['name'])
         self.assertTrue(self.user.check_password(payload['password']))
+
+    def test_delete_user_deactivates_and_queues_deletion(self):
+        """Test deleting the account deactivates the user at once and
+        leaves the deletion to the background worker"""
+        res = self.client.delete(ME_URL)
+
+        self.user.refresh_from_db()
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertFalse(self.user.is_active)
+        self.assertTrue(AccountDeletion.objects.filter(
+            user=self.user, finished__isnull=True).exists())
+
+
+class TokenLifecycleTests(TestCase):
+    """Test expiry, rotation and revocation of API tokens"""
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = create_user(
+            email="test@example.com",
+            password="test@123",
+            name="Test User"
+        )
+        self.token = AuthToken.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def expire(self, token):
+        AuthToken.objects.filter(key=token.key).update(
+            created=timezone.now() - timedelta(days=365))
+
+    def test_login_returns_existing_token(self):
+        """Test logging in again returns the same unexpired token"""
+        res = self.client.post(TOKEN_URL, {
+            'email': 'test@example.com',
+            'password': 'test@123'
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['token'], self.token.key)
+        self.assertIn('expires', res.data)
+
+    def test_login_replaces_expired_token(self):
+        """Test logging in with an expired token issues a new one"""
+        self.expire(self.token)
+
+        res = self.client.post(TOKEN_URL, {
+            'email': 'test@example.com',
+            'password': 'test@123'
+        })
+
+        self.assertNotEqual(res.data['token'], self.token.key)
+        self.assertFalse(AuthToken.objects.filter(key=self.token.key).exists())
+
+    def test_expired_token_rejected(self):
+        """Test expired tokens do not authenticate"""
+        self.expire(self.token)
+
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_rotate_token(self):
+        """Test rotating replaces the token and revokes the old one"""
+        self.client.get(ME_URL)  # cache the token
+
+        res = self.client.post(TOKEN_ROTATE_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res.data['token'], self.token.key)
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_revoked_token_rejected(self):
+        """Test revoked tokens stop authenticating immediately"""
+        self.client.get(ME_URL)  # cache the token
+
+        AuthToken.objects.revoke(user_id__in=[self.user.id])
+
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_cached_token_leaves_out_password(self):
+        """Test the token cache holds no password hash, and a user loaded
+        from it can still be updated"""
+        self.client.get(ME_URL)  # cache the token
+
+        cached = pickle.dumps(cache.get(token_cache_key(self.token.key)))
+        self.assertNotIn(self.user.password.encode(), cached)
+        res = self.client.patch(ME_URL, {'name': 'New Name'})
+        self.assertEqual(res.data['name'], 'New Name')
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('test@123'))
+
+    def test_last_used_throttled(self):
+        """Test last_used is written at most once per interval"""
+        self.client.get(ME_URL)
+        self.token.refresh_from_db()
+        first_use = self.token.last_used
+
+        self.client.get(ME_URL)
+
+        self.token.refresh_from_db()
+        self.assertIsNotNone(first_use)
+        self.assertEqual(self.token.last_used, first_use)
+
+    @override_settings(AUTH_TOKEN_LAST_USED_INTERVAL=0)
+    def test_last_used_updated(self):
+        """Test last_used is refreshed once the interval has passed"""
+        self.client.get(ME_URL)
+        self.token.refresh_from_db()
+        first_use = self.token.last_used
+
+        self.client.get(ME_URL)
+
+        self.token.refresh_from_db()
+        self.assertGreater(self.token.last_used, first_use)
+
+    def test_purge_expired_tokens(self):
+        """Test the purge command deletes expired tokens only"""
+        other = AuthToken.objects.create(user=create_user(
+            email='other@example.com', password='test@123'))
+        self.expire(other)
+
+        call_command('purge_expired_tokens', '--batch-size', '1',
+                     stdout=StringIO())
+
+        self.assertTrue(AuthToken.objects.filter(key=self.token.key).exists())
+        self.assertFalse(AuthToken.objects.filter(key=other.key).exists())
@@ -1,26 +1,74 @@
 """
 views for user api
 """
-from rest_framework import generics, permissions, authentication
+from drf_spectacular.utils import extend_schema, OpenApiTypes
+from rest_framework import generics, permissions, status
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
-
+from core.authentication import ExpiringTokenAuthentication
+from core.idempotency import IDEMPOTENCY_KEY_PARAMETER, idempotent
+from core.models import AccountDeletion, AuthToken
+from core.throttling import LoginRateThrottle, SignupRateThrottle
 from user.serializers import UserSerializer, AuthTokenSerializer
 
+
+def token_response(token):
+    """Response describing an API token"""
+    return Response({'token': token.key, 'expires': token.expires})
+
+
 class CreateUserView(generics.CreateAPIView):
     """Create a new user in the system"""
     serializer_class = UserSerializer
+    # A stale token sent along must not fail the signup
+    authentication_classes = []
+    throttle_classes = [SignupRateThrottle]
+
+    @extend_schema(parameters=[IDEMPOTENCY_KEY_PARAMETER])
+    @idempotent
+    def post(self, request, *args, **kwargs):
+        """Create a user, once per Idempotency-Key"""
+        return super().post(request, *args, **kwargs)
 
 class CreateTokenView(ObtainAuthToken):
     """Create a new auth token for user"""
     serializer_class = AuthTokenSerializer
+    # Clients log in again with their expired token still set
+    authentication_classes = []
+    throttle_classes = [LoginRateThrottle]
 
-class ManageUserView(generics.RetrieveUpdateAPIView):
+    def post(self, request, *args, **kwargs):
+        """Return the user's token, issuing a new one if it expired"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data['user']
+        return token_response(AuthToken.objects.get_or_rotate(user))
+
+class RotateTokenView(APIView):
+    """Replace the authenticated user's token with a new one"""
+    authentication_classes = [ExpiringTokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    @extend_schema(request=None, responses={200: OpenApiTypes.OBJECT})
+    def post(self, request):
+        """Revoke the current token and return its replacement"""
+        return token_response(AuthToken.objects.rotate(request.user))
+
+class ManageUserView(generics.RetrieveUpdateDestroyAPIView):
     """Manage the authenticated user"""
     serializer_class = UserSerializer
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [ExpiringTokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self):
         """Retrieve and return authenticated user"""
-        return self.request.user
\ No newline at end of file
+        return self.request.user
+
+    @extend_schema(responses={202: None})
+    def delete(self, request, *args, **kwargs):
+        """Deactivate the user now and delete the account in the
+        background, see core.deletion"""
+        AccountDeletion.objects.enqueue(request.user)
+        return Response(status=status.HTTP_202_ACCEPTED)
@@ -0,0 +1,28 @@
+#!/bin/sh
+
+set -e
+
+python manage.py wait_for_db
+python manage.py collectstatic --noinput
+python manage.py migrate
+for shard in $(echo "${DB_SHARDS:-}" | tr ',' ' '); do
+    python manage.py migrate --database "$shard"
+done
+python manage.py build_schema
+
+# Workers write their metrics here for /metrics to add up, start empty so
+# totals of a previous container run are not counted
+export METRICS_DIR="${METRICS_DIR:-/dev/shm/metrics}"
+rm -rf "$METRICS_DIR"
+mkdir -p "$METRICS_DIR"
+
+# exec, so gunicorn receives the container's signals (TERM drains workers).
+# The API runs on gthread workers with persistent connections. With
+# SERVER_ROLE=stream the container serves the change stream instead:
+# app.asgi on uvicorn workers, which the proxy routes CHANGE_STREAM_PATH
+# to, see recipe.stream.
+if [ "${SERVER_ROLE:-api}" = stream ]; then
+    export GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker
+    exec gunicorn app.asgi:application
+fi
+exec gunicorn app.wsgi